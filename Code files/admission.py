@@ -0,0 +1,214 @@
+"""
+GreenClassify - Admission Control
+Load shedding and per-client rate limits in front of /predict
+
+A request is turned away before any upload parsing or inference when:
+  - ADMISSION_MAX_IN_FLIGHT requests are already running     -> 503 + Retry-After
+  - the estimated wait (in flight x recent service time /
+    ADMISSION_CONCURRENCY) exceeds ADMISSION_LATENCY_BUDGET  -> 503 + Retry-After
+  - the client has run out of tokens in its bucket          -> 429 + Retry-After
+
+A shed request does not use up one of the client's tokens. Model work runs
+inside model_call(), which lets ADMISSION_CONCURRENCY requests at a time
+into the model. The service time is an EWMA of the time requests spend in
+there once let in. Their whole duration would also include waiting behind
+the others, which the estimate already counts through the in-flight number.
+
+Usage in app.py:
+    import admission
+    admission.init_app(app)
+    ...
+    with admission.model_call():
+        probs, stage = cascade.classify(img)
+
+An endpoint that only sometimes runs the model (an upload chunk that may
+finish the file) is listed in ADMISSION_ENDPOINTS but registered with
+defer(); its view calls admit() at the point it knows it needs the model.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from flask import Blueprint, Flask, Response, g, has_request_context, jsonify, request
+
+import config
+import tracing
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.tokens = burst
+        self.burst = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume one token; returns 0 on success or seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.service_time = config.ADMISSION_INITIAL_SERVICE_TIME  # EWMA, seconds
+        self.model_slots = threading.Semaphore(config.ADMISSION_CONCURRENCY)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.counters: Dict[str, int] = {
+            'admitted': 0, 'completed': 0, 'rate_limited': 0,
+            'shed_queue_full': 0, 'shed_latency_budget': 0,
+        }
+
+    def _bucket(self, client: str) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(config.RATE_LIMIT_PER_SECOND, config.RATE_LIMIT_BURST)
+            self._buckets[client] = bucket
+            # Bound memory: forget the least recently seen clients
+            if len(self._buckets) > config.RATE_LIMIT_MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def try_admit(self, client: str) -> Tuple[Optional[int], Optional[str], float]:
+        """(None, None, 0) if admitted, else (HTTP status, reason, seconds to retry after)"""
+        with self._lock:
+            if self.in_flight >= config.ADMISSION_MAX_IN_FLIGHT:
+                self.counters['shed_queue_full'] += 1
+                return 503, 'queue_full', self._drain_time()
+
+            expected_wait = self.in_flight * self.service_time / config.ADMISSION_CONCURRENCY
+            if expected_wait > config.ADMISSION_LATENCY_BUDGET:
+                self.counters['shed_latency_budget'] += 1
+                return 503, 'latency_budget', self._drain_time()
+
+            # Only requests that would be served spend a token
+            if config.RATE_LIMIT_PER_SECOND > 0:
+                wait = self._bucket(client).take()
+                if wait > 0:
+                    self.counters['rate_limited'] += 1
+                    return 429, 'rate_limited', wait
+
+            self.in_flight += 1
+            self.counters['admitted'] += 1
+            return None, None, 0.0
+
+    def release(self, service_time: Optional[float]):
+        """Mark an admitted request finished and fold its model time (if it used the model) into the EWMA"""
+        with self._lock:
+            self.in_flight -= 1
+            self.counters['completed'] += 1
+            if service_time is not None:
+                alpha = config.ADMISSION_EWMA_ALPHA
+                self.service_time = (1 - alpha) * self.service_time + alpha * service_time
+
+    def _drain_time(self) -> float:
+        return self.in_flight * self.service_time / config.ADMISSION_CONCURRENCY
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self.counters)
+            metrics.update(in_flight=self.in_flight,
+                           service_time_ms=round(self.service_time * 1000, 2),
+                           tracked_clients=len(self._buckets))
+        shed = metrics['shed_queue_full'] + metrics['shed_latency_budget'] + metrics['rate_limited']
+        total = shed + metrics['admitted']
+        metrics['shed_rate'] = shed / total if total else 0.0
+        return metrics
+
+
+# ==================== Flask Integration ==================== #
+admission_bp = Blueprint('admission', __name__)
+_controller: Optional[AdmissionController] = None
+_deferred = set()
+
+
+def _client_id() -> str:
+    if config.RATE_LIMIT_TRUST_FORWARDED and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+
+def _reject(status: int, reason: str, retry_after: float) -> Response:
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify(error=reason)
+    else:
+        message = "Too many requests" if status == 429 else "Server busy"
+        response = Response(f"{message}, please retry shortly.", mimetype='text/plain')
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admit() -> Optional[Response]:
+    """Admit the current request now: None, or the 429/503 response to return instead"""
+    if _controller is None or request.endpoint not in config.ADMISSION_ENDPOINTS or 'admitted_at' in g:
+        return None
+    status, reason, retry_after = _controller.try_admit(_client_id())
+    if status is not None:
+        return _reject(status, reason, retry_after)
+    g.admitted_at = time.perf_counter()
+    return None
+
+
+def defer(endpoint: str):
+    """Let an endpoint's view call admit() itself, once it knows it will use the model"""
+    _deferred.add(endpoint)
+
+
+def _before_request():
+    if request.endpoint in _deferred:
+        return None
+    return admit()
+
+
+def _teardown_request(exc):
+    admitted_at = g.pop('admitted_at', None)
+    if admitted_at is not None:
+        _controller.release(g.pop('model_seconds', None))
+
+
+@contextmanager
+def model_call():
+    """Run model work in one of ADMISSION_CONCURRENCY slots and time it for the service time
+
+    The wait for a slot is recorded as the request's 'queue' span.
+    """
+    if _controller is None:
+        yield
+        return
+    with tracing.span('queue'):
+        _controller.model_slots.acquire()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _controller.model_slots.release()
+        if has_request_context() and 'admitted_at' in g:
+            g.model_seconds = g.get('model_seconds', 0.0) + time.perf_counter() - start
+
+
+@admission_bp.route('/metrics/admission')
+def admission_metrics():
+    return jsonify(_controller.metrics())
+
+
+def init_app(app: Flask) -> AdmissionController:
+    """Install the admission hooks and the metrics endpoint"""
+    global _controller
+    _controller = AdmissionController()
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(admission_bp)
+    return _controller
@@ -0,0 +1,355 @@
+"""
+GreenClassify - CPU Inference Autotuner
+Sweeps thread, worker, batch and oneDNN settings against the real model
+
+TensorFlow sizes its intra-op pool to all cores by default, so N worker
+processes each start a pool that large and fight over the same cores. The
+sweep measures the real model on this host for every combination of:
+
+    workers            processes running inference at the same time
+    intra/inter-op     TensorFlow thread pools per worker (plus the default)
+    oneDNN             TF_ENABLE_ONEDNN_OPTS on/off (and BF16 math with --bf16)
+    batch size         images per forward pass
+
+Each combination starts its workers as fresh processes (thread pools and
+oneDNN are fixed when TensorFlow initializes), lets them run together for
+--duration seconds per batch size and records host throughput and p50/p95
+latency per forward pass. Every setting also classifies a probe batch of
+real images (AUTOTUNE_PROBE_DIR); the fastest setting whose p95 latency
+stays within AUTOTUNE_MAX_LATENCY_MS and whose probabilities stay within
+AUTOTUNE_PROB_TOLERANCE of the reference setting (oneDNN off) is written to
+CPU_PROFILE_PATH together with the whole measured curve.
+
+At startup the app loads the profile (load_profile / init_app), which sets
+the TensorFlow thread counts and oneDNN options before the model is loaded
+and uses the batch size as STREAM_MAX_BATCH. A profile measured on another
+CPU count, inference backend or model version is ignored with a warning.
+The worker count is for the process manager, e.g. `gunicorn -w 4 app:app`;
+`show` prints it.
+
+Usage:
+    python autotune.py sweep                               # defaults for this host
+    python autotune.py sweep --workers 1,2,4 --batch-sizes 1,8,32 --duration 3 --bf16
+    python autotune.py sweep --probe-dir data/validation/Tomato
+    python autotune.py show
+
+Usage in app.py (before anything loads the model):
+    import autotune
+    autotune.init_app(app)
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+from flask import Flask
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+ONEDNN_MODES = ('on', 'off', 'bf16')
+
+
+# ==================== Settings ==================== #
+def apply_settings(settings: dict):
+    """Point config and the environment at a tuned setting (before TensorFlow loads)"""
+    if settings.get('onednn') in ONEDNN_MODES:
+        if 'tensorflow' in sys.modules:
+            logger.warning("TensorFlow is already loaded; oneDNN setting '%s' takes effect on restart",
+                           settings['onednn'])
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0' if settings['onednn'] == 'off' else '1'
+        if settings['onednn'] == 'bf16':
+            os.environ['ONEDNN_DEFAULT_FPMATH_MODE'] = 'BF16'
+        else:
+            os.environ.pop('ONEDNN_DEFAULT_FPMATH_MODE', None)
+    config.TF_INTRA_OP_THREADS = settings.get('intra_op_threads', 0)
+    config.TF_INTER_OP_THREADS = settings.get('inter_op_threads', 0)
+    if settings.get('batch_size'):
+        config.STREAM_MAX_BATCH = settings['batch_size']
+
+
+def load_profile(path: str = config.CPU_PROFILE_PATH) -> Optional[dict]:
+    """Apply the tuned settings saved by `sweep`, if they were measured on this host, backend and model"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    if profile['host']['cpu_count'] != os.cpu_count():
+        logger.warning("Ignoring %s: tuned for %d CPUs, this host has %d; run `python autotune.py sweep`",
+                       path, profile['host']['cpu_count'], os.cpu_count())
+        return None
+    if profile.get('backend') != config.INFERENCE_BACKEND:
+        logger.warning("Ignoring %s: tuned for the %s backend, INFERENCE_BACKEND is %s; "
+                       "run `python autotune.py sweep`", path, profile.get('backend'), config.INFERENCE_BACKEND)
+        return None
+    import inference
+    if profile.get('model_version') != inference.model_version():
+        logger.warning("Ignoring %s: tuned for model %s, the current model is %s; run `python autotune.py sweep`",
+                       path, profile.get('model_version'), inference.model_version())
+        return None
+    apply_settings(profile['settings'])
+    return profile
+
+
+def init_app(app: Flask) -> Optional[dict]:
+    profile = load_profile()
+    if profile is not None:
+        app.extensions['cpu_profile'] = profile
+        logger.info("Loaded CPU profile: %s", profile['settings'])
+    return profile
+
+
+# ==================== Benchmark Worker ==================== #
+def probe_batch(directory: str = config.AUTOTUNE_PROBE_DIR, count: int = 16) -> np.ndarray:
+    """Model inputs for up to count real images in directory, random pixels if it has none"""
+    import preprocessing
+
+    inputs = []
+    names = sorted(os.listdir(directory)) if directory and os.path.isdir(directory) else []
+    for name in names:
+        if len(inputs) == count:
+            break
+        if not preprocessing.allowed_file(name):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                inputs.append(preprocessing.prepare_input(preprocessing.load_upload(f, name)))
+        except (OSError, preprocessing.UploadError):
+            continue
+    if inputs:
+        return np.concatenate(inputs)
+    logger.warning("No images in %s; checking agreement on random pixels", directory)
+    height, width = config.IMAGE_TARGET_SIZE
+    return np.random.default_rng(0).random((count, height, width, 3), dtype=np.float32)
+
+
+def _bench_worker(settings: dict, batch_sizes: List[int], duration: float, probe: np.ndarray,
+                  barrier, results):
+    """Runs in a fresh process: load the model with these settings and time it"""
+    try:
+        # Only the CPU is measured, even on a host that has a GPU
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+        apply_settings(settings)
+        import inference
+
+        height, width = config.IMAGE_TARGET_SIZE
+        rng = np.random.default_rng(0)
+        probs = np.asarray(inference.predict(probe), dtype=np.float32)
+
+        runs = []
+        for batch_size in batch_sizes:
+            batch = rng.random((batch_size, height, width, 3), dtype=np.float32)
+            for _ in range(3):
+                inference.predict(batch)
+            # All workers measure the same batch size at the same time
+            barrier.wait(timeout=600)
+            latencies = []
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                inference.predict(batch)
+                latencies.append(time.perf_counter() - start)
+            runs.append({'batch_size': batch_size, 'latencies': latencies})
+        results.put({'probs': probs, 'runs': runs})
+    except Exception as e:  # report instead of leaving the others at the barrier
+        barrier.abort()
+        results.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def measure(settings: dict, batch_sizes: List[int], duration: float, probe: np.ndarray) -> dict:
+    """Throughput and latency per batch size for one setting, all workers running together"""
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(settings['workers'])
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_bench_worker, args=(settings, batch_sizes, duration, probe, barrier, results))
+             for _ in range(settings['workers'])]
+    for p in procs:
+        p.start()
+    try:
+        outputs = [results.get(timeout=900) for _ in procs]
+    except queue.Empty:
+        outputs = [{'error': "a worker process died without reporting"}]
+        for p in procs:
+            p.terminate()
+    for p in procs:
+        p.join()
+
+    # The worker that failed first explains it; the others only saw the barrier break
+    errors = sorted((o['error'] for o in outputs if 'error' in o), key=lambda e: e.startswith('BrokenBarrier'))
+    if errors:
+        return {'settings': settings, 'error': errors[0]}
+    curve = []
+    for i, batch_size in enumerate(batch_sizes):
+        latencies = np.concatenate([o['runs'][i]['latencies'] for o in outputs]) * 1000
+        calls = len(latencies)
+        curve.append({
+            'batch_size': batch_size,
+            'images_per_second': round(calls * batch_size / duration, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        })
+    return {'settings': settings, 'probs': outputs[0]['probs'], 'curve': curve}
+
+
+# ==================== Sweep ==================== #
+def candidate_settings(workers_list: List[int], bf16: bool) -> List[dict]:
+    """Every thread/worker/oneDNN combination worth measuring on this host"""
+    cores = os.cpu_count() or 1
+    if config.INFERENCE_BACKEND != 'keras':
+        # Thread pools and oneDNN are TensorFlow settings; only workers and batch apply
+        return [{'workers': w, 'intra_op_threads': 0, 'inter_op_threads': 0, 'onednn': None}
+                for w in workers_list]
+
+    onednn_modes = ['on', 'off'] + (['bf16'] if bf16 else [])
+    candidates = []
+    for onednn in onednn_modes:
+        for workers in workers_list:
+            per_worker = max(1, cores // workers)
+            # TensorFlow's defaults first, as the baseline the sweep is meant to beat
+            threads = [(0, 0)] + [(intra, inter) for intra in sorted({per_worker, max(1, per_worker // 2)})
+                                  for inter in (1, 2)]
+            candidates += [{'workers': workers, 'intra_op_threads': intra, 'inter_op_threads': inter,
+                            'onednn': onednn} for intra, inter in threads]
+    return candidates
+
+
+def pick_best(results: List[dict], max_latency_ms: float,
+              tolerance: float = config.AUTOTUNE_PROB_TOLERANCE) -> Optional[dict]:
+    """Highest throughput within the latency limit, among settings that agree with the reference"""
+    valid = [r for r in results if 'error' not in r]
+    if not valid:
+        return None
+    reference = next((r['probs'] for r in valid if r['settings']['onednn'] in ('off', None)), valid[0]['probs'])
+    options = []
+    for r in valid:
+        # BF16 math or a broken build can change answers; those settings are not eligible.
+        # Thread counts reorder float sums, so small differences are expected and allowed
+        r['max_prob_diff'] = round(float(np.max(np.abs(r['probs'] - reference))), 4)
+        if r['max_prob_diff'] <= tolerance:
+            options += [{'settings': dict(r['settings'], batch_size=point['batch_size']), 'measured': point}
+                        for point in r['curve']]
+    if not options:
+        return None
+    within = [o for o in options if o['measured']['p95_ms'] <= max_latency_ms]
+    if within:
+        return max(within, key=lambda o: o['measured']['images_per_second'])
+    logger.warning("No setting met %.0f ms p95; picked the lowest-latency one", max_latency_ms)
+    return min(options, key=lambda o: o['measured']['p95_ms'])
+
+
+def _label(settings: dict) -> str:
+    threads = 'default' if not settings['intra_op_threads'] else \
+        f"{settings['intra_op_threads']}/{settings['inter_op_threads']}"
+    return f"{settings['onednn'] or '-':>6} {settings['workers']:>7} {threads:>9}"
+
+
+def print_report(results: List[dict], best: Optional[dict]):
+    print(f"\n{'oneDNN':>6} {'workers':>7} {'intra/inter':>9} {'batch':>6} {'img/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in results:
+        if 'error' in r:
+            print(f"{_label(r['settings'])}  failed: {r['error']}")
+            continue
+        diff = r.get('max_prob_diff', 0.0)
+        for point in r['curve']:
+            note = ''
+            if best is not None and best['settings'] == dict(r['settings'], batch_size=point['batch_size']):
+                note = '  * best'
+            elif diff > config.AUTOTUNE_PROB_TOLERANCE:
+                note = f'  probabilities differ by {diff:.4f}'
+            print(f"{_label(r['settings'])} {point['batch_size']:>6} {point['images_per_second']:>9.1f} "
+                  f"{point['p50_ms']:>9.2f} {point['p95_ms']:>9.2f}{note}")
+
+
+def sweep(workers_list: List[int], batch_sizes: List[int], duration: float, max_latency_ms: float,
+          bf16: bool, output: str, probe_dir: str = config.AUTOTUNE_PROBE_DIR):
+    candidates = candidate_settings(workers_list, bf16)
+    probe = probe_batch(probe_dir)
+    estimate = len(candidates) * (len(batch_sizes) * (duration + 1) + 5)
+    print(f"Measuring {len(candidates)} settings x {len(batch_sizes)} batch sizes on {os.cpu_count()} CPUs "
+          f"(about {estimate / 60:.1f} min)")
+
+    results = []
+    for i, settings in enumerate(candidates, 1):
+        print(f"[{i}/{len(candidates)}] {_label(settings)}", flush=True)
+        results.append(measure(settings, batch_sizes, duration, probe))
+
+    best = pick_best(results, max_latency_ms)
+    print_report(results, best)
+    if best is None:
+        print("\nEvery setting failed; no profile written.")
+        return
+
+    import inference
+    profile = {
+        'host': {'cpu_count': os.cpu_count(), 'machine': platform.machine(),
+                 'processor': platform.processor(), 'python': platform.python_version()},
+        'backend': config.INFERENCE_BACKEND,
+        'model_version': inference.model_version(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'max_latency_ms': max_latency_ms,
+        'settings': best['settings'],
+        'measured': best['measured'],
+        'results': [{k: v for k, v in r.items() if k != 'probs'} for r in results],
+    }
+    with open(output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"\nBest: {best['settings']} -> {best['measured']['images_per_second']} img/s, "
+          f"p95 {best['measured']['p95_ms']} ms")
+    print(f"Saved {output}; run the app with {best['settings']['workers']} worker process(es).")
+
+
+def show(path: str):
+    if not os.path.exists(path):
+        print(f"No profile at {path}; run `python autotune.py sweep`")
+        return
+    with open(path) as f:
+        profile = json.load(f)
+    settings, measured = profile['settings'], profile['measured']
+    print(f"Tuned {profile['created']} on {profile['host']['cpu_count']} CPUs "
+          f"({profile['backend']} backend, model {profile['model_version']})")
+    for key, value in settings.items():
+        print(f"  {key:<17} {value}")
+    print(f"  measured          {measured['images_per_second']} img/s, p50 {measured['p50_ms']} ms, "
+          f"p95 {measured['p95_ms']} ms")
+    print(f"Start the app with {settings['workers']} worker(s), e.g. gunicorn -w {settings['workers']} app:app")
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(',')]
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 1
+    default_workers = ','.join(str(2 ** i) for i in range(cores.bit_length()) if 2 ** i <= cores)
+
+    parser = argparse.ArgumentParser(description="CPU inference autotuner")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sweep_cmd = sub.add_parser('sweep', help="Measure settings on this host and save the best")
+    sweep_cmd.add_argument('--workers', type=_int_list, default=_int_list(default_workers))
+    sweep_cmd.add_argument('--batch-sizes', type=_int_list, default=[1, 4, 16, 32])
+    sweep_cmd.add_argument('--duration', type=float, default=3.0, help="Seconds per batch size")
+    sweep_cmd.add_argument('--max-latency-ms', type=float, default=config.AUTOTUNE_MAX_LATENCY_MS)
+    sweep_cmd.add_argument('--bf16', action='store_true', help="Also try oneDNN BF16 math (AVX512-BF16/AMX CPUs)")
+    sweep_cmd.add_argument('--output', default=config.CPU_PROFILE_PATH)
+    sweep_cmd.add_argument('--probe-dir', default=config.AUTOTUNE_PROBE_DIR,
+                           help="Folder of real images used to check each setting's answers")
+    show_cmd = sub.add_parser('show', help="Print the saved profile")
+    show_cmd.add_argument('--profile', default=config.CPU_PROFILE_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'sweep':
+        sweep(args.workers, args.batch_sizes, args.duration, args.max_latency_ms, args.bf16, args.output,
+              args.probe_dir)
+    else:
+        show(args.profile)
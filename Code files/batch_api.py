@@ -0,0 +1,102 @@
+"""
+GreenClassify - Batch Prediction API
+JSON endpoint classifying several uploaded images in one forward pass
+
+POST /predict/batch with one or more multipart 'files' fields returns
+
+    {"model_version": "3f9c0a1b2d4e",
+     "results": [{"filename": "a.jpg", "vegetable": "Tomato", "confidence": 97.12},
+                 {"filename": "b.txt", "error": "Unsupported file type. ..."}]}
+
+with one result per file, in upload order. Results are cached in the shared
+store under the file's content hash, so repeats are answered without the
+model on any node; with PHASH_ENABLED, re-encoded copies of an image already
+classified by this model version are answered from the near-duplicate index.
+Every classified file is recorded in the prediction history, as /predict and
+resumable uploads do. This is the endpoint the greenclassify_client SDK calls.
+
+Usage in app.py:
+    import batch_api
+    batch_api.init_app(app)
+"""
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify, request
+
+import admission
+import config
+import explain
+import history_store
+import inference
+import near_duplicates
+import preprocessing
+import shared_store
+import similarity_index
+
+
+batch_bp = Blueprint('batch_api', __name__)
+
+
+@batch_bp.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify(error="No files uploaded"), 400
+    if len(files) > config.BATCH_MAX_IMAGES:
+        return jsonify(error=f"At most {config.BATCH_MAX_IMAGES} images per request"), 413
+
+    model_version = inference.model_version()
+    results, inputs, pending = [], [], []
+    for file in files:
+        digest = preprocessing.content_hash(file.stream)
+        # Any node may already have classified these exact bytes
+        cached = shared_store.get_result(digest, model_version)
+        if cached is not None:
+            results.append(dict(cached, filename=file.filename, cached=True))
+            history_store.record(cached['vegetable'], cached['confidence'], content_hash=digest,
+                                 filename=file.filename, model_version=model_version)
+            continue
+        try:
+            img = preprocessing.load_upload(file.stream, file.filename)
+        except preprocessing.UploadError as e:
+            results.append({'filename': file.filename, 'error': str(e)})
+            continue
+        phash = near_duplicates.compute(img) if near_duplicates.enabled() else None
+        match = near_duplicates.lookup(phash, model_version)
+        if match and not near_duplicates.should_verify():
+            result = {'vegetable': match.label, 'confidence': round(match.confidence, 2)}
+            shared_store.put_result(digest, model_version, result)
+            results.append(dict(result, filename=file.filename, near_duplicate=True))
+            history_store.record(result['vegetable'], result['confidence'], content_hash=digest,
+                                 filename=file.filename, model_version=model_version)
+            continue
+        pending.append((len(results), digest, phash, match))
+        results.append({'filename': file.filename})
+        inputs.append(preprocessing.prepare_input(img))
+        explain.remember_input(digest, inputs[-1])
+
+    if inputs:
+        with admission.model_call():
+            probs, embeddings = similarity_index.predict(np.concatenate(inputs))
+        for i, ((position, digest, phash, match), row) in enumerate(zip(pending, probs)):
+            vegetable, confidence = inference.top_prediction(row)
+            result = {'vegetable': vegetable, 'confidence': round(confidence, 2)}
+            shared_store.put_result(digest, model_version, result)
+            if match:
+                near_duplicates.verify(match, vegetable)
+            near_duplicates.add(phash, vegetable, confidence, model_version)
+            results[position].update(result)
+            history_store.record(vegetable, result['confidence'], content_hash=digest,
+                                 filename=results[position]['filename'], model_version=model_version)
+            if embeddings is not None:
+                similarity_index.index_embedding(digest, embeddings[i])
+                if config.EMIT_EMBEDDINGS:
+                    results[position]['embedding'] = embeddings[i].tolist()
+
+    return jsonify(model_version=model_version, results=results)
+
+
+def init_app(app: Flask):
+    """Register /predict/batch if BATCH_PREDICTION is enabled"""
+    if config.BATCH_PREDICTION:
+        app.register_blueprint(batch_bp)
@@ -0,0 +1,187 @@
+"""
+GreenClassify - Model Cascade
+Answer easy images with a small student model, escalate the rest
+
+The student (train_student.py) sees a STUDENT_IMAGE_SIZE copy of the upload.
+If its top probability reaches CASCADE_CONFIDENCE_THRESHOLD its answer is
+returned; otherwise the image is classified by vegetable_classifier.h5 as
+before. Without a student model file every request goes to the full model.
+
+Usage in app.py:
+    import cascade
+    cascade.init_app(app)
+    probs, stage = cascade.classify(img)       # stage is 'student' or 'full'
+
+    python cascade.py evaluate --dir data/validation --thresholds 0.8,0.9,0.95
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify
+from PIL import Image
+
+import config
+import inference
+from preprocessing import prepare_input
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+
+_lock = threading.Lock()
+_student: Optional['tf.keras.Model'] = None
+_student_missing = False
+
+
+def get_student_model() -> Optional['tf.keras.Model']:
+    """Load the student once; None if it has not been trained"""
+    global _student, _student_missing
+    if _student is not None or _student_missing:
+        return _student
+    with _lock:
+        if _student is None and not _student_missing:
+            if os.path.exists(config.STUDENT_MODEL_PATH):
+                # TensorFlow is imported only once there is a student to run
+                import tensorflow as tf
+                _student = tf.keras.models.load_model(config.STUDENT_MODEL_PATH)
+            else:
+                _student_missing = True
+        return _student
+
+
+class CascadeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.escalated = 0
+        self.student_seconds = 0.0
+        self.full_seconds = 0.0
+
+    def record(self, student_seconds: float, full_seconds: Optional[float]):
+        with self._lock:
+            self.requests += 1
+            self.student_seconds += student_seconds
+            if full_seconds is not None:
+                self.escalated += 1
+                self.full_seconds += full_seconds
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            requests, escalated = self.requests, self.escalated
+            student, full = self.student_seconds, self.full_seconds
+        return {
+            'enabled': config.CASCADE_ENABLED and get_student_model() is not None,
+            'threshold': config.CASCADE_CONFIDENCE_THRESHOLD,
+            'requests': requests,
+            'escalated': escalated,
+            'escalation_rate': escalated / requests if requests else 0.0,
+            'avg_latency_ms': round((student + full) / requests * 1000, 2) if requests else 0.0,
+            'avg_student_ms': round(student / requests * 1000, 2) if requests else 0.0,
+            'avg_full_ms': round(full / escalated * 1000, 2) if escalated else 0.0,
+        }
+
+
+stats = CascadeStats()
+
+
+def classify(img: Image.Image) -> Tuple[np.ndarray, str]:
+    """Class probabilities for one RGB image and the stage that produced them"""
+    student = get_student_model() if config.CASCADE_ENABLED else None
+    student_seconds = 0.0
+    if student is not None:
+        start = time.perf_counter()
+        probs = np.asarray(student.predict_on_batch(prepare_input(img, config.STUDENT_IMAGE_SIZE)))[0]
+        student_seconds = time.perf_counter() - start
+        if probs.max() >= config.CASCADE_CONFIDENCE_THRESHOLD:
+            stats.record(student_seconds, None)
+            return probs, 'student'
+
+    start = time.perf_counter()
+    probs = np.asarray(inference.predict(prepare_input(img)))[0]
+    stats.record(student_seconds, time.perf_counter() - start)
+    return probs, 'full'
+
+
+# ==================== Flask Integration ==================== #
+cascade_bp = Blueprint('cascade', __name__)
+
+
+@cascade_bp.route('/metrics/cascade')
+def cascade_metrics():
+    return jsonify(stats.metrics())
+
+
+def init_app(app: Flask):
+    """Register the metrics endpoint and load the student ahead of the first request"""
+    if config.CASCADE_ENABLED:
+        get_student_model()
+    app.register_blueprint(cascade_bp)
+
+
+# ==================== Offline Evaluation ==================== #
+def _timed(model: 'tf.keras.Model', img: Image.Image, size: Tuple[int, int]) -> Tuple[np.ndarray, float]:
+    """Probabilities and seconds spent, resize included, for one image"""
+    start = time.perf_counter()
+    probs = np.asarray(model.predict_on_batch(prepare_input(img, size)))[0]
+    return probs, time.perf_counter() - start
+
+
+def evaluate(directory: str, thresholds: List[float], limit: Optional[int] = None):
+    """Escalation rate, accuracy and mean latency per threshold on a labelled split"""
+    import training
+
+    student = get_student_model()
+    if student is None:
+        raise SystemExit(f"No student model at {config.STUDENT_MODEL_PATH}; run train_student.py first")
+    full = inference.get_model()
+    paths, labels, _ = training.list_images(directory)
+    if limit:
+        paths, labels = paths[:limit], labels[:limit]
+
+    # Run both models on every image once; each threshold is then a replay
+    records = []
+    for i, (path, label) in enumerate(zip(paths, labels)):
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            if i == 0:  # warm up both graphs
+                _timed(student, img, config.STUDENT_IMAGE_SIZE)
+                _timed(full, img, config.IMAGE_TARGET_SIZE)
+            student_probs, student_seconds = _timed(student, img, config.STUDENT_IMAGE_SIZE)
+            full_probs, full_seconds = _timed(full, img, config.IMAGE_TARGET_SIZE)
+        records.append((label, student_probs, student_seconds, full_probs, full_seconds))
+
+    labels_arr = np.array([r[0] for r in records])
+    student_conf = np.array([r[1].max() for r in records])
+    student_pred = np.array([r[1].argmax() for r in records])
+    full_pred = np.array([r[3].argmax() for r in records])
+    student_t = np.array([r[2] for r in records])
+    full_t = np.array([r[4] for r in records])
+
+    print(f"{len(records)} images from {directory}")
+    print(f"Full model only:   accuracy {np.mean(full_pred == labels_arr):.4f}  "
+          f"mean latency {full_t.mean() * 1000:7.2f} ms")
+    print(f"Student only:      accuracy {np.mean(student_pred == labels_arr):.4f}  "
+          f"mean latency {student_t.mean() * 1000:7.2f} ms")
+    print(f"\n{'threshold':>9} {'escalated':>10} {'accuracy':>9} {'mean ms':>9} {'speedup':>8}")
+    for threshold in thresholds:
+        escalate = student_conf < threshold
+        predictions = np.where(escalate, full_pred, student_pred)
+        latency = student_t + escalate * full_t
+        print(f"{threshold:>9.2f} {escalate.mean():>9.1%} {np.mean(predictions == labels_arr):>9.4f} "
+              f"{latency.mean() * 1000:>9.2f} {full_t.mean() / latency.mean():>7.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Student/full model cascade")
+    sub = parser.add_subparsers(dest='command', required=True)
+    ev = sub.add_parser('evaluate', help="Escalation rate and latency per confidence threshold")
+    ev.add_argument('--dir', required=True, help="Labelled class-per-folder split")
+    ev.add_argument('--thresholds', default=f"0.5,0.7,0.8,{config.CASCADE_CONFIDENCE_THRESHOLD},0.95")
+    ev.add_argument('--limit', type=int, help="Evaluate only the first N images")
+    args = parser.parse_args()
+    evaluate(args.dir, sorted({float(t) for t in args.thresholds.split(',')}), args.limit)
@@ -13,14 +13,60 @@ PORT = 5000
 MAX_FILE_SIZE_MB = 16  # Maximum file size in MB
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+MAX_IMAGE_PIXELS = 40 * 1000 * 1000  # Reject decompression bombs
 UPLOAD_FOLDER = 'uploads'
 
+# Thumbnails (shown on the results page instead of the original)
+THUMBNAIL_MAX_EDGE = 800  # 2x the 400px the results page shows, sharp on HiDPI screens
+THUMBNAIL_FORMAT = 'WEBP'  # Falls back to JPEG if Pillow lacks WebP support
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_SUFFIX = '_thumb'
+
+# Client-Side Resize (static/js/main.js)
+CLIENT_RESIZE_ENABLED = True  # Shrink photos in the browser before upload
+CLIENT_RESIZE_MAX_EDGE = 512  # Longest edge in pixels after resizing
+CLIENT_RESIZE_QUALITY = 0.9  # JPEG re-encode quality (0-1)
+
+# Resumable Uploads (chunked upload sessions, static/js/main.js)
+RESUMABLE_UPLOADS = True
+UPLOAD_SESSION_FOLDER = 'upload_sessions'  # Partial uploads and session state
+UPLOAD_CHUNK_SIZE = 256 * 1024  # Bytes per chunk the browser sends
+UPLOAD_MAX_CHUNK_BYTES = 4 * 1024 * 1024  # Largest chunk the server accepts
+UPLOAD_SESSION_TTL = 86400  # Seconds before an unfinished upload is discarded
+
+# Static File Caching
+STATIC_CACHE_MAX_AGE = 31536000  # 1 year for content-hashed asset URLs
+UPLOAD_CACHE_MAX_AGE = 86400  # 1 day, revalidated with ETag afterwards
+PRECOMPRESS_STATIC = True  # Build gzip/brotli variants of CSS/JS at startup
+USE_X_SENDFILE = False  # Let nginx/Apache send files (requires server support)
+
 # Model Configuration
 MODEL_PATH = 'vegetable_classifier.h5'
 CLASS_MAP_PATH = 'class_map.pkl'
+INFERENCE_BACKEND = 'keras'  # 'keras' (TensorFlow) or 'mmap' (shared weight file, NumPy)
+MMAP_WEIGHTS_PATH = 'vegetable_classifier.weights'  # python weights_mmap.py export
 IMAGE_TARGET_SIZE = (150, 150)
 IMAGE_NORMALIZATION = True
 
+# Grad-CAM Explanations (GET /explain/<filename>, computed only on request)
+EXPLAIN_ENABLED = True
+EXPLANATION_FOLDER = 'explanations'  # Rendered overlays, by model version and content hash
+EXPLAIN_INPUT_CACHE_SIZE = 64  # Preprocessed inputs kept from /predict (~270 KB each)
+EXPLAIN_MAX_BATCH = 8  # Concurrent explanation requests computed together
+EXPLAIN_OVERLAY_ALPHA = 0.45  # Heatmap opacity over the image
+EXPLAIN_TIMEOUT = 30  # Seconds a request waits for its heatmap
+
+# CPU Inference Tuning (python autotune.py sweep writes the profile)
+CPU_PROFILE_PATH = 'cpu_profile.json'  # Loaded at startup when present
+TF_INTRA_OP_THREADS = 0  # Threads per op; 0 = TensorFlow default (all cores)
+TF_INTER_OP_THREADS = 0  # Ops run in parallel; 0 = TensorFlow default
+AUTOTUNE_MAX_LATENCY_MS = 250  # p95 per forward pass the chosen setting must meet
+AUTOTUNE_PROBE_DIR = UPLOAD_FOLDER  # Real images each setting's answers are checked on
+AUTOTUNE_PROB_TOLERANCE = 0.02  # Max probability difference from the reference setting
+
+# Dataset manifest used by the training tools (python manifest.py build ...)
+MANIFEST_PATH = 'dataset_manifest.db'
+
 # Model Classes (Default)
 DEFAULT_CLASSES = {
     0: "Tomato",
@@ -40,12 +86,65 @@ CONFIDENCE_THRESHOLD = 0.3  # Minimum confidence to show result
 SHOW_CONFIDENCE_SCORE = True
 VERBOSE_PREDICTIONS = False
 
+# Model Cascade (small student first, vegetable_classifier.h5 only when unsure)
+CASCADE_ENABLED = False
+STUDENT_MODEL_PATH = 'vegetable_student.h5'  # python train_student.py ...
+STUDENT_IMAGE_SIZE = (64, 64)
+CASCADE_CONFIDENCE_THRESHOLD = 0.9  # Student confidence needed to skip the full model
+
+# Stream Classification (WebSocket /stream, requires flask-sock)
+STREAM_TARGET_FPS = 10  # Default and maximum frames per second per stream
+STREAM_MAX_BATCH = 16  # Frames from different streams per forward pass
+STREAM_MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+# Tiled Classification (POST /predict/tiles, for photos of mixed crates)
+TILE_MAX_EDGE = 1200  # Longest edge the photo is scaled to before tiling
+TILE_SCALES = (1.0, 0.5)  # Tiling passes relative to TILE_MAX_EDGE
+TILE_OVERLAP = 0.5  # Fraction of a tile shared with its neighbour
+TILE_MAX_TILES = 512  # Upper bound on one forward pass
+TILE_MERGE_OVERLAP = 0.25  # Share of the smaller tile two same-class tiles must overlap to join
+
+# Near-Duplicate Lookup (perceptual hash, skips the model on re-uploads)
+PHASH_ENABLED = True
+PHASH_ALGORITHM = 'phash'  # 'phash' (DCT) or 'dhash' (gradient)
+PHASH_MAX_DISTANCE = 6  # Hamming radius out of 64 bits
+PHASH_VERIFY_RATE = 0.05  # Share of hits re-checked by the model
+PHASH_INDEX_PATH = 'phash_index.bin'
+
+# Similar Images (embeddings from the penultimate Dense(128) layer)
+SIMILAR_INDEX_ENABLED = True
+SIMILAR_INDEX_DIR = 'similar_index'
+EMIT_EMBEDDINGS = False  # Include the 128-d vector in JSON prediction responses
+SIMILAR_NPROBE = 8  # Inverted lists scanned per query (recall vs speed)
+SIMILAR_DEFAULT_K = 10
+SIMILAR_MAX_K = 100
+
 # UI Configuration
 SHOW_FEATURE_ICONS = True
 ENABLE_DRAG_DROP = True
 SHOW_FILE_PREVIEW = True
 ANIMATION_ENABLED = True
 
+# Admission Control (load shedding for /predict)
+ADMISSION_ENDPOINTS = {'predict', 'batch_api.predict_batch', 'resumable_upload.upload_chunk',
+                       'tiling.predict_tiles'}
+ADMISSION_MAX_IN_FLIGHT = 16  # Requests running or waiting for the model
+ADMISSION_CONCURRENCY = 1  # Requests let into the model at once (admission.model_call)
+ADMISSION_LATENCY_BUDGET = 2.0  # Seconds of expected queueing before shedding
+ADMISSION_INITIAL_SERVICE_TIME = 0.1  # Seconds, until real timings arrive
+ADMISSION_EWMA_ALPHA = 0.2  # Weight of the newest request in the service time
+RATE_LIMIT_PER_SECOND = 5.0  # Per-client token refill rate (0 disables)
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_MAX_CLIENTS = 10000  # Buckets kept in memory
+RATE_LIMIT_TRUST_FORWARDED = False  # Use X-Forwarded-For (only behind a proxy)
+
+# Multi-Node Deployment (shared cache/storage and hash-affinity routing)
+SHARED_STORE_URL = None  # e.g. 'redis://cache-host:6379/0'; None keeps results in-process
+SHARED_RESULT_TTL = 30 * 86400  # Seconds a cached prediction is kept
+SHARED_UPLOAD_TTL = 86400  # Seconds an uploaded file stays fetchable by other nodes
+SHARED_UPLOAD_MAX_BYTES = MAX_FILE_SIZE_BYTES
+HASH_RING_REPLICAS = 160  # Virtual nodes per node on the consistent hash ring
+
 # Security Configuration
 ENABLE_CORS = False
 SECURE_HEADERS = True
@@ -56,6 +155,36 @@ ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 LOG_LEVEL = 'INFO'  # DEBUG, INFO, WARNING, ERROR
 ENABLE_REQUEST_LOGGING = True
 LOG_FILE = 'app.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate app.log at 10MB ...
+LOG_ROTATE_WHEN = 'midnight'  # ... or daily, whichever comes first
+LOG_BACKUP_COUNT = 7
+LOG_QUEUE_SIZE = 10000  # Records buffered for the background writer
+LOG_SAMPLE_RATE = 0.1  # Fraction kept once the queue is half full
+
+# Request Tracing (X-Trace-Id and Server-Timing headers)
+TRACE_ENABLED = True
+TRACE_ENDPOINTS = {'predict'}
+TRACE_EXPORT_PATH = None  # e.g. 'traces.jsonl' for OTLP/JSON spans, one request per line
+TRACE_EXPORT_MIN_MS = 0  # Only export requests at least this slow
+TRACE_QUEUE_SIZE = 1000  # Traces buffered for the exporter thread
+
+# Prediction History (SQLite, written in batches by a background thread)
+HISTORY_ENABLED = True
+HISTORY_DB_PATH = 'predictions.db'
+HISTORY_BATCH_SIZE = 500  # Rows per write transaction
+HISTORY_FLUSH_INTERVAL = 1.0  # Seconds the writer waits for new rows
+HISTORY_QUEUE_SIZE = 50000  # Pending rows before new ones are dropped
+HISTORY_MAX_LIMIT = 500  # Largest page served by /history/recent
+
+# Memory Diagnostics (opt-in, /diagnostics/*)
+ENABLE_DIAGNOSTICS = False
+DIAGNOSTICS_TOKEN = ''  # Required in an X-Diagnostics-Token header; /diagnostics is closed while empty
+DIAGNOSTICS_ALLOWED_IPS = {'127.0.0.1', '::1'}  # Who may call /diagnostics, as well as holding the token
+DIAGNOSTICS_TRUSTED_PROXIES = set()  # Proxies whose X-Forwarded-For names the real client
+DIAGNOSTICS_TRACE_FRAMES = 10  # Traceback depth recorded by tracemalloc
+DIAGNOSTICS_MAX_SNAPSHOTS = 10  # Oldest snapshots are discarded beyond this
+DIAGNOSTICS_REQUEST_HISTORY = 1000  # Per-request peaks kept in memory
+DIAGNOSTICS_TRACKED_ENDPOINTS = {'predict'}
 
 # Environment Specific Settings
 PRODUCTION_SETTINGS = {
@@ -73,8 +202,9 @@ DEVELOPMENT_SETTINGS = {
 }
 
 # Advanced Settings
-USE_GPU = True  # Use GPU if available (TensorFlow)
-BATCH_PREDICTION = False
+USE_GPU = True  # Use GPU if available (TensorFlow); CPU-only hosts use the CPU profile above
+BATCH_PREDICTION = False  # POST /predict/batch (JSON, needed by greenclassify_client)
+BATCH_MAX_IMAGES = 32  # Images per /predict/batch request
 CACHE_MODEL = True
 CLEANUP_UPLOADS = True  # Delete old uploads
 CLEANUP_DAYS = 7  # Delete uploads older than 7 days
@@ -0,0 +1,249 @@
+"""
+GreenClassify - Memory Diagnostics
+Opt-in endpoints for RSS, TensorFlow allocator stats and tracemalloc snapshots
+
+Enable with ENABLE_DIAGNOSTICS = True and set DIAGNOSTICS_TOKEN. Every call
+must send that token in an X-Diagnostics-Token header and come from an
+address in DIAGNOSTICS_ALLOWED_IPS. Behind a reverse proxy every request
+arrives from the proxy's address, so the token is what keeps the endpoints
+private; list the proxy in DIAGNOSTICS_TRUSTED_PROXIES to check the client
+address from X-Forwarded-For instead of the proxy's.
+
+    GET  /diagnostics/memory                  RSS, open fds, TF allocator stats
+    POST /diagnostics/tracemalloc/start       begin tracing (?frames=N)
+    POST /diagnostics/tracemalloc/stop
+    POST /diagnostics/snapshots               take a snapshot, returns its id
+    GET  /diagnostics/snapshots/<a>/diff/<b>  rank allocation sites by growth
+    GET  /diagnostics/requests                per-request peak allocation
+
+Per-request peaks use tracemalloc.reset_peak(), which is process-wide, so
+under concurrent requests a peak may include a neighbour's allocations.
+"""
+
+import gc
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+from flask import Blueprint, Flask, abort, g, jsonify, request
+
+import config
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+diagnostics_bp = Blueprint('diagnostics', __name__, url_prefix='/diagnostics')
+
+_lock = threading.Lock()
+_snapshots: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (taken_at, snapshot)
+_snapshot_ids = itertools.count(1)
+_request_peaks: deque = deque(maxlen=config.DIAGNOSTICS_REQUEST_HISTORY)
+
+
+# ==================== Process Memory ==================== #
+def _proc_status() -> Dict[str, int]:
+    """VmRSS/VmHWM etc. from /proc (Linux), in bytes"""
+    values = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS', 'VmHWM', 'VmSize', 'RssAnon', 'RssFile')):
+                    name, value = line.split(':', 1)
+                    values[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values
+
+
+def _open_fds() -> Optional[int]:
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def _tensorflow_memory() -> Dict[str, dict]:
+    """Allocator stats per device, only if TensorFlow is already loaded"""
+    tf = sys.modules.get('tensorflow')
+    if tf is None:
+        return {}
+    stats = {}
+    for device in tf.config.list_logical_devices():
+        try:
+            stats[device.name] = tf.config.experimental.get_memory_info(device.name)
+        except (ValueError, tf.errors.OpError):
+            # The CPU allocator does not expose stats in every TF build
+            continue
+    return stats
+
+
+def memory_report() -> dict:
+    status = _proc_status()
+    report = {
+        'rss_bytes': status.get('VmRSS'),
+        'peak_rss_bytes': status.get('VmHWM'),
+        'rss_anon_bytes': status.get('RssAnon'),
+        'rss_file_bytes': status.get('RssFile'),
+        'open_fds': _open_fds(),
+        'gc_counts': gc.get_count(),
+        'tensorflow': _tensorflow_memory(),
+        'tracemalloc': tracemalloc.is_tracing(),
+    }
+    if report['peak_rss_bytes'] is None and resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        report['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report['traced_bytes'] = current
+        report['traced_peak_bytes'] = peak
+    return report
+
+
+def _format_stats(stats, limit: int) -> list:
+    return [{
+        'site': str(stat.traceback),
+        'size_bytes': stat.size,
+        'size_diff_bytes': getattr(stat, 'size_diff', None),
+        'count': stat.count,
+        'count_diff': getattr(stat, 'count_diff', None),
+    } for stat in stats[:limit]]
+
+
+# ==================== Routes ==================== #
+def _client_address() -> Optional[str]:
+    """The caller's address, looking through DIAGNOSTICS_TRUSTED_PROXIES only"""
+    if request.remote_addr not in config.DIAGNOSTICS_TRUSTED_PROXIES:
+        return request.remote_addr
+    # Proxies append to X-Forwarded-For, so the client is the last hop no trusted proxy added
+    forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    for hop in reversed(forwarded):
+        if hop not in config.DIAGNOSTICS_TRUSTED_PROXIES:
+            return hop
+    # Every hop is trusted (or there are none, i.e. a direct call), so the earliest one is the client
+    return forwarded[0] if forwarded else request.remote_addr
+
+
+@diagnostics_bp.before_request
+def restrict_to_operators():
+    token = request.headers.get('X-Diagnostics-Token', '')
+    if not config.DIAGNOSTICS_TOKEN or not hmac.compare_digest(token.encode(), config.DIAGNOSTICS_TOKEN.encode()):
+        abort(403)
+    if _client_address() not in config.DIAGNOSTICS_ALLOWED_IPS:
+        abort(403)
+
+
+@diagnostics_bp.route('/memory')
+def memory():
+    return jsonify(memory_report())
+
+
+@diagnostics_bp.route('/tracemalloc/start', methods=['POST'])
+def start_tracing():
+    frames = request.args.get('frames', config.DIAGNOSTICS_TRACE_FRAMES)
+    try:
+        frames = int(frames)
+    except ValueError:
+        frames = 0
+    if not 1 <= frames <= 65535:  # tracemalloc's own bounds
+        return jsonify(error="frames must be an integer from 1 to 65535"), 400
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return jsonify(tracing=True, frames=tracemalloc.get_traceback_limit())
+
+
+@diagnostics_bp.route('/tracemalloc/stop', methods=['POST'])
+def stop_tracing():
+    tracemalloc.stop()
+    with _lock:
+        _snapshots.clear()
+    return jsonify(tracing=False)
+
+
+@diagnostics_bp.route('/snapshots', methods=['POST'])
+def take_snapshot():
+    if not tracemalloc.is_tracing():
+        return jsonify(error="tracemalloc is not running"), 409
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    with _lock:
+        snapshot_id = next(_snapshot_ids)
+        _snapshots[snapshot_id] = (time.time(), snapshot)
+        while len(_snapshots) > config.DIAGNOSTICS_MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+    limit = request.args.get('limit', 20, type=int)
+    top = snapshot.statistics(request.args.get('key', 'lineno'))
+    return jsonify(id=snapshot_id, top=_format_stats(top, limit))
+
+
+@diagnostics_bp.route('/snapshots/<int:first>/diff/<int:second>')
+def diff_snapshots(first: int, second: int):
+    with _lock:
+        old, new = _snapshots.get(first), _snapshots.get(second)
+    if old is None or new is None:
+        return jsonify(error="Unknown snapshot id", available=list(_snapshots)), 404
+
+    limit = request.args.get('limit', 20, type=int)
+    stats = new[1].compare_to(old[1], request.args.get('key', 'lineno'))
+    return jsonify(seconds=round(new[0] - old[0], 3),
+                   total_diff_bytes=sum(stat.size_diff for stat in stats),
+                   top=_format_stats(stats, limit))
+
+
+@diagnostics_bp.route('/requests')
+def request_peaks():
+    with _lock:
+        peaks = list(_request_peaks)
+    sizes = sorted(p['peak_bytes'] for p in peaks)
+    summary = {}
+    if sizes:
+        summary = {
+            'count': len(sizes),
+            'max_bytes': sizes[-1],
+            'p50_bytes': sizes[len(sizes) // 2],
+            'p95_bytes': sizes[min(len(sizes) - 1, int(len(sizes) * 0.95))],
+        }
+    return jsonify(summary=summary, recent=peaks[-50:])
+
+
+# ==================== Per-Request Tracking ==================== #
+def _begin_request_tracking():
+    if request.endpoint in config.DIAGNOSTICS_TRACKED_ENDPOINTS and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        g.alloc_start = tracemalloc.get_traced_memory()[0]
+
+
+def _end_request_tracking(response):
+    start = g.pop('alloc_start', None)
+    if start is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            _request_peaks.append({
+                'endpoint': request.endpoint,
+                'ts': round(time.time(), 3),
+                'peak_bytes': peak - start,
+                'retained_bytes': current - start,
+                'status': response.status_code,
+            })
+    return response
+
+
+def init_app(app: Flask):
+    """Register diagnostics routes and hooks if ENABLE_DIAGNOSTICS is set"""
+    if not config.ENABLE_DIAGNOSTICS:
+        return
+    app.register_blueprint(diagnostics_bp)
+    app.before_request(_begin_request_tracking)
+    app.after_request(_end_request_tracking)
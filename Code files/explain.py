@@ -0,0 +1,263 @@
+"""
+GreenClassify - Grad-CAM Explanations
+Heatmaps of the image regions behind a prediction, computed only when asked
+
+GET /explain/<filename> returns a PNG of the upload with a Grad-CAM heatmap
+for the class the user was shown (from the model's last Conv2D layer)
+blended over it. That label may come from the cascade student or a
+near-duplicate match rather than the Keras model, so it is passed as
+?label=<class> (prediction_view and prediction.html add it) or, failing
+that, taken from the shared result cache; only without either is the
+Keras model's own top class explained.
+
+/predict does no extra work beyond remember_input(), which keeps the
+already preprocessed model input in a small LRU so an explanation asked
+for soon afterwards skips decoding the upload again. Concurrent explanation
+requests go through the network in one batched forward/backward pass, and
+requests for the same image and class share one computation. Rendered PNGs
+are kept under EXPLANATION_FOLDER by model version, content hash and class,
+so repeat views are a file read (or a 304 for a browser that already has it).
+
+Usage in app.py:
+    import explain
+    explain.init_app(app)
+    ...
+    batch = preprocessing.prepare_input(img)
+    explain.remember_input(digest, batch)
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify, request, send_file
+from PIL import Image
+from werkzeug.security import safe_join
+
+import config
+import preprocessing
+
+
+# ==================== Preprocessed Input Cache ==================== #
+_inputs: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+_inputs_lock = threading.Lock()
+
+
+def remember_input(content_hash: str, batch: np.ndarray):
+    """Keep the (1, H, W, 3) model input of a classified upload for a later explanation"""
+    with _inputs_lock:
+        _inputs[content_hash] = batch
+        _inputs.move_to_end(content_hash)
+        while len(_inputs) > config.EXPLAIN_INPUT_CACHE_SIZE:
+            _inputs.popitem(last=False)
+
+
+def _cached_input(content_hash: str) -> Optional[np.ndarray]:
+    with _inputs_lock:
+        return _inputs.get(content_hash)
+
+
+# ==================== Batched Grad-CAM ==================== #
+class ExplanationBatcher:
+    """Queues Grad-CAM requests and computes them in batches on one worker thread"""
+
+    def __init__(self, max_batch: int = config.EXPLAIN_MAX_BATCH):
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Tuple[np.ndarray, int]] = {}  # key -> (input, class or -1)
+        self._futures: Dict[str, Future] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {'requests': 0, 'shared': 0, 'computed': 0, 'batches': 0,
+                         'cache_hits': 0, 'input_reused': 0, 'compute_seconds': 0.0}
+
+    def submit(self, key: str, batch: np.ndarray, class_index: int = -1) -> Future:
+        """Future of (heatmap, class index); joins a computation already queued for key"""
+        with self._cond:
+            self.counters['requests'] += 1
+            future = self._futures.get(key)
+            if future is not None:
+                self.counters['shared'] += 1
+                return future
+            future = self._futures[key] = Future()
+            self._pending[key] = (batch, class_index)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='gradcam', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return future
+
+    def _take_batch(self) -> List[Tuple[str, Tuple[np.ndarray, int]]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            keys = list(self._pending)[:self.max_batch]
+            return [(key, self._pending.pop(key)) for key in keys]
+
+    def _run(self):
+        import inference
+
+        while True:
+            items = self._take_batch()
+            start = time.perf_counter()
+            try:
+                cams, classes = inference.gradcam(np.concatenate([batch for _, (batch, _) in items]),
+                                                  np.array([index for _, (_, index) in items]))
+                outcomes = [(True, (cam, int(index))) for cam, index in zip(cams, classes)]
+            except Exception as exc:  # fail these requests, keep serving later ones
+                outcomes = [(False, exc)] * len(items)
+            with self._cond:
+                self.counters['batches'] += 1
+                self.counters['computed'] += len(items)
+                self.counters['compute_seconds'] += time.perf_counter() - start
+                futures = [self._futures.pop(key) for key, _ in items]
+            for future, (ok, value) in zip(futures, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def count(self, counter: str):
+        with self._cond:
+            self.counters[counter] += 1
+
+    def metrics(self) -> dict:
+        with self._cond:
+            metrics = dict(self.counters)
+        batches = metrics['batches']
+        metrics['avg_batch_size'] = round(metrics['computed'] / batches, 2) if batches else 0.0
+        metrics['avg_batch_ms'] = round(metrics.pop('compute_seconds') / batches * 1000, 2) if batches else 0.0
+        return metrics
+
+
+batcher = ExplanationBatcher()
+
+
+# ==================== Rendering ==================== #
+def _jet_colormap() -> np.ndarray:
+    """(256, 3) uint8 blue-cyan-yellow-red lookup table"""
+    x = np.linspace(0.0, 1.0, 256)
+    red = np.interp(x, [0.0, 0.35, 0.66, 0.89, 1.0], [0.0, 0.0, 1.0, 1.0, 0.5])
+    green = np.interp(x, [0.0, 0.125, 0.375, 0.64, 0.91, 1.0], [0.0, 0.0, 1.0, 1.0, 0.0, 0.0])
+    blue = np.interp(x, [0.0, 0.11, 0.34, 0.65, 1.0], [0.5, 1.0, 1.0, 0.0, 0.0])
+    return (np.stack([red, green, blue], axis=1) * 255).astype(np.uint8)
+
+
+COLORMAP = _jet_colormap()
+
+
+def render_overlay(img: Image.Image, cam: np.ndarray, alpha: float = config.EXPLAIN_OVERLAY_ALPHA) -> bytes:
+    """PNG of img with the heatmap upsampled to its size and blended over it"""
+    levels = Image.fromarray((np.clip(cam, 0.0, 1.0) * 255).astype(np.uint8))
+    levels = levels.resize(img.size, Image.BILINEAR)
+    heat = Image.fromarray(COLORMAP[np.asarray(levels)])
+    out = io.BytesIO()
+    Image.blend(img.convert('RGB'), heat, alpha).save(out, 'PNG')
+    return out.getvalue()
+
+
+def _background(path: str, filename: str) -> Image.Image:
+    """The stored thumbnail if there is one (cheap to decode), else the upload"""
+    thumb_path = os.path.join(config.UPLOAD_FOLDER, preprocessing.thumbnail_filename(filename))
+    if os.path.exists(thumb_path):
+        with Image.open(thumb_path) as thumb:
+            return thumb.convert('RGB')
+    with open(path, 'rb') as f:
+        img = preprocessing.load_upload(f, filename, draft_edge=config.THUMBNAIL_MAX_EDGE)
+    img.thumbnail((config.THUMBNAIL_MAX_EDGE, config.THUMBNAIL_MAX_EDGE), Image.BILINEAR)
+    return img
+
+
+def explanation_path(content_hash: str, model_version: str, class_index: int = -1) -> str:
+    suffix = f'_{class_index}' if class_index >= 0 else ''
+    return os.path.join(config.EXPLANATION_FOLDER, model_version, f'{content_hash}{suffix}.png')
+
+
+def displayed_class(content_hash: str, model_version: str, label: Optional[str] = None) -> int:
+    """Index of the class the user was shown for this upload, -1 if unknown"""
+    import inference
+    import shared_store
+
+    if not label:
+        result = shared_store.get_result(content_hash, model_version)
+        label = result.get('vegetable') if result else None
+    for index, name in inference.get_class_map().items():
+        if name == label:
+            return int(index)
+    return -1
+
+
+def explain_file(path: str, filename: str, label: Optional[str] = None) -> Tuple[str, str]:
+    """Path of the rendered explanation of label (the displayed class) for an upload, and its ETag"""
+    import inference
+
+    with open(path, 'rb') as f:
+        digest = preprocessing.content_hash(f)
+    model_version = inference.model_version()
+    class_index = displayed_class(digest, model_version, label)
+    out_path = explanation_path(digest, model_version, class_index)
+    etag = f"{model_version}-{digest[:16]}-{class_index if class_index >= 0 else 'top'}"
+    if os.path.exists(out_path):
+        batcher.count('cache_hits')
+        return out_path, etag
+
+    batch = _cached_input(digest)
+    if batch is not None:
+        batcher.count('input_reused')
+    else:
+        with open(path, 'rb') as f:
+            batch = preprocessing.prepare_input(preprocessing.load_upload(f, filename))
+    cam, _ = batcher.submit(f'{digest}:{class_index}', batch, class_index).result(timeout=config.EXPLAIN_TIMEOUT)
+
+    png = render_overlay(_background(path, filename), cam)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f'{out_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(png)
+    os.replace(tmp_path, out_path)
+    return out_path, etag
+
+
+# ==================== Flask Integration ==================== #
+explain_bp = Blueprint('explain', __name__)
+
+
+@explain_bp.route('/explain/<filename>')
+def explain_upload(filename: str):
+    path = safe_join(config.UPLOAD_FOLDER, filename)
+    if path is None:
+        return jsonify(error="Unknown upload"), 404
+    if config.SHARED_STORE_URL and not os.path.exists(path):
+        import shared_store
+        shared_store.fetch_upload(filename, config.UPLOAD_FOLDER)
+    if not os.path.isfile(path):
+        return jsonify(error="Unknown upload"), 404
+    try:
+        out_path, etag = explain_file(path, filename, request.args.get('label'))
+    except preprocessing.UploadError as e:
+        return jsonify(error=str(e)), 400
+    except FutureTimeout:
+        return jsonify(error="Explanation is taking too long; please try again."), 503
+    return send_file(out_path, mimetype='image/png', etag=etag, conditional=True,
+                     max_age=config.UPLOAD_CACHE_MAX_AGE)
+
+
+@explain_bp.route('/metrics/explain')
+def explain_metrics():
+    return jsonify(batcher.metrics())
+
+
+def init_app(app: Flask):
+    """Register /explain and offer the button on the results page"""
+    if not config.EXPLAIN_ENABLED:
+        return
+    os.makedirs(config.EXPLANATION_FOLDER, exist_ok=True)
+    app.register_blueprint(explain_bp)
+
+    @app.context_processor
+    def explain_settings():
+        return {'explain_enabled': True}
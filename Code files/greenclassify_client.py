@@ -0,0 +1,314 @@
+"""
+GreenClassify - Python Client
+Sync and asyncio clients for the /predict/batch JSON API (or /predict)
+
+Both clients keep a pool of keep-alive connections, split large image lists
+into batch calls (by image count and by request size), run at most
+max_concurrency calls at once and retry 429/503 responses and connection
+errors with exponential backoff, honouring Retry-After. Results come back
+in input order, one Prediction per image. Image files are hashed up front
+but only read into memory when their call is sent, so a long list holds at
+most max_concurrency batches of image bytes at a time.
+
+Given several node URLs, each image is sent to the node that owns its
+content hash on a consistent hash ring (hash_ring.py), so repeats hit that
+node's warm caches. Every call also carries an X-Content-Hash header for
+load balancers that route by hash.
+
+Requires httpx (pip install -r requirements.txt). A node that answers
+/predict/batch with 404 (BATCH_PREDICTION = False, the default) is
+remembered and sent one /predict call per image instead.
+
+Usage:
+    from greenclassify_client import Client, AsyncClient
+
+    with Client('http://localhost:5000') as client:
+        print(client.classify('carrot.jpg'))
+        predictions = client.classify_many(glob.glob('crates/*.jpg'))
+
+    client = Client(['http://node-a:5000', 'http://node-b:5000'])   # hash-affinity routing
+
+    async with AsyncClient('http://localhost:5000') as client:
+        predictions = await client.classify_many(paths)
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import httpx
+
+from hash_ring import HashRing
+
+
+ImageInput = Union[str, os.PathLike, bytes, Tuple[str, bytes]]
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class Prediction(NamedTuple):
+    filename: str
+    vegetable: Optional[str]
+    confidence: Optional[float]  # 0-100
+    error: Optional[str] = None
+
+
+class GreenClassifyError(Exception):
+    """Raised when a batch call fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Image(NamedTuple):
+    filename: str
+    source: Union[str, os.PathLike, bytes]  # a path, or bytes the caller already holds
+    size: int
+    content_hash: str
+
+
+def _describe(image: ImageInput, index: int) -> _Image:
+    """Name, size and content hash; a file is hashed in blocks, not kept in memory"""
+    if isinstance(image, tuple):
+        name, data = image
+    elif isinstance(image, (bytes, bytearray)):
+        name, data = f'image_{index}.jpg', bytes(image)
+    else:
+        digest, size = hashlib.sha256(), 0
+        with open(image, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+                size += len(block)
+        return _Image(os.path.basename(image), image, size, digest.hexdigest())
+    return _Image(name, data, len(data), hashlib.sha256(data).hexdigest())
+
+
+def _files(images: Sequence[_Image], field: str = 'files') -> list:
+    """Multipart fields for one call, reading image files only now"""
+    fields = []
+    for image in images:
+        if isinstance(image.source, (bytes, bytearray)):
+            data = image.source
+        else:
+            with open(image.source, 'rb') as f:
+                data = f.read()
+        fields.append((field, (image.filename, data, 'application/octet-stream')))
+    return fields
+
+
+def _chunk(items: Sequence[int], sizes: Sequence[int], batch_size: int,
+           max_batch_bytes: int) -> List[List[int]]:
+    """Consecutive groups within both the image count and the request size limit"""
+    chunks, current, size = [], [], 0
+    for item in items:
+        if current and (len(current) == batch_size or size + sizes[item] > max_batch_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += sizes[item]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class _Call(NamedTuple):
+    node: str
+    indices: List[int]
+    images: List[_Image]
+    content_hash: str
+
+
+def _error_message(response: httpx.Response) -> str:
+    try:
+        return response.json().get('error', response.text)
+    except ValueError:
+        return response.text
+
+
+def _parse(response: httpx.Response) -> List[Prediction]:
+    if response.status_code != 200:
+        raise GreenClassifyError(f"HTTP {response.status_code}: {_error_message(response)}",
+                                 response.status_code)
+    return [Prediction(r['filename'], r.get('vegetable'), r.get('confidence'), r.get('error'))
+            for r in response.json()['results']]
+
+
+def _parse_single(response: httpx.Response, filename: str) -> Prediction:
+    """A /predict answer; a rejected upload (400) is a per-image error, like in a batch"""
+    if response.status_code == 400:
+        return Prediction(filename, None, None, _error_message(response))
+    if response.status_code != 200:
+        raise GreenClassifyError(f"HTTP {response.status_code}: {_error_message(response)}",
+                                 response.status_code)
+    body = response.json()
+    return Prediction(filename, body.get('vegetable'), body.get('confidence'))
+
+
+class _RetryPolicy:
+    def __init__(self, retries: int, backoff: float, max_backoff: float):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Retry-After if the server sent one, else full-jitter exponential backoff"""
+        if response is not None:
+            try:
+                return min(float(response.headers['Retry-After']), self.max_backoff)
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class _BaseClient:
+    def __init__(self, base_url: Union[str, Sequence[str]], batch_size: int = 16,
+                 max_batch_bytes: int = 12 * 1024 * 1024, max_concurrency: int = 4, retries: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 30.0, timeout: float = 60.0):
+        nodes = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.ring = HashRing([node.rstrip('/') for node in nodes])
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_concurrency = max_concurrency
+        self.retry = _RetryPolicy(retries, backoff, max_backoff)
+        self.timeout = timeout
+        # One keep-alive connection per concurrent call
+        self.limits = httpx.Limits(max_connections=max_concurrency,
+                                   max_keepalive_connections=max_concurrency)
+        self._single_nodes = set()  # nodes without /predict/batch
+
+    def _calls(self, images: Iterable[ImageInput]) -> Tuple[List[_Call], int]:
+        """Batch calls grouped by owning node, and the number of images"""
+        described = [_describe(image, i) for i, image in enumerate(images)]
+        by_node = {}
+        for i, image in enumerate(described):
+            by_node.setdefault(self.ring.node_for(image.content_hash), []).append(i)
+
+        calls = []
+        for node, items in by_node.items():
+            for chunk in _chunk(items, [image.size for image in described], self.batch_size,
+                                self.max_batch_bytes):
+                calls.append(_Call(node, chunk, [described[i] for i in chunk],
+                                   described[chunk[0]].content_hash))
+        return calls, len(described)
+
+    @staticmethod
+    def _ordered(calls: List[_Call], batches: List[List[Prediction]], count: int) -> List[Prediction]:
+        results: List[Optional[Prediction]] = [None] * count
+        for call, batch in zip(calls, batches):
+            for i, prediction in zip(call.indices, batch):
+                results[i] = prediction
+        return results
+
+
+class Client(_BaseClient):
+    """Blocking client; batch calls run on a thread pool sharing one connection pool"""
+
+    def __init__(self, base_url: Union[str, Sequence[str]], **kwargs):
+        super().__init__(base_url, **kwargs)
+        self._http = httpx.Client(limits=self.limits, timeout=self.timeout)
+
+    def _send(self, url: str, files: list, content_hash: str) -> httpx.Response:
+        """POST with retries; the last response once it is final or retries run out"""
+        for attempt in range(self.retry.retries + 1):
+            response = None
+            try:
+                response = self._http.post(url, files=files, headers={
+                    'X-Content-Hash': content_hash, 'Accept': 'application/json'})
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            except httpx.TransportError as e:
+                if attempt == self.retry.retries:
+                    raise GreenClassifyError(f"Connection failed: {e}") from e
+            if attempt < self.retry.retries:
+                time.sleep(self.retry.delay(attempt, response))
+        return response
+
+    def _post(self, call: _Call) -> List[Prediction]:
+        if call.node not in self._single_nodes:
+            response = self._send(call.node + '/predict/batch', _files(call.images), call.content_hash)
+            if response.status_code != 404:
+                return _parse(response)
+            self._single_nodes.add(call.node)
+        return [_parse_single(self._send(call.node + '/predict', _files([image], 'image'),
+                                         image.content_hash), image.filename)
+                for image in call.images]
+
+    def classify(self, image: ImageInput) -> Prediction:
+        return self.classify_many([image])[0]
+
+    def classify_many(self, images: Iterable[ImageInput]) -> List[Prediction]:
+        calls, count = self._calls(images)
+        if len(calls) == 1:
+            return self._post(calls[0])
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return self._ordered(calls, list(pool.map(self._post, calls)), count)
+
+    def close(self):
+        self._http.close()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncClient(_BaseClient):
+    """asyncio client; at most max_concurrency batch calls are in flight"""
+
+    def __init__(self, base_url: Union[str, Sequence[str]], **kwargs):
+        super().__init__(base_url, **kwargs)
+        self._http = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _send(self, url: str, files: list, content_hash: str) -> httpx.Response:
+        """POST with retries; the last response once it is final or retries run out"""
+        for attempt in range(self.retry.retries + 1):
+            response = None
+            try:
+                response = await self._http.post(url, files=files, headers={
+                    'X-Content-Hash': content_hash, 'Accept': 'application/json'})
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            except httpx.TransportError as e:
+                if attempt == self.retry.retries:
+                    raise GreenClassifyError(f"Connection failed: {e}") from e
+            if attempt < self.retry.retries:
+                await asyncio.sleep(self.retry.delay(attempt, response))
+        return response
+
+    async def _post(self, call: _Call) -> List[Prediction]:
+        async with self._semaphore:
+            if call.node not in self._single_nodes:
+                files = await asyncio.to_thread(_files, call.images)
+                response = await self._send(call.node + '/predict/batch', files, call.content_hash)
+                if response.status_code != 404:
+                    return _parse(response)
+                self._single_nodes.add(call.node)
+            predictions = []
+            for image in call.images:
+                files = await asyncio.to_thread(_files, [image], 'image')
+                response = await self._send(call.node + '/predict', files, image.content_hash)
+                predictions.append(_parse_single(response, image.filename))
+            return predictions
+
+    async def classify(self, image: ImageInput) -> Prediction:
+        return (await self.classify_many([image]))[0]
+
+    async def classify_many(self, images: Iterable[ImageInput]) -> List[Prediction]:
+        calls, count = self._calls(images)
+        batches = await asyncio.gather(*(self._post(call) for call in calls))
+        return self._ordered(calls, list(batches), count)
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def __aenter__(self) -> 'AsyncClient':
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,52 @@
+"""
+GreenClassify - Consistent Hash Ring
+Maps image content hashes to serving nodes (no dependencies, shared by the
+server tools and greenclassify_client)
+
+Each node owns `replicas` pseudo-random points on a 64-bit ring and a key
+belongs to the first point at or after its own hash. Adding or removing one
+of N nodes therefore moves only the keys next to that node's points, about
+1/N of the total, and every other key keeps its node and its warm caches.
+"""
+
+import bisect
+import hashlib
+from typing import List, Sequence
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Sequence[str] = (), replicas: int = 160):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._owners))
+
+    def add_node(self, node: str):
+        for i in range(self.replicas):
+            point = _point(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str):
+        keep = [(p, n) for p, n in zip(self._points, self._owners) if n != node]
+        self._points = [p for p, _ in keep]
+        self._owners = [n for _, n in keep]
+
+    def node_for(self, key: str) -> str:
+        """Node owning a key (e.g. an image's SHA-256)"""
+        if not self._points:
+            raise LookupError("Hash ring has no nodes")
+        index = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._owners[index]
@@ -0,0 +1,227 @@
+"""
+GreenClassify - Prediction History Store
+Write-behind SQLite (WAL) store with indexed history queries
+
+Request threads call record() which only enqueues; a background writer
+thread inserts the rows in batches. A batch that fails to write (database
+locked past busy_timeout, disk full) is retried once, then logged and
+counted as failed; the writer keeps running. Per-class totals are kept in a
+separate counter table so /history/counts does not scan the history.
+
+Usage in app.py:
+    import history_store
+    history_store.init_app(app)
+    ...
+    history_store.record(predicted_vegetable, confidence, content_hash=digest,
+                         filename=filename, model_version=model_version)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from flask import Blueprint, Flask, jsonify, request
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    predicted_class TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    content_hash TEXT,
+    filename TEXT,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_ts ON predictions (ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_class_ts ON predictions (predicted_class, ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_class_id ON predictions (predicted_class, id);
+CREATE INDEX IF NOT EXISTS idx_predictions_hash ON predictions (content_hash);
+CREATE TABLE IF NOT EXISTS class_counts (
+    predicted_class TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+INSERT_SQL = ("INSERT INTO predictions (ts, predicted_class, confidence, content_hash, filename, model_version) "
+              "VALUES (?, ?, ?, ?, ?, ?)")
+COUNT_SQL = ("INSERT INTO class_counts (predicted_class, count) VALUES (?, ?) "
+             "ON CONFLICT (predicted_class) DO UPDATE SET count = count + excluded.count")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    """Open a connection tuned for a concurrent reader/writer workload"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class PredictionStore:
+    def __init__(self, path: str = config.HISTORY_DB_PATH):
+        self.path = path
+        self.queue: queue.Queue = queue.Queue(maxsize=config.HISTORY_QUEUE_SIZE)
+        self.dropped = 0  # queue full
+        self.failed = 0  # lost to database errors
+        self._count_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+
+        conn = _connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+
+    # ==================== Writes ==================== #
+    def record(self, predicted_class: str, confidence: float, content_hash: Optional[str] = None,
+               filename: Optional[str] = None, model_version: Optional[str] = None,
+               ts: Optional[float] = None):
+        """Queue a prediction for the background writer (never blocks)"""
+        row = (time.time() if ts is None else ts, predicted_class, float(confidence),
+               content_hash, filename, model_version)
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=config.HISTORY_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < config.HISTORY_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch_safely(conn, batch)
+        conn.close()
+
+    def _write_batch_safely(self, conn: sqlite3.Connection, batch: List[tuple]):
+        """Write a batch, retrying once; never lets a database error end the writer"""
+        for attempt in range(2):
+            try:
+                self._write_batch(conn, batch)
+                return
+            except sqlite3.Error:
+                if attempt == 0:
+                    time.sleep(config.HISTORY_FLUSH_INTERVAL)
+                    continue
+                logger.exception("Could not write %d history rows to %s", len(batch), self.path)
+        with self._count_lock:
+            self.failed += len(batch)
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[tuple]):
+        counts: Dict[str, int] = {}
+        for row in batch:
+            counts[row[1]] = counts.get(row[1], 0) + 1
+        with conn:
+            conn.executemany(INSERT_SQL, batch)
+            conn.executemany(COUNT_SQL, counts.items())
+
+    def close(self):
+        """Flush pending rows and stop the writer thread"""
+        self._stop.set()
+        self._writer.join()
+
+    # ==================== Queries ==================== #
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = _connect(self.path)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def recent(self, limit: int = 50, predicted_class: Optional[str] = None,
+               before_id: Optional[int] = None) -> List[dict]:
+        """Newest predictions first, paged by id (keyset pagination)"""
+        clauses, params = [], []
+        if predicted_class:
+            clauses.append("predicted_class = ?")
+            params.append(predicted_class)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT * FROM predictions {where} ORDER BY id DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def by_hash(self, content_hash: str, limit: int = 10) -> List[dict]:
+        """Past predictions for the same image content"""
+        rows = self._reader().execute(
+            "SELECT * FROM predictions WHERE content_hash = ? ORDER BY id DESC LIMIT ?",
+            (content_hash, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def class_counts(self, since: Optional[float] = None) -> Dict[str, int]:
+        """Predictions per class, all-time or since a timestamp"""
+        conn = self._reader()
+        if since is None:
+            rows = conn.execute("SELECT predicted_class, count FROM class_counts")
+        else:
+            # One index range scan per class on (predicted_class, ts)
+            rows = conn.execute(
+                "SELECT c.predicted_class, "
+                "(SELECT COUNT(*) FROM predictions p "
+                " WHERE p.predicted_class = c.predicted_class AND p.ts >= ?) "
+                "FROM class_counts c", (since,)
+            )
+        return {name: count for name, count in rows if count}
+
+
+# ==================== Flask Integration ==================== #
+history_bp = Blueprint('history', __name__, url_prefix='/history')
+_store: Optional[PredictionStore] = None
+
+
+def record(*args, **kwargs):
+    """Record a prediction if the history store is enabled"""
+    if _store is not None:
+        _store.record(*args, **kwargs)
+
+
+@history_bp.route('/recent')
+def recent_history():
+    limit = max(1, min(request.args.get('limit', 50, type=int), config.HISTORY_MAX_LIMIT))
+    rows = _store.recent(limit=limit,
+                         predicted_class=request.args.get('class'),
+                         before_id=request.args.get('before', type=int))
+    next_before = rows[-1]['id'] if len(rows) == limit else None
+    return jsonify(predictions=rows, next_before=next_before)
+
+
+@history_bp.route('/counts')
+def class_counts():
+    since = request.args.get('since', type=float)
+    return jsonify(counts=_store.class_counts(since=since), since=since)
+
+
+def init_app(app: Flask) -> Optional[PredictionStore]:
+    """Open the store, start the writer and register /history routes"""
+    global _store
+    if not config.HISTORY_ENABLED:
+        return None
+    _store = PredictionStore(os.path.join(app.root_path, config.HISTORY_DB_PATH))
+    atexit.register(_store.close)
+    app.register_blueprint(history_bp)
+    return _store
@@ -0,0 +1,281 @@
+"""
+GreenClassify - Hyperparameter Search
+Parallel Hyperband / successive-halving search over the notebook's training choices
+
+The dataset is decoded once into a uint8 .npy cache that every trial process
+memory-maps; the cache is named after a fingerprint of the file list (path,
+size and mtime of every image), so an edited dataset is decoded again.
+Trials train with the same batch augmentation as the production model
+(augment.py). Each Hyperband bracket starts many configurations on a small
+epoch budget and keeps the best 1/eta of them at every rung; survivors
+continue from their saved weights and Adam state (moments and step count)
+instead of restarting. Every rung result (accuracy, training wall time) is
+appended to a JSONL log. Once training is over, the single-image inference
+latency of each bracket's final configurations is measured one at a time in
+an otherwise idle process, and the accuracy/latency Pareto front is printed.
+
+Usage:
+    python hparam_search.py --train-dir data/train --val-dir data/validation --workers 4
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+import config
+import manifest
+
+
+SEARCH_SPACE = {
+    'batch_size': [16, 32, 64],
+    'dropout': [0.1, 0.25, 0.4],
+    'dense_units': [(64, 64), (128, 128), (256, 128), (128,)],
+    'learning_rate': (1e-4, 3e-3),  # log-uniform
+    'beta_1': [0.85, 0.9, 0.95],
+}
+
+
+def sample_params(rng: random.Random) -> dict:
+    low, high = SEARCH_SPACE['learning_rate']
+    return {
+        'batch_size': rng.choice(SEARCH_SPACE['batch_size']),
+        'dropout': rng.choice(SEARCH_SPACE['dropout']),
+        'dense_units': list(rng.choice(SEARCH_SPACE['dense_units'])),
+        'learning_rate': math.exp(rng.uniform(math.log(low), math.log(high))),
+        'beta_1': rng.choice(SEARCH_SPACE['beta_1']),
+    }
+
+
+# ==================== Dataset Cache ==================== #
+def cache_split(directory: str, cache_dir: str, name: str) -> Tuple[str, str]:
+    """Decode a class-per-folder split once into uint8 image/label .npy files"""
+    import training
+
+    paths, labels, class_names = training.list_images(directory)
+    fingerprint = hashlib.sha256('\n'.join(class_names).encode())
+    for path, label in zip(paths, labels):
+        stat = os.stat(path)
+        fingerprint.update(f"{path}\0{label}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    prefix = os.path.join(cache_dir, f"{name}_{fingerprint.hexdigest()[:16]}")
+    x_path, y_path = f"{prefix}_x.npy", f"{prefix}_y.npy"
+    if os.path.exists(x_path) and os.path.exists(y_path):
+        return x_path, y_path
+
+    from PIL import Image
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Caches of an older version of this split are stale now
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}_*.npy")):
+        os.remove(stale)
+    height, width = config.IMAGE_TARGET_SIZE
+    images = np.lib.format.open_memmap(x_path + '.tmp', mode='w+', dtype=np.uint8,
+                                       shape=(len(paths), height, width, 3))
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            images[i] = np.asarray(img.convert('RGB').resize((width, height), Image.NEAREST))
+    images.flush()
+    del images
+    os.replace(x_path + '.tmp', x_path)
+    np.save(y_path, np.asarray(labels, dtype=np.int64))
+    return x_path, y_path
+
+
+# ==================== Trial Worker ==================== #
+def run_trial(task: dict) -> dict:
+    """Train one configuration from epoch_from to epoch_to (runs in a worker process)"""
+    import tensorflow as tf
+
+    import training
+    from augment import BatchAugmenter
+
+    tf.config.threading.set_intra_op_parallelism_threads(task['threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    tf.keras.utils.set_random_seed(task['seed'])
+
+    params = task['params']
+    x_train = np.load(task['train'][0], mmap_mode='r')
+    y_train = np.load(task['train'][1])
+    x_val = np.load(task['val'][0], mmap_mode='r')
+    y_val = np.load(task['val'][1])
+    num_classes = int(max(y_train.max(), y_val.max())) + 1
+
+    # Same augmentation as training.make_dataset; seeded per rung so a
+    # survivor's later epochs do not replay its earlier ones
+    augmenter = BatchAugmenter(seed=task['seed'] + task['epoch_from'])
+
+    def to_dataset(x, y, training_split: bool) -> tf.data.Dataset:
+        def gather(indices):
+            # Read just this batch from the memory-mapped cache
+            batch = x[indices].astype(np.float32) / 255.0
+            return augmenter(batch) if training_split else batch
+
+        ds = tf.data.Dataset.from_tensor_slices((np.arange(len(y)), y))
+        if training_split:
+            ds = ds.shuffle(len(y), seed=task['seed'])
+        ds = ds.batch(params['batch_size'])
+        ds = ds.map(lambda i, label: (
+            tf.ensure_shape(tf.numpy_function(gather, [i], tf.float32), (None, *x.shape[1:])),
+            tf.one_hot(label, num_classes)))
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    model = training.build_model(num_classes, params['dense_units'], params['dropout'])
+    model.compile(optimizer=tf.keras.optimizers.Adam(params['learning_rate'], beta_1=params['beta_1']),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+    model.build((None, *config.IMAGE_TARGET_SIZE, 3))
+    # Weights and optimizer state, so a survivor continues with its Adam moments
+    ckpt = tf.train.Checkpoint(model=model, optimizer=model.optimizer)
+    state_path = os.path.join(task['trial_dir'], 'state')
+    if task['epoch_from'] > 0 and os.path.exists(state_path + '.index'):
+        ckpt.read(state_path)
+
+    start = time.perf_counter()
+    model.fit(to_dataset(x_train, y_train, True), initial_epoch=task['epoch_from'],
+              epochs=task['epoch_to'], verbose=0)
+    train_seconds = time.perf_counter() - start
+    ckpt.write(state_path)
+
+    _, accuracy = model.evaluate(to_dataset(x_val, y_val, False), verbose=0)
+
+    return {
+        'trial': task['trial'],
+        'params': params,
+        'epochs': task['epoch_to'],
+        'val_accuracy': float(accuracy),
+        'train_seconds': round(train_seconds, 2),
+        'params_count': int(model.count_params()),
+    }
+
+
+def measure_latency(task: dict) -> float:
+    """Median single-image latency (ms) of a trained trial (runs alone in a worker process)"""
+    import tensorflow as tf
+
+    import training
+
+    # Same threading as the serving process
+    if config.TF_INTRA_OP_THREADS:
+        tf.config.threading.set_intra_op_parallelism_threads(config.TF_INTRA_OP_THREADS)
+    if config.TF_INTER_OP_THREADS:
+        tf.config.threading.set_inter_op_parallelism_threads(config.TF_INTER_OP_THREADS)
+
+    params = task['params']
+    model = training.build_model(task['num_classes'], params['dense_units'], params['dropout'])
+    model.build((None, *config.IMAGE_TARGET_SIZE, 3))
+    tf.train.Checkpoint(model=model).read(os.path.join(task['trial_dir'], 'state')).expect_partial()
+
+    sample = np.asarray(np.load(task['val'][0], mmap_mode='r')[:1], dtype=np.float32) / 255.0
+    model.predict_on_batch(sample)
+    timings = []
+    for _ in range(50):
+        t = time.perf_counter()
+        model.predict_on_batch(sample)
+        timings.append(time.perf_counter() - t)
+    return round(float(np.median(timings)) * 1000, 3)
+
+
+# ==================== Hyperband ==================== #
+def hyperband(args: argparse.Namespace, train_cache, val_cache) -> List[dict]:
+    """Run every Hyperband bracket, each one a successive-halving schedule"""
+    rng = random.Random(args.seed)
+    eta, max_epochs = args.eta, args.max_epochs
+    s_max = int(math.log(max_epochs) / math.log(eta) + 1e-9)
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    ctx = multiprocessing.get_context('spawn')
+    final: List[dict] = []
+    trial_counter = 0
+
+    with ctx.Pool(args.workers, maxtasksperchild=1) as pool, open(args.log, 'a') as log:
+        for s in range(s_max, -1, -1):
+            n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            trials = []
+            for _ in range(n):
+                trials.append({'trial': trial_counter, 'params': sample_params(rng), 'epochs': 0})
+                trial_counter += 1
+
+            for rung in range(s + 1):
+                budget = max(1, int(round(max_epochs * eta ** (rung - s))))
+                tasks = [{
+                    'trial': t['trial'], 'params': t['params'], 'seed': args.seed + t['trial'],
+                    'epoch_from': t['epochs'], 'epoch_to': budget, 'threads': threads,
+                    'train': train_cache, 'val': val_cache,
+                    'trial_dir': os.path.join(args.work_dir, f"trial_{t['trial']:04d}"),
+                } for t in trials]
+                for task in tasks:
+                    os.makedirs(task['trial_dir'], exist_ok=True)
+
+                results = pool.map(run_trial, tasks, chunksize=1)
+                for result in results:
+                    result.update(bracket=s, rung=rung)
+                    log.write(json.dumps(result) + '\n')
+                    log.flush()
+                    print(f"bracket {s} rung {rung} trial {result['trial']:>3}: "
+                          f"acc={result['val_accuracy']:.4f} "
+                          f"epochs={result['epochs']} ({result['train_seconds']}s)")
+
+                results.sort(key=lambda r: r['val_accuracy'], reverse=True)
+                if rung == s:
+                    final.extend(results)
+                    break
+                # Successive halving: only the top 1/eta continue to the next rung
+                keep = {r['trial'] for r in results[:max(1, len(results) // eta)]}
+                trials = [dict(t, epochs=budget) for t in trials if t['trial'] in keep]
+
+    # Latency of the final configurations, measured one at a time with no
+    # training running, so the numbers are comparable across trials
+    num_classes = int(max(np.load(train_cache[1]).max(), np.load(val_cache[1]).max())) + 1
+    with ctx.Pool(1, maxtasksperchild=1) as pool, open(args.log, 'a') as log:
+        for result in final:
+            result['latency_ms'] = pool.apply(measure_latency, ({
+                'params': result['params'], 'num_classes': num_classes, 'val': val_cache,
+                'trial_dir': os.path.join(args.work_dir, f"trial_{result['trial']:04d}"),
+            },))
+            log.write(json.dumps(result) + '\n')
+            log.flush()
+            print(f"trial {result['trial']:>3}: latency={result['latency_ms']}ms")
+    return final
+
+
+def pareto_front(results: List[dict]) -> List[dict]:
+    """Trials not beaten on both accuracy and latency by any other trial"""
+    front = []
+    for r in sorted(results, key=lambda r: (r['latency_ms'], -r['val_accuracy'])):
+        if not front or r['val_accuracy'] > front[-1]['val_accuracy']:
+            front.append(r)
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel Hyperband hyperparameter search")
+    parser.add_argument('--train-dir', required=True)
+    parser.add_argument('--val-dir', required=True)
+    parser.add_argument('--workers', type=int, default=4, help="Trials trained in parallel")
+    parser.add_argument('--max-epochs', type=int, default=27, help="Epoch budget of a full trial")
+    parser.add_argument('--eta', type=int, default=3, help="Halving rate between rungs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache-dir', default='dataset_cache')
+    parser.add_argument('--work-dir', default='hparam_trials')
+    parser.add_argument('--log', default='hparam_trials.jsonl')
+    args = parser.parse_args()
+
+    manifest.refresh(args.train_dir, args.val_dir)
+    train_cache = cache_split(args.train_dir, args.cache_dir, 'train')
+    val_cache = cache_split(args.val_dir, args.cache_dir, 'validation')
+    results = hyperband(args, train_cache, val_cache)
+
+    print("\nPareto front (accuracy vs single-image latency):")
+    for r in pareto_front(results):
+        print(f"  acc={r['val_accuracy']:.4f} latency={r['latency_ms']}ms "
+              f"epochs={r['epochs']} params={json.dumps(r['params'])}")
+
+
+if __name__ == '__main__':
+    main()
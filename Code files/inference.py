@@ -0,0 +1,164 @@
+"""
+GreenClassify - Model Inference
+Shared model loading and batched prediction for the app and offline tools
+
+INFERENCE_BACKEND selects how predictions are computed:
+    'keras'  vegetable_classifier.h5 through TensorFlow
+    'mmap'   the exported weight file, memory-mapped and shared between
+             processes (weights_mmap.py); TensorFlow is never imported
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+import numpy as np
+
+import config
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+
+_lock = threading.Lock()
+_model: Optional['tf.keras.Model'] = None
+_embedding_model: Optional['tf.keras.Model'] = None
+_gradcam_model: Optional['tf.keras.Model'] = None
+_class_map: Optional[Dict[int, str]] = None
+_model_version: Optional[str] = None
+
+
+def _configure_threads(tf):
+    """Apply TF_*_OP_THREADS (set by the CPU profile) before TensorFlow runs its first op"""
+    try:
+        if config.TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(config.TF_INTRA_OP_THREADS)
+        if config.TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(config.TF_INTER_OP_THREADS)
+    except RuntimeError:
+        pass  # TensorFlow was already initialized elsewhere in this process
+
+
+def get_model() -> 'tf.keras.Model':
+    """Load vegetable_classifier.h5 once and reuse it (CACHE_MODEL)"""
+    global _model
+    if _model is not None and config.CACHE_MODEL:
+        return _model
+    with _lock:
+        if _model is None or not config.CACHE_MODEL:
+            import tensorflow as tf
+            _configure_threads(tf)
+            _model = tf.keras.models.load_model(config.MODEL_PATH)
+        return _model
+
+
+def get_class_map() -> Dict[int, str]:
+    """Index -> class name, falling back to DEFAULT_CLASSES"""
+    global _class_map
+    if _class_map is None:
+        if os.path.exists(config.CLASS_MAP_PATH):
+            with open(config.CLASS_MAP_PATH, 'rb') as f:
+                _class_map = pickle.load(f)
+        else:
+            _class_map = dict(config.DEFAULT_CLASSES)
+    return _class_map
+
+
+def file_version(path: str) -> str:
+    """Short content hash of a model file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def model_version() -> str:
+    """Short content hash of the model file, used to key caches and logs"""
+    global _model_version
+    if _model_version is None:
+        if config.INFERENCE_BACKEND == 'mmap':
+            # The export records the hash of the .h5 it was made from
+            import weights_mmap
+            _model_version = weights_mmap.get_mapped_model().source_version
+        else:
+            _model_version = file_version(config.MODEL_PATH)
+    return _model_version
+
+
+def predict(batch: np.ndarray) -> np.ndarray:
+    """Class probabilities for a (N, H, W, 3) batch"""
+    if config.INFERENCE_BACKEND == 'mmap':
+        import weights_mmap
+        return weights_mmap.get_mapped_model().predict(batch)
+    return get_model().predict_on_batch(batch)
+
+
+def get_embedding_model() -> 'tf.keras.Model':
+    """Model returning (penultimate Dense activations, probabilities)"""
+    global _embedding_model
+    if _embedding_model is None:
+        import tensorflow as tf
+        model = get_model()
+        # The last Dense layer before the softmax output (Dense(128) in the notebook)
+        penultimate = next(layer for layer in reversed(model.layers[:-1])
+                           if isinstance(layer, tf.keras.layers.Dense))
+        _embedding_model = tf.keras.Model(inputs=model.inputs,
+                                          outputs=[penultimate.output, model.output])
+    return _embedding_model
+
+
+def predict_with_embeddings(batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Probabilities and 128-d embeddings from a single forward pass"""
+    if config.INFERENCE_BACKEND == 'mmap':
+        import weights_mmap
+        return weights_mmap.get_mapped_model().predict_with_embeddings(batch)
+    embeddings, probs = get_embedding_model().predict_on_batch(batch)
+    return np.asarray(probs), np.asarray(embeddings, dtype=np.float32)
+
+
+def get_gradcam_model() -> 'tf.keras.Model':
+    """Model returning (last Conv2D feature maps, input of the output layer)"""
+    global _gradcam_model
+    if _gradcam_model is None:
+        import tensorflow as tf
+        model = get_model()
+        last_conv = next(layer for layer in reversed(model.layers)
+                         if isinstance(layer, tf.keras.layers.Conv2D))
+        _gradcam_model = tf.keras.Model(inputs=model.inputs,
+                                        outputs=[last_conv.output, model.layers[-1].input])
+    return _gradcam_model
+
+
+def gradcam(batch: np.ndarray, classes: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Grad-CAM maps in [0, 1] at conv resolution, and the class index each map is for
+
+    Each map explains classes[i] (the label the user was shown); a negative
+    or missing entry means the Keras model's own top class. Uses the Keras
+    model under either backend. Gradients are taken of the class score
+    before the softmax, which does not saturate on confident predictions.
+    """
+    import tensorflow as tf
+    head = get_model().layers[-1]
+    with tf.GradientTape() as tape:
+        features, hidden = get_gradcam_model()(tf.convert_to_tensor(batch), training=False)
+        logits = tf.matmul(hidden, head.kernel) + head.bias
+        top = tf.argmax(logits, axis=1)
+        if classes is not None:
+            requested = tf.convert_to_tensor(np.asarray(classes, dtype=np.int64))
+            top = tf.where(requested >= 0, requested, top)
+        scores = tf.gather(logits, top, axis=1, batch_dims=1)
+    # Samples are independent, so the gradient of the sum is each sample's own gradient
+    grads = tape.gradient(scores, features)
+    weights = tf.reduce_mean(grads, axis=(1, 2))
+    cams = tf.nn.relu(tf.einsum('bhwc,bc->bhw', features, weights))
+    cams = cams / (tf.reduce_max(cams, axis=(1, 2), keepdims=True) + 1e-8)
+    return cams.numpy(), top.numpy()
+
+
+def top_prediction(probs: np.ndarray) -> Tuple[str, float]:
+    """Class name and confidence (0-100) for one probability vector"""
+    index = int(np.argmax(probs))
+    return get_class_map().get(index, str(index)), float(probs[index]) * 100
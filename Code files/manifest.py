@@ -0,0 +1,229 @@
+"""
+GreenClassify - Dataset Manifest
+Indexed SQLite record of every dataset image, updated incrementally
+
+Each row holds split, class, path, size, dimensions, mtime and SHA-256 of
+one image. An update only lists directories whose mtime changed (files were
+added or removed) and only re-reads files whose mtime or size changed, so a
+rescan of an unchanged network-mounted dataset is mostly stat calls.
+Class or split directories that no longer exist are dropped from it.
+
+The training scripts call refresh() once before they start (in the launcher,
+never in each distributed worker). training.list_images
+only reads it, and only for a split whose class folders and their mtimes
+still match what the manifest recorded; otherwise it lists the folders.
+
+Usage:
+    python manifest.py build "Vegetable Images"     # train/validation/test below it
+    python manifest.py counts
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import config
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    split_dir TEXT NOT NULL,
+    class TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_split_class ON images (split_dir, class);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+
+def _describe(path: str) -> Tuple[int, Optional[int], Optional[int], str]:
+    """Size, dimensions (header only) and content hash of one image"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+        size = f.tell()
+        f.seek(0)
+        try:
+            with Image.open(f) as img:
+                width, height = img.size
+        except OSError:
+            width = height = None
+    return size, width, height, digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path: str = config.MANIFEST_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def update(self, root: str, trust_directories: bool = False) -> Dict[str, int]:
+        """Sync the manifest with <root>/<split>/<class>/<image> on disk"""
+        root = os.path.abspath(root)
+        stats = {'listed_dirs': 0, 'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        known_dirs = dict(self.conn.execute("SELECT path, mtime FROM directories"))
+        seen = set()
+
+        for split in sorted(os.listdir(root)):
+            split_dir = os.path.join(root, split)
+            if not os.path.isdir(split_dir):
+                continue
+            for class_name in sorted(os.listdir(split_dir)):
+                class_dir = os.path.join(split_dir, class_name)
+                if os.path.isdir(class_dir):
+                    seen.add((split_dir, class_name))
+                    self._update_class_dir(split_dir, class_name, class_dir, known_dirs,
+                                           trust_directories, stats)
+        self._purge_missing(root, seen, stats)
+        self.conn.commit()
+        return stats
+
+    def _purge_missing(self, root: str, seen: set, stats: Dict[str, int]):
+        """Drop rows of class directories under root that were not found on disk"""
+        prefix = root + os.sep
+        for split_dir, class_name in self.conn.execute(
+                "SELECT DISTINCT split_dir, class FROM images").fetchall():
+            if split_dir.startswith(prefix) and (split_dir, class_name) not in seen:
+                cursor = self.conn.execute("DELETE FROM images WHERE split_dir = ? AND class = ?",
+                                           (split_dir, class_name))
+                stats['removed'] += cursor.rowcount
+                self.conn.execute("DELETE FROM directories WHERE path = ?",
+                                  (os.path.join(split_dir, class_name),))
+
+    def _update_class_dir(self, split_dir: str, class_name: str, class_dir: str,
+                          known_dirs: Dict[str, float], trust_directories: bool, stats: Dict[str, int]):
+        dir_mtime = os.stat(class_dir).st_mtime
+        rows = {path: (size, mtime) for path, size, mtime in self.conn.execute(
+            "SELECT path, size, mtime FROM images WHERE split_dir = ? AND class = ?",
+            (split_dir, class_name))}
+
+        if known_dirs.get(class_dir) == dir_mtime:
+            # No files were added or removed; optionally skip per-file stats too
+            if trust_directories:
+                stats['unchanged'] += len(rows)
+                return
+            names = None
+        else:
+            stats['listed_dirs'] += 1
+            names = [n for n in os.listdir(class_dir) if n.lower().endswith(IMAGE_EXTENSIONS)]
+
+        paths = list(rows) if names is None else [os.path.join(class_dir, n) for n in names]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            previous = rows.get(path)
+            if previous == (stat.st_size, stat.st_mtime):
+                stats['unchanged'] += 1
+                continue
+            size, width, height, digest = _describe(path)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, split_dir, class_name, size, width, height, stat.st_mtime, digest))
+            stats['changed' if previous else 'added'] += 1
+
+        if names is not None:
+            removed = set(rows) - set(paths)
+            self.conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in removed])
+            stats['removed'] += len(removed)
+        self.conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (class_dir, dir_mtime))
+
+    def _class_dirs(self, split_dir: str) -> Dict[str, float]:
+        """Class name -> recorded mtime for every class folder of a split, empty ones included"""
+        return {os.path.basename(path): mtime for path, mtime in
+                self.conn.execute("SELECT path, mtime FROM directories")
+                if os.path.dirname(path) == split_dir}
+
+    def is_current(self, directory: str) -> bool:
+        """True if no class folder of the split was added, removed or had files added/removed"""
+        split_dir = os.path.abspath(directory)
+        try:
+            on_disk = {name: os.stat(os.path.join(split_dir, name)).st_mtime
+                       for name in os.listdir(split_dir) if os.path.isdir(os.path.join(split_dir, name))}
+        except FileNotFoundError:
+            return False
+        return on_disk == self._class_dirs(split_dir)
+
+    def has_split(self, directory: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM images WHERE split_dir = ? LIMIT 1",
+                                (os.path.abspath(directory),)).fetchone()
+        return row is not None
+
+    def samples(self, directory: str) -> Tuple[List[str], List[int], List[str]]:
+        """Paths, label indices and class names for one split, like training.list_images"""
+        split_dir = os.path.abspath(directory)
+        rows = self.conn.execute(
+            "SELECT path, class FROM images WHERE split_dir = ? ORDER BY class, path",
+            (split_dir,)).fetchall()
+        # Every class folder counts, even an empty one, so indices match a directory listing
+        class_names = sorted(set(self._class_dirs(split_dir)) | {class_name for _, class_name in rows})
+        index = {name: i for i, name in enumerate(class_names)}
+        return [p for p, _ in rows], [index[c] for _, c in rows], class_names
+
+    def counts(self) -> Dict[str, Tuple[int, int]]:
+        """Images and classes per split (replaces the notebook's count_images)"""
+        return {os.path.basename(split_dir): (images, classes) for split_dir, images, classes in
+                self.conn.execute("SELECT split_dir, COUNT(*), COUNT(DISTINCT class) "
+                                  "FROM images GROUP BY split_dir")}
+
+    def close(self):
+        self.conn.close()
+
+
+def refresh(*directories: Optional[str], path: str = config.MANIFEST_PATH):
+    """Update the manifest for the dataset roots of these splits, if it covers them
+
+    A full update, so files edited in place are re-hashed too.
+    """
+    if not os.path.exists(path):
+        return
+    manifest = Manifest(path)
+    try:
+        covered = [d for d in directories if d and manifest.has_split(d)]
+        for root in sorted({os.path.dirname(os.path.abspath(d)) for d in covered}):
+            print(f"Manifest refreshed for {root}: {manifest.update(root)}")
+    finally:
+        manifest.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the dataset manifest")
+    parser.add_argument('--manifest', default=config.MANIFEST_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Create or incrementally update the manifest")
+    build.add_argument('root', help="Dataset folder containing train/validation/test")
+    build.add_argument('--trust-directories', action='store_true',
+                       help="Skip per-file checks in directories whose mtime is unchanged")
+    sub.add_parser('counts', help="Images and classes per split")
+    args = parser.parse_args()
+
+    manifest = Manifest(args.manifest)
+    if args.command == 'build':
+        start = time.perf_counter()
+        stats = manifest.update(args.root, args.trust_directories)
+        print(f"Manifest updated in {time.perf_counter() - start:.1f}s: {stats}")
+    for split, (images, classes) in sorted(manifest.counts().items()):
+        print(f"Found {images} images belonging to {classes} classes in {split}.")
+    manifest.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+GreenClassify - Near-Duplicate Lookup
+Perceptual hashes (pHash/dHash) in a BK-tree to skip inference on re-uploads
+
+Re-encoded, resized or screenshotted copies of a photo change every byte
+but keep a 64-bit perceptual hash within a few bits, so a Hamming-radius
+lookup finds them and /predict can return the stored prediction.
+
+Stored labels belong to the model that produced them: each model version
+has its own file (phash_index.<version>.bin), and the index starts over
+from that file when it is asked about a different version. Every worker
+process appends to the same file and reads the records the others added
+when it sees the file grow.
+
+A sampled share of hits is re-run through the model anyway. The metrics
+report how often the stored label disagreed with the model's answer; the
+model is the reference here, not ground truth.
+
+Usage in app.py /predict (batch_api and resumable_upload do the same):
+    phash = near_duplicates.compute(img) if near_duplicates.enabled() else None
+    match = near_duplicates.lookup(phash, model_version)
+    if match and not near_duplicates.should_verify():
+        return ...match.label, match.confidence...
+    ...run the model...
+    if match:
+        near_duplicates.verify(match, predicted_vegetable)
+    near_duplicates.add(phash, predicted_vegetable, confidence, model_version)
+"""
+
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify
+from PIL import Image
+
+import config
+
+
+RECORD_DTYPE = np.dtype([('hash', '<u8'), ('label', 'S32'), ('confidence', '<f4')])
+
+
+# ==================== Hashing ==================== #
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+_DCT32 = _dct_matrix(32)
+_BIT_WEIGHTS = (1 << np.arange(63, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def _pack_bits(bits: np.ndarray) -> int:
+    return int(np.sum(_BIT_WEIGHTS[bits.ravel()]))
+
+
+def dhash(img: Image.Image) -> int:
+    """Difference hash: sign of horizontal gradients on a 9x8 grayscale"""
+    gray = np.asarray(img.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    return _pack_bits(gray[:, 1:] > gray[:, :-1])
+
+
+def phash(img: Image.Image) -> int:
+    """DCT hash: low 8x8 frequencies of a 32x32 grayscale against their median"""
+    gray = np.asarray(img.convert('L').resize((32, 32), Image.BOX), dtype=np.float32)
+    freq = (_DCT32 @ gray @ _DCT32.T)[:8, :8].ravel()
+    return _pack_bits(freq > np.median(freq[1:]))
+
+
+def compute(img: Image.Image) -> int:
+    """Hash an already decoded upload with the configured algorithm"""
+    return dhash(img) if config.PHASH_ALGORITHM == 'dhash' else phash(img)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+# ==================== BK-Tree ==================== #
+class BKTree:
+    """Metric tree over Hamming distance; children keyed by distance to parent"""
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, payload, {distance: child}]
+        self.size = 0
+
+    def add(self, key: int, payload) -> bool:
+        """Insert a hash; returns False if the exact hash is already present"""
+        if self.root is None:
+            self.root = [key, payload, {}]
+            self.size = 1
+            return True
+        node = self.root
+        while True:
+            d = hamming(key, node[0])
+            if d == 0:
+                return False
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [key, payload, {}]
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, key: int, radius: int) -> List[Tuple[int, int, object]]:
+        """All (distance, hash, payload) within radius, closest first"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(key, node[0])
+            if d <= radius:
+                results.append((d, node[0], node[1]))
+            # Triangle inequality: only children in [d - r, d + r] can match
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        results.sort(key=lambda r: r[0])
+        return results
+
+
+class Match:
+    def __init__(self, phash: int, label: str, confidence: float, distance: int):
+        self.phash = phash
+        self.label = label
+        self.confidence = confidence
+        self.distance = distance
+
+
+class NearDuplicateIndex:
+    def __init__(self, path: str = config.PHASH_INDEX_PATH):
+        self.base_path = path
+        self.path: Optional[str] = None
+        self.model_version: Optional[str] = None
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+        self._loaded = 0  # bytes of self.path already in the tree
+        self.stats: Dict[str, int] = {'lookups': 0, 'hits': 0, 'verified': 0, 'disagreements': 0}
+
+    def _use_version(self, model_version: str):
+        """Load the hashes stored for this model version (caller holds the lock)"""
+        if model_version != self.model_version:
+            root, ext = os.path.splitext(self.base_path)
+            self.path = f'{root}.{model_version}{ext}'
+            self.model_version = model_version
+            self.tree = BKTree()
+            self._loaded = 0
+        self._refresh()
+
+    def _refresh(self):
+        """Add the records other processes appended since the last read (caller holds the lock)"""
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            return
+        # Whole records only; one still being appended is read next time
+        count = (size - self._loaded) // RECORD_DTYPE.itemsize
+        if count <= 0:
+            return
+        records = np.fromfile(self.path, dtype=RECORD_DTYPE, count=count, offset=self._loaded)
+        for record in records:
+            self.tree.add(int(record['hash']), (record['label'].decode(), float(record['confidence'])))
+        self._loaded += count * RECORD_DTYPE.itemsize
+
+    def lookup(self, key: int, model_version: str, radius: int = config.PHASH_MAX_DISTANCE) -> Optional[Match]:
+        """Closest prediction of this model version within the Hamming radius"""
+        with self._lock:
+            self._use_version(model_version)
+            found = self.tree.search(key, radius)
+            self.stats['lookups'] += 1
+            if not found:
+                return None
+            self.stats['hits'] += 1
+        distance, stored, (label, confidence) = found[0]
+        return Match(stored, label, confidence, distance)
+
+    def add(self, key: int, label: str, confidence: float, model_version: str):
+        """Store a model prediction for future lookups"""
+        with self._lock:
+            self._use_version(model_version)
+            if not self.tree.add(key, (label, float(confidence))):
+                return
+            record = np.array([(key, label.encode()[:32], confidence)], dtype=RECORD_DTYPE)
+            with open(self.path, 'ab') as f:
+                f.write(record.tobytes())
+
+    def verify(self, match: Match, model_label: str):
+        """Compare a reused prediction with what the model says for this upload"""
+        with self._lock:
+            self.stats['verified'] += 1
+            if match.label != model_label:
+                self.stats['disagreements'] += 1
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['indexed'] = self.tree.size
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        stats['model_disagreement_rate'] = (stats['disagreements'] / stats['verified']
+                                            if stats['verified'] else 0.0)
+        return stats
+
+
+# ==================== Flask Integration ==================== #
+phash_bp = Blueprint('near_duplicates', __name__)
+_index: Optional[NearDuplicateIndex] = None
+
+
+def enabled() -> bool:
+    return _index is not None
+
+
+def lookup(key: Optional[int], model_version: str) -> Optional[Match]:
+    if _index is None or key is None:
+        return None
+    return _index.lookup(key, model_version)
+
+
+def add(key: Optional[int], label: str, confidence: float, model_version: str):
+    if _index is not None and key is not None:
+        _index.add(key, label, confidence, model_version)
+
+
+def verify(match: Match, model_label: str):
+    if _index is not None:
+        _index.verify(match, model_label)
+
+
+def should_verify() -> bool:
+    """Sample a share of hits to re-run through the model as ground truth"""
+    return random.random() < config.PHASH_VERIFY_RATE
+
+
+@phash_bp.route('/metrics/near-duplicates')
+def near_duplicate_metrics():
+    return jsonify(_index.metrics())
+
+
+def init_app(app: Flask) -> Optional[NearDuplicateIndex]:
+    """Set up the index (loaded per model version on first use) and register the metrics endpoint"""
+    global _index
+    if not config.PHASH_ENABLED:
+        return None
+    _index = NearDuplicateIndex(os.path.join(app.root_path, config.PHASH_INDEX_PATH))
+    app.register_blueprint(phash_bp)
+    return _index
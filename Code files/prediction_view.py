@@ -0,0 +1,59 @@
+"""
+GreenClassify - Prediction Responses
+One prediction, rendered as prediction.html for form posts or as JSON for main.js
+
+main.js submits the upload form with XHR and Accept: application/json and
+updates the page in place, so those requests get a small JSON body and never
+touch Jinja. Form posts without JavaScript still get the full results page.
+
+    {"vegetable": "Broccoli", "confidence": 97.12,
+     "image_url": "/uploads/a.jpg", "thumbnail_url": "/uploads/a_jpg_thumb.webp",
+     "explain_url": "/explain/a.jpg?label=Broccoli"}
+
+With EMIT_EMBEDDINGS on, a freshly computed prediction also carries its
+128-d "embedding" (the vector /similar accepts).
+
+Errors are {"error": "..."} with status 400.
+
+Usage in app.py /predict (in place of render_template("prediction.html", ...)):
+    return prediction_view.respond(predicted_vegetable, confidence=confidence,
+                                   image_url=image_url, thumbnail_url=thumbnail_url,
+                                   embedding=embedding)
+    ...
+    return prediction_view.respond(str(e), error=True)
+"""
+
+from typing import Optional
+
+import numpy as np
+from flask import current_app, jsonify, render_template, request, url_for
+
+import config
+
+
+def wants_json() -> bool:
+    """True when the client asked for JSON ahead of HTML (main.js does)"""
+    return request.accept_mimetypes.best == 'application/json'
+
+
+def prediction_json(vegetable: str, confidence: Optional[float] = None, image_url: Optional[str] = None,
+                    thumbnail_url: Optional[str] = None, embedding: Optional[np.ndarray] = None) -> dict:
+    payload = {'vegetable': vegetable, 'confidence': confidence,
+               'image_url': image_url, 'thumbnail_url': thumbnail_url}
+    if image_url and 'explain' in current_app.blueprints:
+        payload['explain_url'] = url_for('explain.explain_upload', filename=image_url.rsplit('/', 1)[-1],
+                                         label=vegetable)
+    if embedding is not None and config.EMIT_EMBEDDINGS:
+        payload['embedding'] = np.asarray(embedding).tolist()
+    return payload
+
+
+def respond(result: str, confidence: Optional[float] = None, image_url: Optional[str] = None,
+            thumbnail_url: Optional[str] = None, error: bool = False, embedding: Optional[np.ndarray] = None):
+    """A prediction (or an error message in result) for the current request"""
+    if wants_json():
+        if error:
+            return jsonify(error=result), 400
+        return jsonify(prediction_json(result, confidence, image_url, thumbnail_url, embedding))
+    return render_template("prediction.html", result=result, confidence=confidence,
+                           image_url=image_url, thumbnail_url=thumbnail_url, error=error)
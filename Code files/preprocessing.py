@@ -0,0 +1,139 @@
+"""
+GreenClassify - Image Preprocessing
+Upload validation, fast decoding and model input preparation
+
+Usage in app.py /predict:
+    try:
+        img = preprocessing.load_upload(file.stream, file.filename,
+                                        client_resized=request.form.get('client_resized') == '1')
+    except preprocessing.UploadError as e:
+        return prediction_view.respond(str(e), error=True)
+    thumb_name = preprocessing.save_thumbnail(img, filename)
+    predictions = model.predict(preprocessing.prepare_input(img))
+"""
+
+import hashlib
+import os
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+from flask import Flask
+from PIL import Image, UnidentifiedImageError, features
+
+import config
+
+
+# PIL format names for the extensions in config.ALLOWED_EXTENSIONS
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+
+# Pillow only raises DecompressionBombError above twice this (and warns
+# in between), so check_pixel_count() enforces the limit itself
+Image.MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS
+
+
+class UploadError(ValueError):
+    """Raised when an upload is not a usable image"""
+
+
+def allowed_file(filename: str) -> bool:
+    """Check the file extension against ALLOWED_EXTENSIONS"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
+
+
+def content_hash(stream: BinaryIO) -> str:
+    """SHA-256 of the uploaded bytes; rewinds the stream afterwards"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def check_pixel_count(img: Image.Image):
+    """Refuse decompression bombs from the header, before any pixels are decoded"""
+    width, height = img.size
+    if width * height > config.MAX_IMAGE_PIXELS:
+        raise UploadError("The uploaded image has too many pixels.")
+
+
+def load_upload(stream: BinaryIO, filename: str, client_resized: bool = False,
+                draft_edge: Optional[int] = None) -> Image.Image:
+    """Validate an uploaded image and decode it to RGB (at least draft_edge px if given)"""
+    if not filename or not allowed_file(filename):
+        raise UploadError("Unsupported file type. Please upload PNG, JPG, JPEG, GIF or WEBP.")
+
+    try:
+        img = Image.open(stream)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise UploadError("The uploaded file is not a valid image.")
+
+    if img.format not in ALLOWED_FORMATS:
+        raise UploadError("Unsupported image format.")
+    check_pixel_count(img)
+
+    # Browser-resized payloads must honour the advertised limit
+    max_edge = config.CLIENT_RESIZE_MAX_EDGE
+    if client_resized and max(img.size) > max_edge:
+        raise UploadError(f"Resized image exceeds {max_edge}px on its longest edge.")
+
+    # JPEG can decode directly at 1/2, 1/4 or 1/8 scale, which skips most
+    # of the work for full-size phone photos; other formats are unaffected
+    draft_edge = draft_edge or max_edge
+    img.draft('RGB', (draft_edge, draft_edge))
+
+    try:
+        return img.convert('RGB')
+    except (OSError, ValueError):
+        raise UploadError("The uploaded image is corrupt or truncated.")
+
+
+def prepare_input(img: Image.Image, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Resize and normalize an image into a (1, H, W, 3) model batch"""
+    height, width = size or config.IMAGE_TARGET_SIZE
+    # Nearest-neighbour matches keras load_img / flow_from_directory defaults
+    resized = img.resize((width, height), Image.NEAREST)
+    arr = np.asarray(resized, dtype=np.float32)
+    if config.IMAGE_NORMALIZATION:
+        arr = arr / 255.0
+    return arr[np.newaxis]
+
+
+def thumbnail_filename(filename: str) -> str:
+    """Name of the thumbnail stored next to an upload (foo.jpg -> foo_jpg_thumb.webp)"""
+    ext = 'webp' if _thumbnail_format() == 'WEBP' else 'jpg'
+    # Keep the original extension so foo.jpg and foo.png get different thumbnails
+    root, original_ext = os.path.splitext(filename)
+    if original_ext:
+        root = f"{root}_{original_ext[1:].lower()}"
+    return f"{root}{config.THUMBNAIL_SUFFIX}.{ext}"
+
+
+def _thumbnail_format() -> str:
+    """Use WebP when Pillow was built with it, JPEG otherwise"""
+    fmt = config.THUMBNAIL_FORMAT.upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return fmt
+
+
+def save_thumbnail(img: Image.Image, filename: str) -> str:
+    """Write a small preview of an already decoded upload, return its name"""
+    thumb = img.copy()
+    edge = config.THUMBNAIL_MAX_EDGE
+    thumb.thumbnail((edge, edge), Image.BILINEAR)
+
+    name = thumbnail_filename(filename)
+    thumb.save(os.path.join(config.UPLOAD_FOLDER, name), _thumbnail_format(),
+               quality=config.THUMBNAIL_QUALITY, optimize=True)
+    return name
+
+
+def init_app(app: Flask):
+    """Expose the client-side resize settings to index.html"""
+    @app.context_processor
+    def client_resize_settings():
+        return {
+            'client_resize_enabled': config.CLIENT_RESIZE_ENABLED,
+            'client_resize_max_edge': config.CLIENT_RESIZE_MAX_EDGE,
+            'client_resize_quality': config.CLIENT_RESIZE_QUALITY,
+        }
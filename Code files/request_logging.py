@@ -0,0 +1,247 @@
+"""
+GreenClassify - Request Logging
+Non-blocking structured JSON logs for /predict with size and time rotation
+
+Request threads only push a record onto a bounded queue; a background
+listener thread formats and writes it. When the queue is filling up records
+are sampled, and when it is full they are dropped instead of blocking.
+
+Usage in app.py:
+    import request_logging
+    request_logging.init_app(app)
+    ...
+    request_logging.log_prediction(result=predicted_vegetable, confidence=confidence,
+                                   timings=timings, cache_hit=False,
+                                   model_version=model_version)
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, List, Optional
+
+from flask import Flask
+
+import config
+
+
+LOGGER_NAME = 'greenclassify.requests'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        """Render one log record as a single JSON line"""
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class SizeAndTimeRotatingFileHandler(TimedRotatingFileHandler):
+    """Rotate on a schedule, or earlier once the file exceeds max_bytes
+
+    Scheduled rollovers are named app.log.2026-10-19 as usual; size rollovers
+    within that period get an index, app.log.2026-10-19.1, .2, ..., so they
+    never overwrite each other. backupCount counts both kinds.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+        self._size_rollover = False
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        self._size_rollover = False
+        if super().shouldRollover(record):
+            return 1
+        if self.max_bytes > 0 and self.stream is not None:
+            if self.stream.tell() >= self.max_bytes:
+                self._size_rollover = True
+                return 1
+        return 0
+
+    def doRollover(self):
+        if not self._size_rollover:
+            super().doRollover()
+            return
+        self._size_rollover = False
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        period_start = self.rolloverAt - self.interval
+        period = time.strftime(self.suffix, time.gmtime(period_start) if self.utc else time.localtime(period_start))
+        # One past the highest index of this period, so a freed low index is not reused
+        index = 1 + max((order for (backup_period, order), _ in self._backups()
+                         if backup_period == period and order != float('inf')), default=0)
+        self.rotate(self.baseFilename, self.rotation_filename(f'{self.baseFilename}.{period}.{index}'))
+        if self.backupCount > 0:
+            for path in self.getFilesToDelete():
+                os.remove(path)
+        if not self.delay:
+            self.stream = self._open()
+
+    def _backups(self) -> List[tuple]:
+        """((period, index), path) of every backup, oldest first"""
+        directory, base = os.path.split(self.baseFilename)
+        backups = []
+        for name in os.listdir(directory or '.'):
+            if not name.startswith(base + '.'):
+                continue
+            period, _, index = name[len(base) + 1:].partition('.')
+            try:
+                time.strptime(period, self.suffix)
+            except ValueError:
+                continue
+            if index and not index.isdigit():
+                continue
+            # Indexed size rollovers come before the scheduled rollover of their period
+            order = int(index) if index else float('inf')
+            backups.append(((period, order), os.path.join(directory, name)))
+        return sorted(backups)
+
+    def getFilesToDelete(self) -> List[str]:
+        """Backups beyond backupCount, oldest first"""
+        backups = self._backups()
+        return [path for _, path in backups[:max(0, len(backups) - self.backupCount)]]
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that samples under pressure and never blocks"""
+
+    def __init__(self, log_queue: queue.Queue, sample_rate: float):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.high_watermark = log_queue.maxsize // 2
+        self.enqueued = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread, not the request thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.high_watermark and random.random() >= self.sample_rate:
+            with self._lock:
+                self.sampled_out += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        with self._lock:
+            self.enqueued += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring log pressure"""
+        with self._lock:
+            return {
+                'enqueued': self.enqueued,
+                'sampled_out': self.sampled_out,
+                'dropped': self.dropped,
+                'queue_depth': self.queue.qsize(),
+            }
+
+
+_logger = logging.getLogger(LOGGER_NAME)
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def start(log_file: str = config.LOG_FILE):
+    """Start the background writer thread (idempotent)"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    file_handler = SizeAndTimeRotatingFileHandler(
+        log_file,
+        max_bytes=config.LOG_MAX_BYTES,
+        when=config.LOG_ROTATE_WHEN,
+        backupCount=config.LOG_BACKUP_COUNT,
+        encoding='utf-8',
+        delay=True,
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    _handler = DroppingQueueHandler(log_queue, config.LOG_SAMPLE_RATE)
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=False)
+    _listener.start()
+
+    _logger.setLevel(getattr(logging, config.LOG_LEVEL.upper(), logging.INFO))
+    _logger.addHandler(_handler)
+    _logger.propagate = False
+    atexit.register(stop)
+
+
+def stop():
+    """Flush queued records and stop the writer thread"""
+    global _handler, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _logger.removeHandler(_handler)
+    _handler = None
+    _listener = None
+
+
+def log_prediction(result: str, confidence: float, timings: Optional[Dict[str, float]] = None,
+                   cache_hit: bool = False, model_version: Optional[str] = None, **extra):
+    """Emit one structured line for a finished prediction"""
+    if _handler is None:
+        return
+    fields = {
+        'class': result,
+        'confidence': round(float(confidence), 4),
+        'timings_ms': {k: round(v * 1000, 2) for k, v in (timings or {}).items()},
+        'cache_hit': cache_hit,
+        'model_version': model_version,
+    }
+    fields.update(extra)
+    _logger.info('prediction', extra={'fields': fields})
+
+
+def stats() -> Dict[str, int]:
+    """Queue counters, or an empty dict when logging is disabled"""
+    return _handler.stats() if _handler is not None else {}
+
+
+class StageTimer:
+    """Collect per-stage durations: with timer.stage('inference'): ..."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def init_app(app: Flask):
+    """Start request logging if ENABLE_REQUEST_LOGGING is set"""
+    if config.ENABLE_REQUEST_LOGGING:
+        start(os.path.join(app.root_path, config.LOG_FILE))
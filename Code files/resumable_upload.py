@@ -0,0 +1,348 @@
+"""
+GreenClassify - Resumable Uploads
+Chunked upload sessions that survive dropped connections
+
+Protocol (ranges in JSON are [start, end) byte offsets):
+    POST   /upload/sessions                 {"filename", "size", "sha256"?}
+           -> 201 {"session_id", "chunk_size", "received": []}
+    PUT    /upload/sessions/<id>            body = one chunk,
+           Content-Range: bytes <first>-<last>/<size>
+           -> 202 {"received": [[0, 524288]], "complete": false}
+           -> 200 {"complete": true, "result": {...}} on the final chunk
+    GET    /upload/sessions/<id>            -> received ranges, "processing" while the
+                                               finished file is classified, then the result
+    GET    /upload/sessions/<id>/result     -> prediction.html for the finished upload
+    DELETE /upload/sessions/<id>            -> abandon the upload
+
+Chunks are written in place into a preallocated file and each stored range
+is appended to a log next to it. All session state lives on disk, so chunks
+of one upload may reach different worker processes, and a client that lost
+its connection asks which ranges arrived and sends only the rest. The chunk
+that completes the file claims the session and classifies the assembled
+image straight away; the checksum is verified first when the client sent
+one. Only that chunk goes through admission control (it is the one that
+runs the model). When it is shed with 429/503 its bytes are kept, and the
+session reads complete but not processing until the client sends that
+chunk again.
+
+Usage in app.py:
+    import resumable_upload
+    resumable_upload.init_app(app)
+
+    @app.route("/uploads/<filename>")
+    def uploaded_file(filename): ...    # used for the result image URLs
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from flask import Blueprint, Flask, abort, jsonify, render_template, request, url_for
+from werkzeug.utils import secure_filename
+
+import admission
+import config
+import explain
+import history_store
+import near_duplicates
+import prediction_view
+import preprocessing
+import shared_store
+import similarity_index
+
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{22}$')
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+SWEEP_INTERVAL = 60.0
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+_session_folder = config.UPLOAD_SESSION_FOLDER  # under app.root_path once init_app has run
+
+
+# ==================== Session Files ==================== #
+def _path(session_id: str, suffix: str) -> str:
+    return os.path.join(_session_folder, f'{session_id}{suffix}')
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _load_session(session_id: str) -> dict:
+    if not SESSION_ID_PATTERN.match(session_id):
+        abort(404)
+    meta = _read_json(_path(session_id, '.json'))
+    if meta is None:
+        abort(404)
+    return meta
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[List[int]]:
+    """Sorted, non-overlapping [start, end) ranges covering the same bytes"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def received_ranges(session_id: str) -> List[List[int]]:
+    try:
+        with open(_path(session_id, '.ranges')) as f:
+            pairs = [line.split() for line in f]
+    except FileNotFoundError:
+        return []
+    # A torn final line from a crashed writer is ignored; its chunk is resent
+    return merge_ranges([(int(p[0]), int(p[1])) for p in pairs if len(p) == 2])
+
+
+def _remove_session(session_id: str):
+    for suffix in ('.part', '.ranges', '.done', '.result.json', '.json'):
+        try:
+            os.remove(_path(session_id, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def sweep_expired():
+    """Delete sessions older than UPLOAD_SESSION_TTL (at most once a minute)"""
+    global _last_sweep
+    now = time.time()
+    with _sweep_lock:
+        if now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    for name in os.listdir(_session_folder):
+        if name.endswith('.json') and not name.endswith('.result.json'):
+            meta = _read_json(os.path.join(_session_folder, name))
+            if meta is None or now - meta.get('created', 0) > config.UPLOAD_SESSION_TTL:
+                _remove_session(name[:-len('.json')])
+
+
+# ==================== Classification ==================== #
+def _file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return preprocessing.content_hash(f)
+
+
+def finish_upload(session_id: str, meta: dict) -> dict:
+    """Verify, move and classify an assembled upload; store and return the result"""
+    import inference
+
+    part_path = _path(session_id, '.part')
+    digest = _file_sha256(part_path)
+    if meta.get('sha256') and meta['sha256'].lower() != digest:
+        raise preprocessing.UploadError("The uploaded file does not match its checksum; please upload it again.")
+
+    filename = f"{digest[:12]}_{secure_filename(meta['filename'])}"
+    with open(part_path, 'rb') as f:
+        img = preprocessing.load_upload(f, filename)
+    path = os.path.join(config.UPLOAD_FOLDER, filename)
+    shutil.move(part_path, path)
+    thumb_name = preprocessing.save_thumbnail(img, filename)
+
+    model_version = inference.model_version()
+    result = shared_store.get_result(digest, model_version)
+    embedding = None
+    if result is None:
+        phash = near_duplicates.compute(img) if near_duplicates.enabled() else None
+        match = near_duplicates.lookup(phash, model_version)
+        if match and not near_duplicates.should_verify():
+            result = {'vegetable': match.label, 'confidence': round(match.confidence, 2)}
+        else:
+            batch = preprocessing.prepare_input(img)
+            explain.remember_input(digest, batch)
+            with admission.model_call():
+                probs, embeddings = similarity_index.predict(batch)
+            vegetable, confidence = inference.top_prediction(probs[0])
+            result = {'vegetable': vegetable, 'confidence': round(confidence, 2)}
+            if match:
+                near_duplicates.verify(match, vegetable)
+            near_duplicates.add(phash, vegetable, confidence, model_version)
+            if embeddings is not None:
+                embedding = embeddings[0]
+                similarity_index.index_embedding(digest, embedding)
+        shared_store.put_result(digest, model_version, result)
+    history_store.record(result['vegetable'], result['confidence'], content_hash=digest,
+                         filename=filename, model_version=model_version)
+    if config.SHARED_STORE_URL:
+        with open(path, 'rb') as f:
+            shared_store.put_upload(filename, f.read())
+
+    payload = prediction_view.prediction_json(result['vegetable'], result['confidence'],
+                                              url_for('uploaded_file', filename=filename),
+                                              url_for('uploaded_file', filename=thumb_name), embedding)
+    return dict(payload, filename=filename,
+                result_url=url_for('resumable_upload.upload_result', session_id=session_id))
+
+
+def _status(session_id: str, meta: dict) -> dict:
+    received = received_ranges(session_id)
+    complete = received == [[0, meta['size']]]
+    status = {'session_id': session_id, 'filename': meta['filename'], 'size': meta['size'],
+              'chunk_size': config.UPLOAD_CHUNK_SIZE, 'received': received, 'complete': complete,
+              'processing': os.path.exists(_path(session_id, '.done'))}
+    outcome = _read_json(_path(session_id, '.result.json'))
+    if outcome is not None:
+        status.update(complete=True, received=[[0, meta['size']]], **outcome)
+    return status
+
+
+def _status_response(session_id: str, meta: dict):
+    status = _status(session_id, meta)
+    if 'error' in status:
+        return jsonify(status), 422
+    return jsonify(status), 200 if 'result' in status else 202
+
+
+# ==================== Flask Integration ==================== #
+resumable_bp = Blueprint('resumable_upload', __name__)
+
+
+@resumable_bp.route('/upload/sessions', methods=['POST'])
+def create_session():
+    data = request.get_json(silent=True) or {}
+    filename, size, sha256 = data.get('filename'), data.get('size'), data.get('sha256')
+    if not filename or not preprocessing.allowed_file(filename):
+        return jsonify(error="Unsupported file type. Please upload PNG, JPG, JPEG, GIF or WEBP."), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify(error="'size' must be a positive integer"), 400
+    if size > config.MAX_FILE_SIZE_BYTES:
+        return jsonify(error=f"File size must be less than {config.MAX_FILE_SIZE_MB}MB"), 413
+    if sha256 is not None and not re.fullmatch(r'[0-9a-fA-F]{64}', str(sha256)):
+        return jsonify(error="'sha256' must be a hex digest"), 400
+
+    sweep_expired()
+    session_id = secrets.token_urlsafe(16)
+    # Sparse on most filesystems: disk is only used as chunks arrive
+    with open(_path(session_id, '.part'), 'wb') as f:
+        f.truncate(size)
+    meta = {'filename': filename, 'size': size, 'sha256': sha256, 'created': time.time()}
+    _write_json(_path(session_id, '.json'), meta)
+    return jsonify(session_id=session_id, chunk_size=config.UPLOAD_CHUNK_SIZE, received=[]), 201
+
+
+@resumable_bp.route('/upload/sessions/<session_id>', methods=['GET'])
+def session_status(session_id: str):
+    return jsonify(_status(session_id, _load_session(session_id)))
+
+
+@resumable_bp.route('/upload/sessions/<session_id>', methods=['PUT'])
+def upload_chunk(session_id: str):
+    meta = _load_session(session_id)
+    match = CONTENT_RANGE_PATTERN.match(request.headers.get('Content-Range', ''))
+    if match is None:
+        return jsonify(error="Content-Range: bytes <first>-<last>/<size> is required"), 400
+    first, last, total = (int(g) for g in match.groups())
+    if total != meta['size'] or first > last or last >= total:
+        return jsonify(error=f"Range {first}-{last}/{total} does not fit a {meta['size']}-byte upload"), 416
+    length = last - first + 1
+    if length > config.UPLOAD_MAX_CHUNK_BYTES:
+        return jsonify(error=f"Chunks are limited to {config.UPLOAD_MAX_CHUNK_BYTES} bytes"), 413
+
+    if os.path.exists(_path(session_id, '.done')):
+        return _status_response(session_id, meta)
+    data = request.get_data(cache=False)
+    if len(data) != length:
+        # Truncated by a dropped connection: keep nothing, the client resends it
+        return jsonify(error=f"Expected {length} bytes, received {len(data)}"), 400
+
+    try:
+        with open(_path(session_id, '.part'), 'r+b') as f:
+            f.seek(first)
+            f.write(data)
+    except FileNotFoundError:
+        # Finished or deleted while this chunk was in flight
+        return _status_response(session_id, meta)
+    # Only recorded once the bytes are in the file
+    with open(_path(session_id, '.ranges'), 'a') as f:
+        f.write(f'{first} {last + 1}\n')
+
+    if received_ranges(session_id) != [[0, meta['size']]]:
+        return _status_response(session_id, meta)
+    # Only now does this request need the model; the client resends a shed chunk
+    rejected = admission.admit()
+    if rejected is not None:
+        return rejected
+
+    try:
+        # Exactly one request finishes the upload, even when retries race
+        os.close(os.open(_path(session_id, '.done'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return _status_response(session_id, meta)
+    try:
+        outcome = {'result': finish_upload(session_id, meta)}
+    except preprocessing.UploadError as e:
+        outcome = {'error': str(e)}
+    except Exception:
+        # Always leave an outcome behind, or clients would poll forever
+        logger.exception("Classifying upload session %s failed", session_id)
+        outcome = {'error': "Classification failed; please try again."}
+    _write_json(_path(session_id, '.result.json'), outcome)
+    for suffix in ('.part', '.ranges'):
+        try:
+            os.remove(_path(session_id, suffix))
+        except FileNotFoundError:
+            pass
+    return _status_response(session_id, meta)
+
+
+@resumable_bp.route('/upload/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id: str):
+    _load_session(session_id)
+    _remove_session(session_id)
+    return '', 204
+
+
+@resumable_bp.route('/upload/sessions/<session_id>/result')
+def upload_result(session_id: str):
+    _load_session(session_id)
+    outcome = _read_json(_path(session_id, '.result.json'))
+    if outcome is None:
+        return render_template("prediction.html", result="This upload has not finished yet.", error=True), 409
+    if 'error' in outcome:
+        return prediction_view.respond(outcome['error'], error=True)
+    result = outcome['result']
+    return prediction_view.respond(result['vegetable'], confidence=result['confidence'],
+                                   image_url=result['image_url'], thumbnail_url=result['thumbnail_url'])
+
+
+def init_app(app: Flask):
+    """Register the upload session routes and tell index.html to use them"""
+    global _session_folder
+    if not config.RESUMABLE_UPLOADS:
+        return
+    _session_folder = os.path.join(app.root_path, config.UPLOAD_SESSION_FOLDER)
+    os.makedirs(_session_folder, exist_ok=True)
+    # Chunks are admitted in upload_chunk, and only the one that finishes the file
+    admission.defer('resumable_upload.upload_chunk')
+    app.register_blueprint(resumable_bp)
+
+    @app.context_processor
+    def resumable_upload_settings():
+        return {
+            'resumable_upload_url': url_for('resumable_upload.create_session'),
+            'upload_chunk_size': config.UPLOAD_CHUNK_SIZE,
+        }
@@ -0,0 +1,331 @@
+"""
+GreenClassify - Shared Store
+Cross-node prediction cache and upload storage, plus hash-affinity routing
+
+Backends share one small interface (get/set/delete). SHARED_STORE_URL picks
+one:
+    None               in-process dictionary (single node, the default)
+    redis://host:port  any server speaking the Redis protocol (Redis, Valkey,
+                       KeyDB, or the stand-in from `python shared_store.py serve`)
+
+Predictions are cached under the upload's content hash and the model
+version, so every node reuses results computed by the others. Uploaded
+files are copied to the store and fetched on demand by a node that is asked
+to serve a file it does not have locally.
+
+HashRing maps content hashes onto nodes with consistent hashing: repeat
+images land on the node whose caches are warm, and adding or removing one
+of N nodes moves only about 1/N of the keys. greenclassify_client routes
+each image with it when given a list of nodes, and sends an X-Content-Hash
+header so a load balancer can do the same (nginx upstream:
+`hash $http_x_content_hash consistent;`).
+
+Usage in app.py:
+    import shared_store
+    shared_store.init_app(app)
+    ...
+    cached = shared_store.get_result(content_hash, model_version)
+    shared_store.put_result(content_hash, model_version, {'vegetable': ..., 'confidence': ...})
+    shared_store.put_upload(filename, data)
+
+    python shared_store.py serve --port 6379
+    python shared_store.py ring --nodes http://a,http://b,http://c --add http://d
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from flask import Flask
+from werkzeug.security import safe_join
+
+import config
+from hash_ring import HashRing
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== Backends ==================== #
+class MemoryBackend:
+    """In-process store with expiry, used when no shared server is configured"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+def _encode(*args) -> bytes:
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode()
+    if kind == b'-':
+        raise RespError(body.decode())
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        count = int(body)
+        return None if count < 0 else [_read_reply(stream) for _ in range(count)]
+    raise RespError(f"Unexpected reply {line!r}")
+
+
+class RedisBackend:
+    """Minimal pooled client for the Redis protocol (GET/SET EX/DEL)"""
+
+    def __init__(self, url: str, pool_size: int = 8, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._pool: "queue.LifoQueue[Tuple[socket.socket, object]]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            self._send(conn, 'AUTH', self.password)
+        if self.db:
+            self._send(conn, 'SELECT', self.db)
+        return conn
+
+    @staticmethod
+    def _send(conn, *args):
+        conn[0].sendall(_encode(*args))
+        return _read_reply(conn[1])
+
+    def command(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            reply = self._send(conn, *args)
+        except (OSError, ConnectionError):
+            conn[0].close()
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+        return reply
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.command('GET', key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        if ttl:
+            self.command('SET', key, value, 'EX', int(ttl))
+        else:
+            self.command('SET', key, value)
+
+    def delete(self, key: str):
+        self.command('DEL', key)
+
+
+# ==================== Cache and Storage API ==================== #
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = RedisBackend(config.SHARED_STORE_URL) if config.SHARED_STORE_URL else MemoryBackend()
+    return _backend
+
+
+def _safe_get(key: str) -> Optional[bytes]:
+    # An unreachable store must only cost a cache miss, never a failed request
+    try:
+        return get_backend().get(key)
+    except (OSError, ConnectionError, RespError) as e:
+        logger.warning("Shared store read failed: %s", e)
+        return None
+
+
+def _safe_set(key: str, value: bytes, ttl: Optional[int]):
+    try:
+        get_backend().set(key, value, ttl)
+    except (OSError, ConnectionError, RespError) as e:
+        logger.warning("Shared store write failed: %s", e)
+
+
+def get_result(content_hash: str, model_version: str) -> Optional[dict]:
+    """A prediction any node made for these bytes with this model"""
+    value = _safe_get(f'gc:result:{model_version}:{content_hash}')
+    return json.loads(value) if value is not None else None
+
+
+def put_result(content_hash: str, model_version: str, result: dict):
+    _safe_set(f'gc:result:{model_version}:{content_hash}', json.dumps(result).encode(),
+              config.SHARED_RESULT_TTL)
+
+
+def put_upload(filename: str, data: bytes):
+    """Make an uploaded file servable by every node"""
+    if len(data) <= config.SHARED_UPLOAD_MAX_BYTES:
+        _safe_set(f'gc:upload:{filename}', data, config.SHARED_UPLOAD_TTL)
+
+
+def fetch_upload(filename: str, directory: str) -> bool:
+    """Copy a file another node stored into the local uploads folder"""
+    data = _safe_get(f'gc:upload:{filename}')
+    if data is None:
+        return False
+    path = safe_join(directory, filename)
+    if path is None:
+        return False
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def init_app(app: Flask):
+    """Connect to the configured store and check it answers"""
+    backend = get_backend()
+    if isinstance(backend, RedisBackend):
+        try:
+            backend.command('PING')
+        except (OSError, ConnectionError, RespError) as e:
+            logger.warning("Shared store %s unreachable (%s); continuing with cache misses",
+                           config.SHARED_STORE_URL, e)
+    app.extensions['shared_store'] = backend
+
+
+# ==================== Stand-in Server ==================== #
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store: MemoryBackend = self.server.store
+        while True:
+            try:
+                args = _read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(args, list) or not args:
+                self.wfile.write(b'-ERR expected a command array\r\n')
+                continue
+            name = args[0].decode().upper()
+            if name == 'PING':
+                reply = b'+PONG\r\n'
+            elif name in ('AUTH', 'SELECT'):
+                reply = b'+OK\r\n'
+            elif name == 'GET':
+                value = store.get(args[1].decode())
+                reply = b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+            elif name == 'SET':
+                ttl = None
+                if len(args) >= 5 and args[3].upper() == b'EX':
+                    ttl = int(args[4])
+                store.set(args[1].decode(), args[2], ttl)
+                reply = b'+OK\r\n'
+            elif name == 'DEL':
+                removed = 0
+                for key in args[1:]:
+                    if store.get(key.decode()) is not None:
+                        store.delete(key.decode())
+                        removed += 1
+                reply = b':%d\r\n' % removed
+            elif name == 'DBSIZE':
+                reply = b':%d\r\n' % len(store)
+            else:
+                reply = f'-ERR unknown command {name}\r\n'.encode()
+            self.wfile.write(reply)
+
+
+def serve(host: str = '127.0.0.1', port: int = 6379):
+    """Run an in-memory Redis-protocol server for tests and single-host setups"""
+    server = socketserver.ThreadingTCPServer((host, port), _StandInHandler)
+    server.daemon_threads = True
+    server.store = MemoryBackend()
+    print(f"Stand-in store listening on redis://{host}:{port}/0")
+    server.serve_forever()
+
+
+def _remap_report(nodes: List[str], add: Optional[str], remove: Optional[str], keys: int):
+    ring = HashRing(nodes, config.HASH_RING_REPLICAS)
+    sample = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(keys)]
+    before = [ring.node_for(k) for k in sample]
+    if add:
+        ring.add_node(add)
+    if remove:
+        ring.remove_node(remove)
+    after = [ring.node_for(k) for k in sample]
+    moved = sum(a != b for a, b in zip(before, after))
+    for node in ring.nodes:
+        print(f"  {node:<30} {after.count(node) / keys:6.1%} of keys")
+    ideal = 1 / len(ring.nodes) if add else 1 / len(nodes)
+    print(f"Remapped {moved / keys:.1%} of {keys} keys (an even split would move {ideal:.1%})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shared cache/storage tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    srv = sub.add_parser('serve', help="Run the in-memory Redis-protocol stand-in")
+    srv.add_argument('--host', default='127.0.0.1')
+    srv.add_argument('--port', type=int, default=6379)
+    ring_cmd = sub.add_parser('ring', help="Key share per node and keys moved by a membership change")
+    ring_cmd.add_argument('--nodes', required=True, help="Comma-separated node URLs")
+    ring_cmd.add_argument('--add')
+    ring_cmd.add_argument('--remove')
+    ring_cmd.add_argument('--keys', type=int, default=100000)
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    else:
+        _remap_report(args.nodes.split(','), args.add, args.remove, args.keys)
@@ -0,0 +1,360 @@
+"""
+GreenClassify - Similar Image Index
+On-disk IVF (inverted file) nearest-neighbour index over 128-d embeddings
+
+Vectors are L2-normalized, so the inner product is cosine similarity. A
+coarse k-means quantizer splits them into inverted lists stored as flat
+files; a query only scans the SIMILAR_NPROBE lists closest to it.
+
+Directory layout (SIMILAR_INDEX_DIR):
+    centroids.npy       (nlist, dim) coarse quantizer, absent until trained
+    keys.bin            32-byte content digest per row id
+    list_00000.vec      float32 vectors of the rows assigned to list 0
+    list_00000.ids      int64 row ids of list 0
+    write.lock          held exclusively while a process appends or retrains,
+                        shared while a query reads the lists
+
+Several worker processes may share one directory. Writers take write.lock
+and first read what the others appended, so row ids stay unique and line
+up with keys.bin; keys are written before the vectors that use them, so a
+reader never meets a row id it cannot map. Queries hold write.lock shared
+for their whole read, so a retrain, which rewrites every list and then the
+centroids, is never seen half done.
+
+Usage in app.py /predict (batch_api and resumable_upload do the same):
+    similarity_index.init_app(app)
+    ...
+    probs, embeddings = similarity_index.predict(batch)
+    if embeddings is not None:
+        similarity_index.index_embedding(digest, embeddings[0])
+
+Usage:
+    python similarity_index.py add uploads/          # bulk index a folder
+    python similarity_index.py train --nlist 1024    # (re)build the quantizer
+    python similarity_index.py query uploads/1210.jpg
+"""
+
+import argparse
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify, request
+
+import config
+import preprocessing
+
+try:
+    import fcntl  # Not available on Windows
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+KEY_BYTES = 32
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IVFIndex:
+    def __init__(self, directory: str = config.SIMILAR_INDEX_DIR, dim: int = 128):
+        self.directory = directory
+        self.dim = dim
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.centroids: Optional[np.ndarray] = None
+        self._centroids_mtime: Optional[int] = None
+        self._keys: List[bytes] = []
+        self._key_set = set()
+        self._refresh()
+
+    @property
+    def ntotal(self) -> int:
+        return len(self._keys)
+
+    @property
+    def nlist(self) -> int:
+        return 1 if self.centroids is None else len(self.centroids)
+
+    def _list_path(self, list_no: int, ext: str) -> str:
+        return os.path.join(self.directory, f"list_{list_no:05d}.{ext}")
+
+    @contextmanager
+    def _file_lock(self, shared: bool):
+        """write.lock on a descriptor of our own, so threads of one process exclude each other too"""
+        with open(os.path.join(self.directory, 'write.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            else:
+                # msvcrt has no shared locks; queries are exclusive on Windows
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive against other threads and other processes using the directory"""
+        with self._lock, self._file_lock(shared=False):
+            yield
+
+    def _refresh(self):
+        """Pick up keys and a quantizer written by other processes (caller holds self._lock)"""
+        keys_path = os.path.join(self.directory, 'keys.bin')
+        known = len(self._keys) * KEY_BYTES
+        size = os.path.getsize(keys_path) if os.path.exists(keys_path) else 0
+        if size > known:
+            with open(keys_path, 'rb') as f:
+                f.seek(known)
+                # Whole records only; a key still being appended is read next time
+                data = f.read((size - known) // KEY_BYTES * KEY_BYTES)
+            new_keys = [data[i:i + KEY_BYTES] for i in range(0, len(data), KEY_BYTES)]
+            self._keys.extend(new_keys)
+            self._key_set.update(new_keys)
+
+        centroids_path = os.path.join(self.directory, 'centroids.npy')
+        mtime = os.stat(centroids_path).st_mtime_ns if os.path.exists(centroids_path) else None
+        if mtime != self._centroids_mtime:
+            self.centroids = np.load(centroids_path) if mtime is not None else None
+            self._centroids_mtime = mtime
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def _read_list(self, list_no: int) -> Tuple[np.ndarray, np.ndarray]:
+        vec_path = self._list_path(list_no, 'vec')
+        if not os.path.exists(vec_path):
+            return np.empty((0, self.dim), np.float32), np.empty(0, np.int64)
+        vectors = np.fromfile(vec_path, dtype=np.float32)
+        ids = np.fromfile(self._list_path(list_no, 'ids'), dtype=np.int64)
+        # A concurrent append may have landed in one file but not the other yet
+        n = min(len(vectors) // self.dim, len(ids))
+        return vectors[:n * self.dim].reshape(n, self.dim), ids[:n]
+
+    # ==================== Writes ==================== #
+    def add(self, keys: Sequence[str], vectors: np.ndarray) -> int:
+        """Append embeddings keyed by hex content hash, skipping known keys"""
+        vectors = _normalize(vectors)
+        raw_keys = [bytes.fromhex(k) for k in keys]
+        with self._write_lock():
+            self._refresh()
+            fresh, seen = [], set()
+            for i, key in enumerate(raw_keys):
+                if key not in self._key_set and key not in seen:
+                    fresh.append(i)
+                    seen.add(key)
+            if not fresh:
+                return 0
+            vectors = vectors[fresh]
+            new_keys = [raw_keys[i] for i in fresh]
+            row_ids = np.arange(self.ntotal, self.ntotal + len(fresh), dtype=np.int64)
+            lists = self._assign(vectors)
+
+            with open(os.path.join(self.directory, 'keys.bin'), 'ab') as f:
+                f.write(b''.join(new_keys))
+            self._keys.extend(new_keys)
+            self._key_set.update(new_keys)
+            for list_no in np.unique(lists):
+                mask = lists == list_no
+                with open(self._list_path(int(list_no), 'vec'), 'ab') as f:
+                    f.write(vectors[mask].tobytes())
+                with open(self._list_path(int(list_no), 'ids'), 'ab') as f:
+                    f.write(row_ids[mask].tobytes())
+        return len(fresh)
+
+    def train(self, nlist: int, iterations: int = 20, sample_size: int = 256 * 1024, seed: int = 0):
+        """Fit a spherical k-means quantizer and redistribute every list"""
+        with self._write_lock():
+            self._refresh()
+            parts = [self._read_list(i) for i in range(self.nlist)]
+            vectors = np.concatenate([p[0] for p in parts])
+            ids = np.concatenate([p[1] for p in parts])
+            if not len(vectors):
+                raise ValueError("The index is empty; add images before training it")
+            nlist = max(1, min(nlist, len(vectors)))
+
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                empty = ~sums.any(axis=1)
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = _normalize(sums)
+
+            old_nlist = self.nlist
+            self.centroids = centroids.astype(np.float32)
+            lists = self._assign(vectors)
+            for list_no in range(max(old_nlist, nlist)):
+                mask = lists == list_no
+                for ext, data in (('vec', vectors[mask]), ('ids', ids[mask])):
+                    tmp = self._list_path(list_no, ext) + '.tmp'
+                    data.tofile(tmp)
+                    os.replace(tmp, self._list_path(list_no, ext))
+            centroids_path = os.path.join(self.directory, 'centroids.npy')
+            with open(centroids_path + '.tmp', 'wb') as f:
+                np.save(f, self.centroids)
+            os.replace(centroids_path + '.tmp', centroids_path)
+            self._centroids_mtime = os.stat(centroids_path).st_mtime_ns
+
+    # ==================== Queries ==================== #
+    def search(self, query: np.ndarray, k: int = 10,
+               nprobe: int = config.SIMILAR_NPROBE) -> List[Tuple[str, float]]:
+        """Top-k (content hash, cosine similarity) for one embedding"""
+        query = _normalize(query)[0]
+        # Centroids and lists are read under one shared lock, never mid-retrain
+        with self._file_lock(shared=True):
+            with self._lock:
+                self._refresh()
+                # _keys only ever grows, so the first len(keys) entries stay valid
+                centroids, keys, nkeys = self.centroids, self._keys, len(self._keys)
+            if centroids is None:
+                probe = [0]
+            else:
+                scores = centroids @ query
+                nprobe = min(nprobe, len(scores))
+                probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+            parts = [self._read_list(int(i)) for i in probe]
+        vectors = np.concatenate([p[0] for p in parts])
+        ids = np.concatenate([p[1] for p in parts])
+        # Rows appended after the keys were read are left for the next query
+        known = ids < nkeys
+        vectors, ids = vectors[known], ids[known]
+        if not len(ids):
+            return []
+
+        scores = vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(keys[ids[i]].hex(), float(scores[i])) for i in top]
+
+
+# ==================== Flask Integration ==================== #
+similar_bp = Blueprint('similar', __name__)
+_index: Optional[IVFIndex] = None
+
+
+def predict(batch: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Probabilities, plus embeddings when the index or EMIT_EMBEDDINGS needs them"""
+    import inference
+    if _index is None and not config.EMIT_EMBEDDINGS:
+        return inference.predict(batch), None
+    return inference.predict_with_embeddings(batch)
+
+
+def index_embedding(content_hash: str, embedding: np.ndarray):
+    """Add one predicted image's embedding to the index if it is enabled"""
+    if _index is not None:
+        _index.add([content_hash], embedding)
+
+
+@similar_bp.route('/similar', methods=['POST'])
+def similar_images():
+    k = min(request.args.get('k', config.SIMILAR_DEFAULT_K, type=int), config.SIMILAR_MAX_K)
+    if k < 1:
+        return jsonify(error="k must be at least 1"), 400
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify(error="Expected a JSON object with an 'embedding' list"), 400
+        try:
+            embedding = np.asarray(data.get('embedding', []), dtype=np.float32)
+        except (TypeError, ValueError):
+            embedding = None
+        if embedding is None or embedding.shape != (_index.dim,):
+            return jsonify(error=f"embedding must have {_index.dim} values"), 400
+    else:
+        # TensorFlow is only needed when the query is an image
+        import inference
+        file = request.files.get('image')
+        if file is None:
+            return jsonify(error="No image uploaded"), 400
+        try:
+            img = preprocessing.load_upload(file.stream, file.filename)
+        except preprocessing.UploadError as e:
+            return jsonify(error=str(e)), 400
+        _, embeddings = inference.predict_with_embeddings(preprocessing.prepare_input(img))
+        embedding = embeddings[0]
+
+    matches = [{'content_hash': key, 'score': round(score, 4)}
+               for key, score in _index.search(embedding, k=k)]
+    return jsonify(matches=matches, indexed=_index.ntotal)
+
+
+def init_app(app: Flask) -> Optional[IVFIndex]:
+    """Open the index and register the /similar endpoint"""
+    global _index
+    if not config.SIMILAR_INDEX_ENABLED:
+        return None
+    _index = IVFIndex(os.path.join(app.root_path, config.SIMILAR_INDEX_DIR))
+    app.register_blueprint(similar_bp)
+    return _index
+
+
+# ==================== Command Line ==================== #
+def _embed_files(paths: List[str], batch_size: int = 64):
+    """Yield (content hashes, embeddings) for image files in batches"""
+    import inference
+    for start in range(0, len(paths), batch_size):
+        keys, batch = [], []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                try:
+                    img = preprocessing.load_upload(f, os.path.basename(path))
+                except preprocessing.UploadError:
+                    continue
+                f.seek(0)
+                keys.append(preprocessing.content_hash(f))
+            batch.append(preprocessing.prepare_input(img)[0])
+        if batch:
+            _, embeddings = inference.predict_with_embeddings(np.stack(batch))
+            yield keys, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the similar-image index")
+    parser.add_argument('--dir', default=config.SIMILAR_INDEX_DIR, help="Index directory")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="Index every image in a folder")
+    add.add_argument('folder')
+    train = sub.add_parser('train', help="Fit the coarse quantizer")
+    train.add_argument('--nlist', type=int, default=1024)
+    query = sub.add_parser('query', help="Find images similar to a file")
+    query.add_argument('image')
+    query.add_argument('-k', type=int, default=config.SIMILAR_DEFAULT_K)
+    args = parser.parse_args()
+
+    index = IVFIndex(args.dir)
+    if args.command == 'add':
+        paths = sorted(os.path.join(args.folder, name) for name in os.listdir(args.folder)
+                       if preprocessing.allowed_file(name))
+        added = sum(index.add(keys, embeddings) for keys, embeddings in _embed_files(paths))
+        print(f"Added {added} images ({index.ntotal} indexed)")
+    elif args.command == 'train':
+        if not index.ntotal:
+            parser.error("the index is empty; run 'add' first")
+        index.train(args.nlist)
+        print(f"Trained {index.nlist} lists over {index.ntotal} vectors")
+    else:
+        for keys, embeddings in _embed_files([args.image]):
+            for key, score in index.search(embeddings[0], k=args.k):
+                print(f"{score:.4f}  {key}")
+
+
+if __name__ == '__main__':
+    main()
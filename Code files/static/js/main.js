@@ -9,6 +9,23 @@ const preview = document.getElementById('preview');
 const fileName = document.getElementById('fileName');
 const uploadForm = document.getElementById('uploadForm');
 
+// ==================== Client-Side Resize Settings ==================== //
+// The model only sees 150x150 pixels, so large photos are shrunk before upload.
+// Values come from data attributes on the form (see config.CLIENT_RESIZE_*).
+const resizeSettings = {
+    enabled: !uploadForm || uploadForm.dataset.resizeEnabled !== 'false',
+    maxEdge: parseInt(uploadForm && uploadForm.dataset.resizeMaxEdge, 10) || 512,
+    quality: parseFloat(uploadForm && uploadForm.dataset.resizeQuality) || 0.9
+};
+
+// ==================== Resumable Upload Settings ==================== //
+// Files larger than one chunk go up in pieces to /upload/sessions, so a
+// dropped connection only costs the missing chunks (see resumable_upload.py).
+const resumableSettings = {
+    url: (uploadForm && uploadForm.dataset.resumableUrl) || '',
+    chunkSize: parseInt(uploadForm && uploadForm.dataset.chunkSize, 10) || 256 * 1024
+};
+
 // ==================== Drag and Drop Functionality ==================== //
 if (uploadArea) {
     // Click to upload
@@ -45,8 +62,8 @@ if (uploadArea) {
 }
 
 // ==================== Image Preview Handler ==================== //
-function handleImageSelect() {
-    const file = imageInput.files[0];
+async function handleImageSelect() {
+    let file = imageInput.files[0];
     
     if (file) {
         // Validate file type
@@ -57,6 +74,20 @@ function handleImageSelect() {
             return;
         }
 
+        // Shrink large photos before upload; keep the original if anything fails
+        if (resizeSettings.enabled) {
+            try {
+                file = await downscaleImage(file, resizeSettings.maxEdge, resizeSettings.quality);
+                replaceSelectedFile(file);
+            } catch (err) {
+                console.warn('Client-side resize skipped: ' + err);
+                // The original is uploaded, so the server must not treat it as pre-shrunk
+                file = imageInput.files[0];
+                const resizedFlag = document.getElementById('clientResized');
+                if (resizedFlag) resizedFlag.value = '0';
+            }
+        }
+
         // Validate file size (max 16MB)
         const maxSize = 16 * 1024 * 1024;
         if (file.size > maxSize) {
@@ -66,24 +97,378 @@ function handleImageSelect() {
         }
 
         // Show preview
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            preview.src = e.target.result;
-            fileName.textContent = `Selected: ${file.name}`;
-            previewSection.style.display = 'block';
-            uploadArea.style.opacity = '0.5';
+        if (preview.src.startsWith('blob:')) URL.revokeObjectURL(preview.src);
+        preview.src = URL.createObjectURL(file);
+        fileName.textContent = `Selected: ${file.name}`;
+        previewSection.style.display = 'block';
+        uploadArea.style.opacity = '0.5';
+    }
+}
+
+// ==================== Client-Side Downscaling ==================== //
+async function decodeImage(file) {
+    if (window.createImageBitmap) {
+        return createImageBitmap(file, { imageOrientation: 'from-image' });
+    }
+    const url = URL.createObjectURL(file);
+    try {
+        const img = new Image();
+        img.src = url;
+        await img.decode();
+        return img;
+    } finally {
+        URL.revokeObjectURL(url);
+    }
+}
+
+async function downscaleImage(file, maxEdge, quality) {
+    const source = await decodeImage(file);
+    const width = source.width;
+    const height = source.height;
+    const scale = Math.min(1, maxEdge / Math.max(width, height));
+
+    // Already small enough: uploading the original is cheaper than re-encoding
+    if (scale === 1 && file.size <= 1024 * 1024) {
+        if (source.close) source.close();
+        return file;
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(width * scale));
+    canvas.height = Math.max(1, Math.round(height * scale));
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = '#ffffff';  // JPEG has no alpha channel
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.imageSmoothingEnabled = true;
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(source, 0, 0, canvas.width, canvas.height);
+    if (source.close) source.close();
+
+    const blob = await new Promise((resolve) => canvas.toBlob(resolve, 'image/jpeg', quality));
+    if (!blob || blob.size >= file.size) return file;
+
+    const name = file.name.replace(/\.[^.]+$/, '') + '.jpg';
+    console.log(`📉 Resized ${width}x${height} → ${canvas.width}x${canvas.height} (${Math.round(file.size / 1024)}KB → ${Math.round(blob.size / 1024)}KB)`);
+    return new File([blob], name, { type: 'image/jpeg', lastModified: Date.now() });
+}
+
+function replaceSelectedFile(file) {
+    const resized = file !== imageInput.files[0];
+    if (resized) {
+        const transfer = new DataTransfer();
+        transfer.items.add(file);
+        imageInput.files = transfer.files;
+    }
+
+    // Tell the server this payload was already shrunk in the browser
+    const resizedFlag = document.getElementById('clientResized');
+    if (resizedFlag) resizedFlag.value = resized ? '1' : '0';
+}
+
+// ==================== Resumable Chunked Upload ==================== //
+class UploadFailed extends Error {}
+class SessionExpired extends Error {}
+class RetryLater extends Error {
+    constructor(status, retryAfter) {
+        super(`HTTP ${status}`);
+        this.retryAfter = retryAfter;
+    }
+}
+
+function uploadSessionKey(file) {
+    return `gc-upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function sha256Hex(file) {
+    // crypto.subtle only exists on HTTPS and localhost; the checksum is optional
+    if (!window.crypto || !window.crypto.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function fetchJSON(url, options) {
+    const response = await fetch(url, options);
+    const body = await response.json().catch(() => ({}));
+    const retryAfter = Number(response.headers.get('Retry-After')) || 0;
+    return { status: response.status, body, retryAfter };
+}
+
+function checkSessionResponse({ status, body, retryAfter }) {
+    // Only overload (429) and server errors are worth resending; other errors are final
+    if (status === 429 || status >= 500) throw new RetryLater(status, retryAfter);
+    if (status === 404) throw new SessionExpired('Upload session expired');
+    if (status >= 400 && status !== 422) throw new UploadFailed(body.error || `Upload failed (HTTP ${status})`);
+    return body;
+}
+
+async function openUploadSession(file) {
+    // Resume a session started earlier for the same file, even after a reload
+    const key = uploadSessionKey(file);
+    const saved = localStorage.getItem(key);
+    if (saved) {
+        const { status, body } = await fetchJSON(`${resumableSettings.url}/${saved}`);
+        if (status === 200) return body;
+        localStorage.removeItem(key);
+    }
+
+    const { status, body, retryAfter } = await fetchJSON(resumableSettings.url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size, sha256: await sha256Hex(file) })
+    });
+    if (status === 429 || status >= 500) throw new RetryLater(status, retryAfter);
+    if (status !== 201) throw new UploadFailed(body.error || `Upload could not start (HTTP ${status})`);
+    localStorage.setItem(key, body.session_id);
+    return body;
+}
+
+function missingRanges(received, size, chunkSize) {
+    // received holds sorted [start, end) ranges; split the gaps into chunks
+    const missing = [];
+    let offset = 0;
+    for (const [start, end] of [...received, [size, size]]) {
+        for (let s = offset; s < start; s += chunkSize) {
+            missing.push([s, Math.min(s + chunkSize, start)]);
+        }
+        offset = Math.max(offset, end);
+    }
+    return missing;
+}
+
+function receivedBytes(session) {
+    return (session.received || []).reduce((total, [start, end]) => total + end - start, 0);
+}
+
+function waitForRetry(delay) {
+    // Retry after the delay, or as soon as the device is back online
+    return new Promise((resolve) => {
+        const done = () => {
+            window.removeEventListener('online', done);
+            clearTimeout(timer);
+            resolve();
         };
-        reader.readAsDataURL(file);
+        const timer = setTimeout(done, navigator.onLine === false ? 60000 : delay);
+        window.addEventListener('online', done);
+    });
+}
+
+async function putChunk(url, file, start, end) {
+    return checkSessionResponse(await fetchJSON(url, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${start}-${end - 1}/${file.size}` },
+        body: file.slice(start, end)
+    }));
+}
+
+async function uploadResumable(file, onProgress) {
+    let retryDelay = 1000;
+    let failures = 0;
+    while (true) {
+        try {
+            let session = await openUploadSession(file);
+            const url = `${resumableSettings.url}/${session.session_id}`;
+            const chunkSize = session.chunk_size || resumableSettings.chunkSize;
+            onProgress(receivedBytes(session), file.size);
+
+            for (const [start, end] of missingRanges(session.received, file.size, chunkSize)) {
+                session = await putChunk(url, file, start, end);
+                onProgress(receivedBytes(session), file.size);
+                retryDelay = 1000;
+                failures = 0;
+            }
+
+            while (!session.result && !session.error) {
+                if (session.complete && !session.processing) {
+                    // The chunk that finished the file was turned away (busy); send it again
+                    session = await putChunk(url, file, Math.max(0, file.size - chunkSize), file.size);
+                } else {
+                    // Another request is still classifying the finished file
+                    await new Promise((resolve) => setTimeout(resolve, 500));
+                    session = checkSessionResponse(await fetchJSON(url));
+                }
+            }
+            localStorage.removeItem(uploadSessionKey(file));
+            if (session.error) throw new UploadFailed(session.error);
+            return session.result;
+        } catch (err) {
+            // Anything else is a network error (fetch rejected), a 429 or a 5xx
+            if (err instanceof UploadFailed) throw err;
+            if (++failures > 10) throw new UploadFailed('Upload failed. Check your connection and try again.');
+            if (err instanceof SessionExpired) {
+                // The server no longer has the session; start a new one straight away
+                localStorage.removeItem(uploadSessionKey(file));
+                continue;
+            }
+            const delay = Math.max(retryDelay, (err.retryAfter || 0) * 1000);
+            console.warn(`Upload interrupted (${err}); resuming in ${delay / 1000}s`);
+            await waitForRetry(delay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        }
+    }
+}
+
+// ==================== In-Place Result Flow ==================== //
+// The form is sent with XHR asking for JSON, and the result is shown on this
+// page; nothing is reloaded and the server renders no template.
+class FormPostNeeded extends Error {}
+
+const uploadCard = document.querySelector('.upload-card');
+const resultSection = document.getElementById('resultSection');
+const uploadProgress = document.getElementById('uploadProgress');
+const submitBtn = uploadForm ? uploadForm.querySelector('button[type="submit"]') : null;
+const submitLabel = submitBtn ? submitBtn.innerHTML : '';
+let uploading = false;
+
+function postForm(onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open('POST', uploadForm.action);
+        xhr.setRequestHeader('Accept', 'application/json');
+        xhr.responseType = 'json';  // null when the server answers with a page
+        xhr.upload.addEventListener('progress', (e) => {
+            if (e.lengthComputable) onProgress(e.loaded, e.total);
+        });
+        xhr.addEventListener('load', () => {
+            const body = xhr.response;
+            if (!body) reject(new FormPostNeeded());
+            else if (xhr.status >= 400 || body.error) reject(new UploadFailed(body.error || `Upload failed (HTTP ${xhr.status})`));
+            else resolve(body);
+        });
+        xhr.addEventListener('error', () => reject(new UploadFailed('Network error while uploading. Please try again.')));
+        xhr.send(new FormData(uploadForm));
+    });
+}
+
+function showUploadProgress(sent, total) {
+    const percent = Math.floor(100 * sent / total);
+    if (uploadProgress) {
+        const bar = uploadProgress.querySelector('.progress-bar');
+        bar.style.width = `${percent}%`;
+        bar.setAttribute('aria-valuenow', percent);
+    }
+    if (submitBtn) {
+        submitBtn.innerHTML = `<span class="spinner-border spinner-border-sm me-2"></span>${percent < 100 ? `Uploading ${percent}%` : 'Analyzing...'}`;
+    }
+}
+
+function setUploading(active) {
+    uploading = active;
+    if (uploadProgress) {
+        uploadProgress.classList.toggle('d-none', !active);
+        if (active) showUploadProgress(0, 1);
+    }
+    if (submitBtn) {
+        submitBtn.disabled = active;
+        if (!active) submitBtn.innerHTML = submitLabel;
+    }
+}
+
+function showResult(result) {
+    const image = document.getElementById('resultImage');
+    const src = result.thumbnail_url || result.image_url;
+    if (src) image.src = src;
+    document.getElementById('resultImageLink').href = result.image_url || src || '#';
+    image.closest('.image-container').classList.toggle('d-none', !src);
+    document.getElementById('resultLabel').textContent = result.vegetable;
+
+    const confidence = document.getElementById('resultConfidence');
+    confidence.classList.toggle('d-none', result.confidence == null);
+    if (result.confidence != null) {
+        const bar = confidence.querySelector('.progress-bar');
+        bar.style.width = `${result.confidence}%`;
+        bar.setAttribute('aria-valuenow', result.confidence);
+        bar.querySelector('span').textContent = `${result.confidence}%`;
     }
+
+    if (explainButton) {
+        resetExplainButton();
+        explainButton.dataset.explainUrl = result.explain_url || '';
+        explainButton.classList.toggle('d-none', !result.explain_url);
+    }
+
+    setUploading(false);
+    uploadCard.classList.add('d-none');
+    resultSection.classList.remove('d-none');
+    resultSection.scrollIntoView({ block: 'start' });
+}
+
+function resetUploadForm() {
+    uploadForm.reset();
+    if (preview.src.startsWith('blob:')) URL.revokeObjectURL(preview.src);
+    preview.src = '';
+    previewSection.style.display = 'none';
+    uploadArea.style.opacity = '1';
+    resultSection.classList.add('d-none');
+    uploadCard.classList.remove('d-none');
 }
 
 // ==================== Form Submission Handler ==================== //
 if (uploadForm) {
     uploadForm.addEventListener('submit', (e) => {
-        if (!imageInput.files[0]) {
+        const file = imageInput.files[0];
+        if (!file) {
             e.preventDefault();
             showAlert('Please select an image first', 'warning');
+            return;
+        }
+        // Without the result section (or XHR) the server renders the page as before
+        if (!resultSection || !window.XMLHttpRequest) return;
+        e.preventDefault();
+        if (uploading) return;
+
+        setUploading(true);
+        // Files larger than one chunk go through a resumable upload session
+        const useChunks = resumableSettings.url && file.size > resumableSettings.chunkSize;
+        const upload = useChunks ? uploadResumable(file, showUploadProgress) : postForm(showUploadProgress);
+        upload.then(showResult).catch((err) => {
+            if (err instanceof FormPostNeeded) {
+                uploadForm.submit();  // the server only renders pages; fall back to it
+                return;
+            }
+            setUploading(false);
+            showAlert(err.message, 'danger');
+        });
+    });
+
+    const tryAnotherButton = document.getElementById('tryAnotherButton');
+    if (tryAnotherButton) tryAnotherButton.addEventListener('click', resetUploadForm);
+}
+
+// ==================== Prediction Explanation ==================== //
+// The Grad-CAM overlay is computed on the server only when asked for
+const explainButton = document.getElementById('explainButton');
+const explainLabel = explainButton ? explainButton.innerHTML : '';
+
+function resetExplainButton() {
+    const image = document.querySelector('.image-container img');
+    if (image && explainButton.dataset.originalSrc) image.src = explainButton.dataset.originalSrc;
+    delete explainButton.dataset.originalSrc;
+    explainButton.disabled = false;
+    explainButton.innerHTML = explainLabel;
+}
+
+if (explainButton) {
+    explainButton.addEventListener('click', () => {
+        const image = document.querySelector('.image-container img');
+        if (!image) return;
+        if (explainButton.dataset.originalSrc) {
+            resetExplainButton();
+            return;
         }
+        explainButton.disabled = true;
+        explainButton.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Explaining...';
+        const overlay = new Image();
+        overlay.onload = () => {
+            explainButton.dataset.originalSrc = image.src;
+            image.src = overlay.src;
+            explainButton.disabled = false;
+            explainButton.innerHTML = '<i class="fas fa-image"></i> Show original';
+        };
+        overlay.onerror = () => {
+            resetExplainButton();
+            showAlert('Could not compute an explanation for this image', 'warning');
+        };
+        overlay.src = explainButton.dataset.explainUrl;
     });
 }
 
@@ -112,11 +497,10 @@ document.addEventListener('DOMContentLoaded', () => {
     // Add smooth scroll behavior
     document.documentElement.style.scrollBehavior = 'smooth';
 
-    // Add loading state for form submission
+    // Add loading state for plain form posts (the in-place flow sets its own)
     if (uploadForm) {
-        uploadForm.addEventListener('submit', () => {
-            const submitBtn = uploadForm.querySelector('button[type="submit"]');
-            if (submitBtn) {
+        uploadForm.addEventListener('submit', (e) => {
+            if (!e.defaultPrevented && submitBtn) {
                 submitBtn.disabled = true;
                 submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Analyzing...';
             }
@@ -140,7 +524,8 @@ document.addEventListener('keydown', (e) => {
     }
     // Press 'Enter' to submit form when file is selected
     if (e.key === 'Enter' && imageInput && imageInput.files[0]) {
-        if (uploadForm) uploadForm.submit();
+        // requestSubmit() runs the submit handlers (validation, in-place upload)
+        if (uploadForm) uploadForm.requestSubmit ? uploadForm.requestSubmit() : uploadForm.submit();
     }
 });
 
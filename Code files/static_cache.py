@@ -0,0 +1,159 @@
+"""
+GreenClassify - Static Asset Caching
+Content-hashed static URLs, ETag validators and precompressed variants
+
+Usage in app.py:
+    import static_cache
+    static_cache.init_app(app)
+
+    @app.route("/uploads/<filename>")
+    def uploaded_file(filename):
+        return static_cache.send_upload(filename)
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from flask import Flask, Response, request, send_from_directory
+from werkzeug.security import safe_join
+
+import config
+
+try:
+    import brotli  # Optional: pip install Brotli
+except ImportError:
+    brotli = None
+
+
+# Only text assets are worth compressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.json', '.txt'}
+MIN_COMPRESS_BYTES = 256
+
+
+class StaticAsset:
+    def __init__(self, path: str, digest: str, variants: Dict[str, bytes]):
+        self.path = path
+        self.digest = digest
+        self.variants = variants  # encoding -> compressed body
+
+
+class StaticAssetCache:
+    def __init__(self, static_folder: str):
+        self.static_folder = static_folder
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def build(self):
+        """Hash every static file and precompress text assets"""
+        self.assets.clear()
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:16]
+                self.assets[rel] = StaticAsset(path, digest, self._compress(name, data))
+
+    @staticmethod
+    def _compress(name: str, data: bytes) -> Dict[str, bytes]:
+        """Build gzip/brotli variants, keeping only those that are smaller"""
+        variants = {}
+        if not config.PRECOMPRESS_STATIC:
+            return variants
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return variants
+        if len(data) < MIN_COMPRESS_BYTES:
+            return variants
+
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data):
+            variants['gzip'] = gz
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                variants['br'] = br
+        return variants
+
+    def version(self, filename: str) -> Optional[str]:
+        """Return the content hash used to version a static URL"""
+        asset = self.assets.get(filename)
+        return asset.digest if asset else None
+
+    def add_version(self, endpoint: str, values: dict):
+        """url_defaults hook: append ?v=<hash> to url_for('static', ...)"""
+        if endpoint != 'static' or 'v' in values:
+            return
+        digest = self.version(values.get('filename', ''))
+        if digest:
+            values['v'] = digest
+
+    def serve(self, filename: str) -> Response:
+        """Replacement view for Flask's built-in static endpoint"""
+        asset = self.assets.get(filename)
+        if asset is None:
+            return send_from_directory(self.static_folder, filename)
+
+        encoding = None
+        if 'Range' not in request.headers:
+            encoding = self._negotiate(asset)
+
+        if encoding:
+            response = Response(asset.variants[encoding],
+                                mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{asset.digest}-{encoding}")
+            response.make_conditional(request)
+        else:
+            # send_file handles If-None-Match, If-Modified-Since and Range
+            response = send_from_directory(self.static_folder, filename,
+                                           etag=asset.digest, conditional=True)
+
+        response.vary.add('Accept-Encoding')
+        if request.args.get('v') == asset.digest:
+            response.cache_control.public = True
+            response.cache_control.max_age = config.STATIC_CACHE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            # Unversioned URL: allow caching but always revalidate the ETag
+            response.cache_control.no_cache = True
+        return response
+
+    @staticmethod
+    def _negotiate(asset: StaticAsset) -> Optional[str]:
+        """Pick the best precompressed variant the client accepts"""
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in asset.variants and accepted[encoding]:
+                return encoding
+        return None
+
+
+def send_upload(filename: str) -> Response:
+    """Serve an uploaded image with validators and zero-copy file transfer"""
+    if config.SHARED_STORE_URL and not os.path.exists(safe_join(config.UPLOAD_FOLDER, filename) or ''):
+        # Uploaded through another node: copy it here once, then serve locally
+        import shared_store
+        shared_store.fetch_upload(filename, config.UPLOAD_FOLDER)
+
+    # send_file hands the open file to the server's wsgi.file_wrapper
+    # (os.sendfile under gunicorn/uwsgi), or emits X-Sendfile when enabled
+    response = send_from_directory(config.UPLOAD_FOLDER, filename,
+                                   conditional=True,
+                                   max_age=config.UPLOAD_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    return response
+
+
+def init_app(app: Flask) -> StaticAssetCache:
+    """Build the asset cache and take over the static endpoint"""
+    cache = StaticAssetCache(app.static_folder)
+    cache.build()
+
+    app.url_defaults(cache.add_version)
+    app.view_functions['static'] = cache.serve
+    app.config['USE_X_SENDFILE'] = config.USE_X_SENDFILE
+    app.extensions['static_cache'] = cache
+    return cache
@@ -0,0 +1,302 @@
+"""
+GreenClassify - Stream Classification
+Continuous classification of camera frames over a WebSocket (/stream)
+
+Clients send JPEG frames as binary messages and receive one JSON message per
+classified frame. Each stream keeps only its newest unprocessed frame: a
+frame that arrives while the previous one is still waiting replaces it (and
+is counted as dropped), so a slow model never builds a backlog. A single
+inference thread takes the waiting frame of every stream and classifies them
+in one batched forward pass, run inside admission.model_call() so streams
+share the ADMISSION_CONCURRENCY model slots with /predict.
+
+Messages to the client:
+    {"seq": 41, "class": "Tomato", "confidence": 97.1, "latency_ms": 38.2,
+     "inference_ms": 21.5, "batch_size": 3, "dropped": 2}
+
+A text message {"fps": 5} lowers the stream's frame rate (frames arriving
+faster are dropped on receipt); STREAM_TARGET_FPS is the default and cap.
+
+Usage in app.py (requires flask-sock):
+    import stream
+    stream.init_app(app)
+
+    python stream.py client --url ws://localhost:5000/stream --frames samples/ --fps 10
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify
+from PIL import Image
+
+import admission
+import config
+from preprocessing import check_pixel_count, prepare_input
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:  # Optional: /stream is only served when flask-sock is installed
+    Sock = None
+    ConnectionClosed = Exception
+
+
+class Frame:
+    __slots__ = ('stream_id', 'seq', 'data', 'received_at')
+
+    def __init__(self, stream_id: int, seq: int, data: bytes, received_at: float):
+        self.stream_id = stream_id
+        self.seq = seq
+        self.data = data
+        self.received_at = received_at
+
+
+class StreamScheduler:
+    """Latest-frame-wins slots per stream, drained in batches by one worker thread"""
+
+    def __init__(self, max_batch: int = config.STREAM_MAX_BATCH):
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending: Dict[int, Frame] = {}
+        self._deliver: Dict[int, Callable[[dict], None]] = {}
+        self._dropped: Dict[int, int] = {}
+        self._next_id = 0
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {'received': 0, 'processed': 0, 'dropped_stale': 0, 'dropped_rate': 0,
+                         'batches': 0, 'latency_seconds': 0.0}
+
+    def open(self, deliver: Callable[[dict], None]) -> int:
+        with self._cond:
+            self._next_id += 1
+            self._deliver[self._next_id] = deliver
+            self._dropped[self._next_id] = 0
+            return self._next_id
+
+    def close(self, stream_id: int):
+        with self._cond:
+            self._pending.pop(stream_id, None)
+            self._deliver.pop(stream_id, None)
+            self._dropped.pop(stream_id, None)
+
+    def drop(self, stream_id: int):
+        """Count a frame refused on receipt because the stream is over its frame rate"""
+        with self._cond:
+            self.counters['received'] += 1
+            self.counters['dropped_rate'] += 1
+            if stream_id in self._dropped:
+                self._dropped[stream_id] += 1
+
+    def submit(self, frame: Frame):
+        with self._cond:
+            self.counters['received'] += 1
+            if frame.stream_id in self._pending:
+                self.counters['dropped_stale'] += 1
+                if frame.stream_id in self._dropped:
+                    self._dropped[frame.stream_id] += 1
+            self._pending[frame.stream_id] = frame
+            self._cond.notify()
+
+    def _take_batch(self) -> List[Frame]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            frames = sorted(self._pending.values(), key=lambda f: f.received_at)[:self.max_batch]
+            for frame in frames:
+                del self._pending[frame.stream_id]
+            return frames
+
+    def start(self, predict: Callable[[np.ndarray], np.ndarray],
+              label: Callable[[np.ndarray], tuple]):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(predict, label),
+                                            name='stream-inference', daemon=True)
+            self._thread.start()
+
+    def _run(self, predict, label):
+        while True:
+            frames = self._take_batch()
+            inputs, decoded = [], []
+            for frame in frames:
+                try:
+                    inputs.append(_decode(frame.data))
+                    decoded.append(frame)
+                except Exception:  # undecodable, too many pixels (UploadError), ...
+                    self._send(frame, {'seq': frame.seq, 'error': 'Frame is not a decodable image'})
+            if not decoded:
+                continue
+
+            batch = np.concatenate(inputs)
+            try:
+                with admission.model_call():
+                    start = time.perf_counter()
+                    probs = predict(batch)
+            except Exception as exc:  # keep serving the other streams
+                for frame in decoded:
+                    self._send(frame, {'seq': frame.seq, 'error': f'Inference failed: {exc}'})
+                continue
+            inference_ms = round((time.perf_counter() - start) * 1000, 2)
+
+            now = time.perf_counter()
+            with self._cond:
+                self.counters['batches'] += 1
+                self.counters['processed'] += len(decoded)
+                self.counters['latency_seconds'] += sum(now - f.received_at for f in decoded)
+            for frame, row in zip(decoded, probs):
+                name, confidence = label(row)
+                self._send(frame, {
+                    'seq': frame.seq, 'class': name, 'confidence': round(confidence, 2),
+                    'latency_ms': round((now - frame.received_at) * 1000, 2),
+                    'inference_ms': inference_ms, 'batch_size': len(decoded),
+                    'dropped': self._dropped.get(frame.stream_id, 0),
+                })
+
+    def _send(self, frame: Frame, message: dict):
+        deliver = self._deliver.get(frame.stream_id)
+        if deliver is None:
+            return
+        try:
+            deliver(message)
+        except (ConnectionClosed, OSError):
+            self.close(frame.stream_id)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            metrics = dict(self.counters, streams=len(self._deliver))
+        processed = metrics['processed']
+        metrics['avg_batch_size'] = round(processed / metrics['batches'], 2) if metrics['batches'] else 0.0
+        metrics['avg_latency_ms'] = round(metrics.pop('latency_seconds') / processed * 1000, 2) if processed else 0.0
+        return metrics
+
+
+def _decode(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as img:
+        check_pixel_count(img)
+        # JPEG draft mode decodes at reduced scale, close to the model's input size
+        img.draft('RGB', config.IMAGE_TARGET_SIZE[::-1])
+        return prepare_input(img.convert('RGB'))
+
+
+# ==================== Flask Integration ==================== #
+stream_bp = Blueprint('stream', __name__)
+scheduler = StreamScheduler()
+
+
+def _handle(ws):
+    send_lock = threading.Lock()
+
+    def deliver(message: dict):
+        with send_lock:
+            ws.send(json.dumps(message))
+
+    stream_id = scheduler.open(deliver)
+    min_interval = 1.0 / config.STREAM_TARGET_FPS
+    last_accepted = 0.0
+    seq = 0
+    try:
+        while True:
+            data = ws.receive()
+            if isinstance(data, str):
+                try:
+                    fps = float(json.loads(data).get('fps', config.STREAM_TARGET_FPS))
+                    min_interval = 1.0 / min(max(fps, 0.1), config.STREAM_TARGET_FPS)
+                except (ValueError, AttributeError):
+                    pass
+                continue
+            if data is None:
+                continue
+            seq += 1
+            if len(data) > config.STREAM_MAX_FRAME_BYTES:
+                deliver({'seq': seq, 'error': 'Frame too large'})
+                continue
+            now = time.perf_counter()
+            if now - last_accepted < min_interval * 0.9:  # leave room for network jitter
+                scheduler.drop(stream_id)
+                continue
+            last_accepted = now
+            scheduler.submit(Frame(stream_id, seq, data, now))
+    finally:
+        scheduler.close(stream_id)
+
+
+@stream_bp.route('/metrics/stream')
+def stream_metrics():
+    return jsonify(scheduler.metrics())
+
+
+def init_app(app: Flask):
+    """Register /stream (if flask-sock is installed) and start the inference thread"""
+    if Sock is not None:
+        Sock().route('/stream', bp=stream_bp)(_handle)
+    app.register_blueprint(stream_bp)
+
+    import inference
+    scheduler.max_batch = config.STREAM_MAX_BATCH  # may come from the CPU profile
+    scheduler.start(inference.predict, inference.top_prediction)
+
+
+# ==================== Load Generator ==================== #
+def run_client(url: str, frames: List[bytes], fps: float, seconds: float):
+    """Send frames at a fixed rate and report achieved result rate and latency"""
+    from simple_websocket import Client
+
+    ws = Client.connect(url)
+    ws.send(json.dumps({'fps': fps}))
+    results: List[dict] = []
+    done = threading.Event()
+
+    def receive():
+        while not done.is_set():
+            try:
+                message = ws.receive(timeout=0.5)
+            except ConnectionClosed:
+                return
+            if message:
+                results.append(json.loads(message))
+
+    reader = threading.Thread(target=receive, daemon=True)
+    reader.start()
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < seconds:
+        ws.send(frames[sent % len(frames)])
+        sent += 1
+        time.sleep(max(0.0, start + sent / fps - time.perf_counter()))
+    time.sleep(1.0)
+    done.set()
+    reader.join()
+    ws.close()
+
+    latencies = sorted(r['latency_ms'] for r in results if 'latency_ms' in r)
+    print(f"sent {sent} frames in {seconds:.0f}s, {len(latencies)} classified "
+          f"({len(latencies) / seconds:.1f} fps of {fps:g} target)")
+    if latencies:
+        print(f"latency ms: p50 {latencies[len(latencies) // 2]:.1f}  "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.1f}  max {latencies[-1]:.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="WebSocket stream classification client")
+    sub = parser.add_subparsers(dest='command', required=True)
+    client = sub.add_parser('client', help="Replay JPEG files as a camera stream")
+    client.add_argument('--url', default='ws://localhost:5000/stream')
+    client.add_argument('--frames', required=True, help="Folder of .jpg frames")
+    client.add_argument('--fps', type=float, default=config.STREAM_TARGET_FPS)
+    client.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.frames, '*.jp*g')))
+    if not paths:
+        raise SystemExit(f"No JPEG frames in {args.frames}")
+    frame_data = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            frame_data.append(f.read())
+    run_client(args.url, frame_data, args.fps, args.seconds)
@@ -0,0 +1,193 @@
+"""greenclassify_client against /predict/batch on a local Werkzeug server"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from flask import Flask, jsonify, request
+from PIL import Image
+from werkzeug.serving import make_server
+
+import batch_api
+import inference
+import preprocessing
+import shared_store
+
+pytest.importorskip('httpx')
+from greenclassify_client import AsyncClient, Client, GreenClassifyError  # noqa: E402
+
+COLORS = {'Red': (220, 30, 30), 'Green': (30, 220, 30), 'Blue': (30, 30, 220)}
+CLASS_MAP = {0: 'Red', 1: 'Green', 2: 'Blue'}
+
+
+def _predict(batch: np.ndarray) -> np.ndarray:
+    """Stub model: the class is the image's dominant colour channel"""
+    means = batch.mean(axis=(1, 2))
+    return np.eye(3)[np.argmax(means, axis=1)]
+
+
+def _single_predict():
+    """Stand-in for app.py's /predict answering JSON"""
+    file = request.files['image']
+    try:
+        img = preprocessing.load_upload(file.stream, file.filename)
+    except preprocessing.UploadError as e:
+        return jsonify(error=str(e)), 400
+    vegetable, confidence = inference.top_prediction(inference.predict(preprocessing.prepare_input(img))[0])
+    return jsonify(vegetable=vegetable, confidence=round(confidence, 2))
+
+
+class Node:
+    """One app instance: records every call and replays scripted failures first"""
+
+    def __init__(self, batch: bool = True):
+        self.calls = []
+        self.faults = []  # (status, Retry-After) returned by the next requests
+        self.app = Flask(__name__)
+        if batch:
+            self.app.register_blueprint(batch_api.batch_bp)
+        self.app.add_url_rule('/predict', 'predict', _single_predict, methods=['POST'])
+        self.app.before_request(self._before_request)
+        self.server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def _before_request(self):
+        if self.faults:
+            status, retry_after = self.faults.pop(0)
+            response = jsonify(error='busy')
+            response.status_code = status
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        self.calls.append((len(request.files.getlist('files') or request.files.getlist('image')),
+                           request.headers.get('X-Content-Hash')))
+        return None
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    monkeypatch.setattr(inference, 'predict', _predict)
+    monkeypatch.setattr(inference, 'model_version', lambda: 'test')
+    monkeypatch.setattr(inference, 'get_class_map', lambda: CLASS_MAP)
+    # A fresh in-memory result cache, so every upload reaches the stub model
+    monkeypatch.setattr(shared_store, '_backend', shared_store.MemoryBackend())
+    started = [Node(), Node()]
+    yield started
+    for node in started:
+        node.close()
+
+
+@pytest.fixture
+def images(tmp_path):
+    """(path, expected class) for 20 distinct small PNGs"""
+    rng = np.random.default_rng(0)
+    out = []
+    for i in range(20):
+        name = list(COLORS)[i % 3]
+        pixels = np.clip(np.array(COLORS[name]) + rng.integers(-20, 20, (32, 32, 3)), 0, 255)
+        path = tmp_path / f'img_{i:02d}.png'
+        Image.fromarray(pixels.astype(np.uint8)).save(path)
+        out.append((str(path), name))
+    return out
+
+
+def test_chunks_by_count_and_keeps_input_order(nodes, images):
+    node = nodes[0]
+    with Client(node.url, batch_size=8, max_concurrency=3) as client:
+        predictions = client.classify_many([path for path, _ in images])
+
+    assert [p.filename for p in predictions] == [f'img_{i:02d}.png' for i in range(20)]
+    assert [p.vegetable for p in predictions] == [name for _, name in images]
+    assert all(p.confidence == 100.0 and p.error is None for p in predictions)
+    assert sorted(count for count, _ in node.calls) == [4, 8, 8]
+    assert all(content_hash for _, content_hash in node.calls)
+
+
+def test_chunks_by_request_size(nodes, images):
+    node = nodes[0]
+    paths = [path for path, _ in images[:6]]
+    with Client(node.url, batch_size=16, max_batch_bytes=1) as client:
+        predictions = client.classify_many(paths)
+    assert len(predictions) == 6
+    # Every image is over the size limit on its own, so each goes in its own call
+    assert [count for count, _ in node.calls] == [1] * 6
+
+
+def test_routes_by_content_hash_across_nodes(nodes, images):
+    paths = [path for path, _ in images]
+    with Client([node.url for node in nodes], batch_size=4) as client:
+        first = client.classify_many(paths)
+        calls = [list(node.calls) for node in nodes]
+        second = client.classify_many(list(reversed(paths)))
+
+    assert [p.vegetable for p in first] == [name for _, name in images]
+    assert [p.filename for p in second] == [f'img_{i:02d}.png' for i in reversed(range(20))]
+    assert all(calls), "both nodes own part of the ring"
+    assert sum(count for node_calls in calls for count, _ in node_calls) == 20
+    # The same images go to the same node the second time
+    for node, before in zip(nodes, calls):
+        assert sum(c for c, _ in node.calls) == 2 * sum(c for c, _ in before)
+
+
+def test_retries_429_and_503_honouring_retry_after(nodes, images):
+    node = nodes[0]
+    node.faults = [(503, 0), (429, 1)]
+    start = time.perf_counter()
+    with Client(node.url, retries=3, backoff=0.01) as client:
+        prediction = client.classify(images[0][0])
+    assert time.perf_counter() - start >= 1.0
+    assert prediction.vegetable == images[0][1]
+    assert not node.faults and len(node.calls) == 1
+
+
+def test_gives_up_after_retries(nodes, images):
+    node = nodes[0]
+    node.faults = [(503, 0)] * 3
+    with Client(node.url, retries=2) as client:
+        with pytest.raises(GreenClassifyError) as info:
+            client.classify(images[0][0])
+    assert info.value.status_code == 503
+    assert not node.calls
+
+
+def test_async_client(nodes, images):
+    node = nodes[0]
+    node.faults = [(429, 0)]
+
+    async def run():
+        async with AsyncClient(node.url, batch_size=6, max_concurrency=2) as client:
+            return await client.classify_many([path for path, _ in images] + [('notes.txt', b'hello')])
+
+    predictions = asyncio.run(run())
+    assert [p.vegetable for p in predictions[:-1]] == [name for _, name in images]
+    assert predictions[-1].filename == 'notes.txt' and predictions[-1].error
+    assert sorted(count for count, _ in node.calls) == [3, 6, 6, 6]
+
+
+def test_falls_back_to_single_predict_without_batch_endpoint(nodes, images):
+    node = Node(batch=False)
+    try:
+        with Client(node.url, batch_size=4, max_concurrency=1) as client:
+            predictions = client.classify_many([path for path, _ in images[:6]] + [('notes.txt', b'hello')])
+    finally:
+        node.close()
+    assert [p.vegetable for p in predictions[:-1]] == [name for _, name in images[:6]]
+    assert predictions[-1].filename == 'notes.txt' and predictions[-1].error
+    # The first batch call finds no endpoint; every image then goes to /predict on its own
+    assert [count for count, _ in node.calls] == [4] + [1] * 7
+
+
+def test_files_are_read_when_their_call_is_sent(images):
+    client = Client('http://127.0.0.1:1', batch_size=4)
+    calls, count = client._calls([path for path, _ in images] + [b'raw bytes'])
+    client.close()
+    assert count == 21
+    sources = [image.source for call in calls for image in call.images]
+    assert sum(isinstance(source, bytes) for source in sources) == 1
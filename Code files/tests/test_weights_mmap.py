@@ -0,0 +1,70 @@
+"""Shared memory-mapped weights: forward pass and per-worker memory"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import weights_mmap
+
+SHAPE = (150, 150, 3)
+WORKERS = 3
+
+
+@pytest.fixture(scope='module')
+def weight_file(tmp_path_factory):
+    """Flatten -> Dense(128, relu) -> Dense(5, softmax); the first kernel is ~35 MB"""
+    rng = np.random.default_rng(0)
+    features = int(np.prod(SHAPE))
+    layers = [
+        {'type': 'Flatten', 'name': 'flatten', 'arrays': []},
+        {'type': 'Dense', 'name': 'dense', 'activation': 'relu', 'arrays': ['1/kernel', '1/bias']},
+        {'type': 'Dense', 'name': 'output', 'activation': 'softmax', 'arrays': ['2/kernel', '2/bias']},
+    ]
+    arrays = {
+        '1/kernel': rng.standard_normal((features, 128), dtype=np.float32) * 0.01,
+        '1/bias': np.zeros(128, np.float32),
+        '2/kernel': rng.standard_normal((128, 5), dtype=np.float32),
+        '2/bias': np.zeros(5, np.float32),
+    }
+    path = str(tmp_path_factory.mktemp('weights') / 'synthetic.weights')
+    weights_mmap.write_weights(path, layers, dict(arrays), source_version='test')
+    return path, arrays
+
+
+def test_forward_pass_matches_numpy(weight_file):
+    path, arrays = weight_file
+    batch = np.random.default_rng(1).random((10, *SHAPE), dtype=np.float32)
+    hidden = np.maximum(batch.reshape(10, -1) @ arrays['1/kernel'] + arrays['1/bias'], 0)
+    logits = hidden @ arrays['2/kernel'] + arrays['2/bias']
+    expected = np.exp(logits - logits.max(axis=1, keepdims=True))
+    expected /= expected.sum(axis=1, keepdims=True)
+
+    model = weights_mmap.MappedModel(path)
+    probs, embeddings = model.predict_with_embeddings(batch)
+    np.testing.assert_allclose(probs, expected, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(embeddings, hidden, rtol=1e-4, atol=1e-5)
+    assert model.source_version == 'test'
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux') or not os.path.exists('/proc/self/smaps_rollup'),
+                    reason="needs Linux /proc/<pid>/smaps_rollup")
+def test_workers_share_one_copy_of_the_weights(weight_file):
+    path, _ = weight_file
+    weights_mb = os.path.getsize(path) / 2 ** 20
+
+    private = weights_mmap.sample_workers(path, WORKERS, private=True, shape=SHAPE)
+    mapped = weights_mmap.sample_workers(path, WORKERS, private=False, shape=SHAPE)
+
+    def total_pss_mb(samples):
+        return sum(s['Pss'] for s in samples) / 1024
+
+    def mean_shared_mb(samples):
+        return np.mean([s.get('Shared_Clean', 0) + s.get('Shared_Dirty', 0) for s in samples]) / 1024
+
+    # Each mapped worker sees the weight pages as shared with the others ...
+    assert mean_shared_mb(mapped) - mean_shared_mb(private) > 0.8 * weights_mb
+    # ... so across the workers they are counted about once instead of WORKERS times
+    saved = total_pss_mb(private) - total_pss_mb(mapped)
+    assert saved > 0.6 * weights_mb * (WORKERS - 1)
@@ -0,0 +1,197 @@
+"""
+GreenClassify - Tiled Classification
+Per-region labels and class counts for large mixed-crate photos
+
+The upload is scaled so its longest edge is TILE_MAX_EDGE, then cut into
+overlapping model-sized windows at every scale in TILE_SCALES. The windows
+are strided views of the decoded pixels (no per-tile copies); the only copy
+is the gather into the float batch, which goes through the model in a single
+forward pass. Confident tiles of the same class that overlap are merged into
+one region, and the regions per class give the counts. Boxes are in the
+pixels of the decoded image, whose size is returned alongside them.
+
+Usage in app.py:
+    import tiling
+    tiling.init_app(app)                       # POST /predict/tiles, 'image' field like /predict
+
+    python tiling.py crate.jpg
+"""
+
+import argparse
+import math
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from flask import Blueprint, Flask, jsonify, request
+from PIL import Image
+
+import admission
+import config
+import preprocessing
+
+
+def _positions(length: int, tile: int, stride: int) -> np.ndarray:
+    """Window offsets along one axis, with the last window flush to the edge"""
+    positions = np.arange(0, length - tile + 1, stride)
+    if positions[-1] != length - tile:
+        positions = np.append(positions, length - tile)
+    return positions
+
+
+def extract_tiles(img: Image.Image, scales=config.TILE_SCALES, overlap: float = config.TILE_OVERLAP
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+    """(N, H, W, 3) float batch and (N, 4) boxes in img coordinates"""
+    tile_h, tile_w = config.IMAGE_TARGET_SIZE
+    stride_h = max(1, int(tile_h * (1 - overlap)))
+    stride_w = max(1, int(tile_w * (1 - overlap)))
+
+    levels, boxes = [], []
+    for scale in scales:
+        width, height = round(img.width * scale), round(img.height * scale)
+        if width < tile_w or height < tile_h:
+            continue
+        scaled = img
+        if (width, height) != img.size:
+            scaled = img.resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+        pixels = np.asarray(scaled)
+        # (H - th + 1, W - tw + 1, th, tw, 3) view over the same buffer
+        windows = np.lib.stride_tricks.sliding_window_view(pixels, (tile_h, tile_w, 3))[:, :, 0]
+        ys = _positions(height, tile_h, stride_h)
+        xs = _positions(width, tile_w, stride_w)
+        levels.append((windows, ys, xs))
+        yy, xx = np.meshgrid(ys, xs, indexing='ij')
+        level_boxes = np.stack([xx, yy, xx + tile_w, yy + tile_h], axis=-1).reshape(-1, 4)
+        boxes.append(level_boxes / scale)
+
+    if not levels:
+        # Smaller than one tile: classify the whole image as a single region
+        return preprocessing.prepare_input(img), np.array([[0, 0, img.width, img.height]], dtype=float)
+
+    total = sum(len(ys) * len(xs) for _, ys, xs in levels)
+    if total > config.TILE_MAX_TILES:
+        raise preprocessing.UploadError(
+            f"Image would produce {total} tiles (limit {config.TILE_MAX_TILES}); lower TILE_SCALES.")
+
+    batch = np.empty((total, tile_h, tile_w, 3), dtype=np.float32)
+    scale = np.float32(1 / 255.0 if config.IMAGE_NORMALIZATION else 1.0)
+    offset = 0
+    for windows, ys, xs in levels:
+        count = len(ys) * len(xs)
+        selected = windows[np.ix_(ys, xs)].reshape(count, tile_h, tile_w, 3)  # the only pixel copy
+        np.multiply(selected, scale, out=batch[offset:offset + count])
+        offset += count
+    return batch, np.concatenate(boxes)
+
+
+def merge_tiles(probs: np.ndarray, boxes: np.ndarray, min_confidence: float = config.CONFIDENCE_THRESHOLD,
+                min_overlap: float = config.TILE_MERGE_OVERLAP) -> List[dict]:
+    """Connected groups of confident, overlapping same-class tiles, one region each"""
+    labels = probs.argmax(axis=1)
+    confidences = probs.max(axis=1)
+    keep = np.flatnonzero(confidences >= min_confidence)
+    boxes, labels, confidences = boxes[keep], labels[keep], confidences[keep]
+
+    # Pairwise overlap as a share of the smaller tile, so tiles of different scales link up
+    inter_w = np.clip(np.minimum(boxes[:, None, 2], boxes[None, :, 2]) -
+                      np.maximum(boxes[:, None, 0], boxes[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes[:, None, 3], boxes[None, :, 3]) -
+                      np.maximum(boxes[:, None, 1], boxes[None, :, 1]), 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    overlap = inter_w * inter_h / np.minimum(area[:, None], area[None, :])
+    linked = (overlap >= min_overlap) & (labels[:, None] == labels[None, :])
+
+    regions: List[dict] = []
+    unvisited = np.ones(len(keep), dtype=bool)
+    for seed in np.argsort(-confidences):
+        if not unvisited[seed]:
+            continue
+        members, frontier = [], [seed]
+        unvisited[seed] = False
+        while frontier:
+            i = frontier.pop()
+            members.append(i)
+            neighbours = np.flatnonzero(linked[i] & unvisited)
+            unvisited[neighbours] = False
+            frontier.extend(neighbours)
+        group = boxes[members]
+        regions.append({
+            'label': int(labels[seed]),
+            'box': np.concatenate([group[:, :2].min(axis=0), group[:, 2:].max(axis=0)]),
+            'scores': confidences[members],
+        })
+    return regions
+
+
+def classify_tiles(img: Image.Image) -> Dict[str, object]:
+    """Regions (boxes in img pixels), class counts and timings for one decoded image"""
+    import inference
+
+    timings = {}
+    start = time.perf_counter()
+    scale = min(1.0, config.TILE_MAX_EDGE / max(img.size))
+    tiled = img
+    if scale < 1.0:
+        tiled = img.resize((round(img.width * scale), round(img.height * scale)), Image.BILINEAR, reducing_gap=2.0)
+    batch, boxes = extract_tiles(tiled)
+    timings['tile_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with admission.model_call():
+        probs = np.asarray(inference.predict(batch))
+    timings['inference_ms'] = (time.perf_counter() - start) * 1000
+
+    class_map = inference.get_class_map()
+    regions, counts = [], {}
+    for region in merge_tiles(probs, boxes):
+        name = class_map.get(int(region['label']), str(region['label']))
+        counts[name] = counts.get(name, 0) + 1
+        regions.append({
+            'class': name,
+            'confidence': round(float(np.mean(region['scores'])) * 100, 2),
+            'box': [int(math.floor(v / scale)) for v in region['box']],
+            'tiles': len(region['scores']),
+        })
+    return {
+        'image_size': list(img.size),
+        'regions': regions,
+        'counts': counts,
+        'tiles': len(batch),
+        'timings_ms': {k: round(v, 2) for k, v in timings.items()},
+    }
+
+
+# ==================== Flask Integration ==================== #
+tiling_bp = Blueprint('tiling', __name__)
+
+
+@tiling_bp.route('/predict/tiles', methods=['POST'])
+def predict_tiles():
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify(error="No file selected"), 400
+    try:
+        img = preprocessing.load_upload(file.stream, file.filename, draft_edge=config.TILE_MAX_EDGE)
+        return jsonify(classify_tiles(img))
+    except preprocessing.UploadError as e:
+        return jsonify(error=str(e)), 400
+
+
+def init_app(app: Flask):
+    app.register_blueprint(tiling_bp)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tiled multi-vegetable classification")
+    parser.add_argument('image')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        start = time.perf_counter()
+        image = preprocessing.load_upload(f, args.image, draft_edge=config.TILE_MAX_EDGE)
+        decode_ms = (time.perf_counter() - start) * 1000
+    result = classify_tiles(image)
+    print(f"{result['tiles']} tiles, decode {decode_ms:.1f} ms, timings {result['timings_ms']}")
+    for region in result['regions']:
+        print(f"  {region['class']:<15} {region['confidence']:6.2f}%  box={region['box']} tiles={region['tiles']}")
+    print(f"Counts: {result['counts']}")
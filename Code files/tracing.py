@@ -0,0 +1,248 @@
+"""
+GreenClassify - Request Tracing
+Trace IDs, per-stage spans and Server-Timing headers for /predict
+
+Every traced request gets a trace ID (taken from an incoming W3C
+traceparent header when present) and a root span. Stages are recorded as
+child spans; the standard names are:
+
+    receive    reading and parsing the multipart body (recorded automatically)
+    validate   file type and payload checks
+    save       writing the upload and its thumbnail
+    decode     decoding and resizing the image
+    queue      waiting for the model (recorded by admission.model_call)
+    inference  the forward pass
+    render     template rendering (recorded automatically)
+
+The response carries an X-Trace-Id header and a Server-Timing header that
+browser devtools show under "Timing". With TRACE_EXPORT_PATH set, requests
+slower than TRACE_EXPORT_MIN_MS are appended in OTLP/JSON form (one line per
+request, readable by the OpenTelemetry Collector's otlpjsonfile receiver).
+
+Usage in app.py (after admission.init_app, so shed requests are not traced):
+    import tracing
+    tracing.init_app(app)
+    ...
+    with tracing.span('inference'):
+        probs = inference.predict(batch)
+"""
+
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from flask import Flask, before_render_template, g, has_app_context, request, template_rendered
+
+import config
+
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'start_ns', 'end_ns', 'attributes')
+
+    def __init__(self, name: str, start_ns: Optional[int] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, object] = {}
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, name: str, traceparent: Optional[str] = None):
+        match = TRACEPARENT_RE.match(traceparent or '')
+        self.trace_id = match.group(1) if match else os.urandom(16).hex()
+        self.parent_span_id = match.group(2) if match else None
+        self.root = Span(name)
+        self.spans: List[Span] = []
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds per stage name, summed over repeats (for log_prediction)"""
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            if s.end_ns is not None:
+                totals[s.name] = totals.get(s.name, 0.0) + (s.end_ns - s.start_ns) / 1e9
+        return totals
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings().items()]
+        entries.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ', '.join(entries)
+
+    def to_otlp(self) -> dict:
+        def encode(s: Span, parent: Optional[str], kind: int) -> dict:
+            span = {
+                'traceId': self.trace_id, 'spanId': s.span_id, 'name': s.name, 'kind': kind,
+                'startTimeUnixNano': str(s.start_ns), 'endTimeUnixNano': str(s.end_ns or s.start_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+            }
+            if parent:
+                span['parentSpanId'] = parent
+            return span
+
+        spans = [encode(self.root, self.parent_span_id, SPAN_KIND_SERVER)]
+        spans += [encode(s, self.root.span_id, SPAN_KIND_INTERNAL) for s in self.spans]
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'greenclassify'}}]},
+            'scopeSpans': [{'scope': {'name': 'greenclassify.tracing'}, 'spans': spans}],
+        }]}
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+# ==================== Span API ==================== #
+def current_trace() -> Optional[Trace]:
+    return g.get('trace') if has_app_context() else None
+
+
+def current_trace_id() -> Optional[str]:
+    trace = current_trace()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a child span of the current request; a no-op outside traced requests"""
+    trace = g.get('trace') if has_app_context() else None
+    if trace is None:
+        yield None
+        return
+    s = Span(name)
+    s.attributes.update(attributes)
+    trace.spans.append(s)
+    try:
+        yield s
+    finally:
+        s.end_ns = time.time_ns()
+
+
+def set_attribute(key: str, value):
+    """Attach an attribute (e.g. predicted class) to the request's root span"""
+    trace = g.get('trace') if has_app_context() else None
+    if trace is not None:
+        trace.root.attributes[key] = value
+
+
+# ==================== Export ==================== #
+class TraceExporter:
+    """Appends finished traces to a JSON-lines file from a background thread"""
+
+    def __init__(self, path: str, max_queue: int = config.TRACE_QUEUE_SIZE):
+        self.path = path
+        self.queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self.exported = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Trace):
+        try:
+            self.queue.put_nowait(trace.to_otlp())
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                f.write(json.dumps(item, separators=(',', ':')) + '\n')
+                self.exported += 1
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+
+
+_exporter: Optional[TraceExporter] = None
+
+
+# ==================== Flask Integration ==================== #
+def _before_request():
+    if request.endpoint not in config.TRACE_ENDPOINTS:
+        return
+    trace = Trace(f"{request.method} {request.path}", request.headers.get('traceparent'))
+    trace.root.attributes.update({'http.method': request.method, 'http.route': request.path,
+                                  'http.request_content_length': request.content_length or 0})
+    g.trace = trace
+    if request.method == 'POST':
+        # Flask parses the body lazily; do it here so the read is its own span
+        with span('receive'):
+            request.files
+
+
+def _after_request(response):
+    trace = g.get('trace')
+    if trace is not None:
+        trace.root.attributes['http.status_code'] = response.status_code
+        response.headers['X-Trace-Id'] = trace.trace_id
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+
+def _teardown_request(exc):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    trace.root.end_ns = time.time_ns()
+    if exc is not None:
+        trace.root.attributes['error'] = repr(exc)
+    if _exporter is not None and trace.root.duration_ms >= config.TRACE_EXPORT_MIN_MS:
+        _exporter.submit(trace)
+
+
+def _render_started(sender, template, context, **extra):
+    trace = g.get('trace')
+    if trace is not None:
+        s = Span('render')
+        s.attributes['template'] = template.name or ''
+        trace.spans.append(s)
+
+
+def _render_finished(sender, template, context, **extra):
+    trace = g.get('trace')
+    if trace is not None:
+        for s in reversed(trace.spans):
+            if s.name == 'render' and s.end_ns is None:
+                s.end_ns = time.time_ns()
+                break
+
+
+def init_app(app: Flask):
+    """Trace TRACE_ENDPOINTS and optionally export spans to TRACE_EXPORT_PATH"""
+    global _exporter
+    if not config.TRACE_ENABLED:
+        return
+    if config.TRACE_EXPORT_PATH and _exporter is None:
+        _exporter = TraceExporter(os.path.join(app.root_path, config.TRACE_EXPORT_PATH))
+        atexit.register(_exporter.close)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
@@ -0,0 +1,196 @@
+"""
+GreenClassify - Multi-Process Training
+Data-parallel CPU training over localhost with MultiWorkerMirroredStrategy
+
+The launcher starts N worker processes, each with its own TF_CONFIG and a
+share of the CPU cores. Every worker reads a disjoint shard of the file list
+and gradients are all-reduced after each step. Worker 0 (the chief) writes
+vegetable_classifier.h5 and class_map.pkl.
+
+Usage:
+    python train_distributed.py --train-dir data/train --val-dir data/validation --workers 4
+    python train_distributed.py --train-dir data/train --scaling 1,2,4,8 --steps 50
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import config
+import manifest
+
+
+def _free_ports(count: int) -> List[int]:
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def launch(args: argparse.Namespace, workers: int, result_path: str) -> float:
+    """Run one training job across `workers` local processes, return wall time"""
+    cluster = {'worker': [f"localhost:{port}" for port in _free_ports(workers)]}
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    procs = []
+    start = time.perf_counter()
+    for index in range(workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}})
+        env['GREENCLASSIFY_THREADS'] = str(threads)
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker',
+               '--result', result_path] + args.passthrough
+        procs.append(subprocess.Popen(cmd, env=env))
+
+    # A dead worker leaves the others blocked in collectives, so stop them all
+    while None in [p.poll() for p in procs]:
+        failed = [index for index, p in enumerate(procs) if p.returncode not in (None, 0)]
+        if failed:
+            for p in procs:
+                if p.poll() is None:
+                    p.terminate()
+            for p in procs:
+                p.wait()
+            raise RuntimeError(f"worker {failed[0]} exited with status {procs[failed[0]].returncode}; "
+                               f"stopped the others")
+        time.sleep(1)
+    failed = [p.args for p in procs if p.returncode != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {workers} workers failed")
+    return time.perf_counter() - start
+
+
+def run_worker(args: argparse.Namespace):
+    """Body of one worker process (TF_CONFIG is set by the launcher)"""
+    import tensorflow as tf
+
+    import training
+
+    threads = int(os.environ.get('GREENCLASSIFY_THREADS', '0'))
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING))
+    task_index = json.loads(os.environ['TF_CONFIG'])['task']['index']
+    is_chief = task_index == 0
+
+    paths, labels, class_names = training.list_images(args.train_dir)
+    num_classes = len(class_names)
+    steps = args.steps or len(paths) // args.batch_size
+
+    def train_fn(ctx: tf.distribute.InputContext):
+        return training.make_dataset(paths, labels, num_classes,
+                                     ctx.get_per_replica_batch_size(args.batch_size),
+                                     training=True, seed=args.seed, input_context=ctx)
+
+    train_ds = strategy.distribute_datasets_from_function(train_fn)
+    val_ds = None
+    if args.val_dir:
+        val_paths, val_labels, _ = training.list_images(args.val_dir)
+        val_ds = training.make_dataset(val_paths, val_labels, num_classes, args.batch_size)
+
+    with strategy.scope():
+        model = training.compile_model(training.build_model(num_classes))
+
+    callbacks = [tf.keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True)] if val_ds else []
+    start = time.perf_counter()
+    history = model.fit(train_ds, epochs=args.epochs, steps_per_epoch=steps,
+                        validation_data=val_ds, callbacks=callbacks, verbose=2 if is_chief else 0)
+    elapsed = time.perf_counter() - start
+
+    # Every worker must take part in saving; only the chief keeps its copy
+    if not args.no_save:
+        if is_chief:
+            training.save_artifacts(model, class_names, args.model_path, args.class_map_path)
+        else:
+            tmp = tempfile.mkdtemp()
+            try:
+                training.save_artifacts(model, class_names, os.path.join(tmp, 'model.h5'),
+                                        os.path.join(tmp, 'class_map.pkl'))
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    if is_chief and args.result:
+        # Early stopping may end the run before args.epochs
+        images = len(history.epoch) * steps * args.batch_size
+        with open(args.result, 'w') as f:
+            json.dump({'train_seconds': elapsed, 'images_per_sec': images / elapsed}, f)
+
+
+def report_scaling(args: argparse.Namespace, worker_counts: List[int]):
+    """Train with each worker count and print throughput and scaling efficiency"""
+    results: Dict[int, dict] = {}
+    for workers in worker_counts:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            result_path = f.name
+        wall = launch(args, workers, result_path)
+        with open(result_path) as f:
+            results[workers] = dict(json.load(f), wall_seconds=wall)
+        os.remove(result_path)
+
+    base = results[worker_counts[0]]['images_per_sec'] / worker_counts[0]
+    print(f"\n{'workers':>8} {'images/sec':>12} {'speedup':>8} {'efficiency':>10} {'wall (s)':>9}")
+    for workers, result in results.items():
+        speedup = result['images_per_sec'] / (base * worker_counts[0])
+        efficiency = result['images_per_sec'] / (base * workers)
+        print(f"{workers:>8} {result['images_per_sec']:>12.1f} {speedup:>8.2f} "
+              f"{efficiency:>10.0%} {result['wall_seconds']:>9.1f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Data-parallel CPU training")
+    parser.add_argument('--train-dir', required=True)
+    parser.add_argument('--val-dir')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--scaling', help="Comma-separated worker counts to benchmark, e.g. 1,2,4,8")
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--steps', type=int, help="Steps per epoch (default: one pass over the data)")
+    parser.add_argument('--batch-size', type=int, default=32, help="Global batch size")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--model-path', default=config.MODEL_PATH)
+    parser.add_argument('--class-map-path', default=config.CLASS_MAP_PATH)
+    parser.add_argument('--no-save', action='store_true', help="Skip writing model artifacts")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Options forwarded unchanged to the worker processes
+    args.passthrough = ['--train-dir', args.train_dir, '--epochs', str(args.epochs),
+                        '--batch-size', str(args.batch_size), '--seed', str(args.seed),
+                        '--model-path', args.model_path, '--class-map-path', args.class_map_path]
+    if args.val_dir:
+        args.passthrough += ['--val-dir', args.val_dir]
+    if args.steps:
+        args.passthrough += ['--steps', str(args.steps)]
+    if args.no_save or args.scaling:
+        # Benchmark runs must not overwrite the model the app serves
+        args.passthrough.append('--no-save')
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+    # Once, here in the launcher; the workers only read the manifest
+    manifest.refresh(args.train_dir, args.val_dir)
+    if args.scaling:
+        report_scaling(args, [int(n) for n in args.scaling.split(',')])
+    else:
+        launch(args, args.workers, '')
+
+
+if __name__ == '__main__':
+    main()
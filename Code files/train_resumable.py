@@ -0,0 +1,174 @@
+"""
+GreenClassify - Resumable Training and Fine-Tuning
+Checkpointed training with exact resume, and incremental fine-tuning on new data
+
+train     Trains from scratch. Every --checkpoint-every epochs the model, the
+          optimizer state, the epoch counter and the early-stopping state are
+          checkpointed. Each epoch reseeds every RNG from (seed + epoch) and
+          augments each batch from (seed + epoch, batch index), so a resumed
+          run replays the same shuffles and augmentations even though batches
+          are augmented in parallel. The best validation weights are
+          restored before the artifacts are written.
+
+finetune  Starts from the current vegetable_classifier.h5 and trains only on
+          images added or changed since the last run, mixed with a replay
+          sample of already-seen images so old classes are not forgotten.
+
+Usage:
+    python train_resumable.py train --train-dir data/train --val-dir data/validation
+    python train_resumable.py finetune --train-dir data/train --val-dir data/validation
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+import config
+import manifest
+import training
+
+
+def _file_state(paths: Sequence[str]) -> Dict[str, List[float]]:
+    """mtime and size per file, used to detect new or changed samples"""
+    state = {}
+    for path in paths:
+        stat = os.stat(path)
+        state[path] = [stat.st_mtime, stat.st_size]
+    return state
+
+
+def _save_state(state_path: str, paths: Sequence[str]):
+    with open(state_path, 'w') as f:
+        json.dump(_file_state(paths), f)
+
+
+def fit_resumable(model: tf.keras.Model, paths: Sequence[str], labels: Sequence[int],
+                  num_classes: int, val_ds: tf.data.Dataset, args: argparse.Namespace) -> tf.keras.Model:
+    """Epoch loop with periodic checkpoints, exact resume and best-weights restore"""
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    ckpt = tf.train.Checkpoint(model=model, optimizer=model.optimizer,
+                               epoch=tf.Variable(0, dtype=tf.int64),
+                               best_loss=tf.Variable(np.inf, dtype=tf.float64),
+                               wait=tf.Variable(0, dtype=tf.int64))
+    manager = tf.train.CheckpointManager(ckpt, args.checkpoint_dir, max_to_keep=3)
+    best_path = os.path.join(args.checkpoint_dir, 'best.weights.h5')
+
+    if manager.latest_checkpoint:
+        ckpt.restore(manager.latest_checkpoint)
+        print(f"Resuming from {manager.latest_checkpoint} at epoch {int(ckpt.epoch)}")
+
+    steps = args.steps or max(1, len(paths) // args.batch_size)
+    for epoch in range(int(ckpt.epoch), args.epochs):
+        # Reseed Python, NumPy and TF from the epoch number so a resumed run
+        # sees exactly the batches the interrupted run would have seen
+        tf.keras.utils.set_random_seed(args.seed + epoch)
+        train_ds = training.make_dataset(paths, labels, num_classes, args.batch_size,
+                                         training=True, seed=args.seed + epoch)
+        history = model.fit(train_ds, initial_epoch=epoch, epochs=epoch + 1, steps_per_epoch=steps,
+                            validation_data=val_ds, verbose=2)
+
+        val_loss = history.history['val_loss'][-1]
+        if val_loss < float(ckpt.best_loss):
+            ckpt.best_loss.assign(val_loss)
+            ckpt.wait.assign(0)
+            model.save_weights(best_path)
+        else:
+            ckpt.wait.assign_add(1)
+        ckpt.epoch.assign(epoch + 1)
+
+        stop = int(ckpt.wait) >= args.patience
+        if (epoch + 1) % args.checkpoint_every == 0 or stop or epoch + 1 == args.epochs:
+            manager.save(checkpoint_number=epoch + 1)
+        if stop:
+            print(f"Early stopping at epoch {epoch + 1}")
+            break
+
+    if os.path.exists(best_path):
+        model.load_weights(best_path)
+    return model
+
+
+def select_finetune_samples(paths: Sequence[str], labels: Sequence[int], state_path: str,
+                            replay_ratio: float, seed: int) -> Tuple[List[str], List[int], int]:
+    """New/changed samples plus a replay sample of previously seen ones"""
+    previous = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            previous = json.load(f)
+
+    current = _file_state(paths)
+    fresh = [i for i, path in enumerate(paths) if previous.get(path) != current[path]]
+    seen = [i for i, path in enumerate(paths) if previous.get(path) == current[path]]
+
+    rng = random.Random(seed)
+    replay = rng.sample(seen, min(len(seen), int(len(fresh) * replay_ratio)))
+    chosen = fresh + replay
+    rng.shuffle(chosen)
+    return [paths[i] for i in chosen], [labels[i] for i in chosen], len(fresh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable training and incremental fine-tuning")
+    parser.add_argument('mode', choices=['train', 'finetune'])
+    parser.add_argument('--train-dir', required=True)
+    parser.add_argument('--val-dir', required=True)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--steps', type=int, help="Steps per epoch (default: one pass over the data)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--patience', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--checkpoint-dir', default='checkpoints')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help="Epochs between checkpoints")
+    parser.add_argument('--learning-rate', type=float, help="Default: 1e-3 (train), 1e-4 (finetune)")
+    parser.add_argument('--replay-ratio', type=float, default=1.0,
+                        help="Old samples replayed per new sample when fine-tuning")
+    parser.add_argument('--state-file', default='training_state.json',
+                        help="Records which files the current model was trained on")
+    parser.add_argument('--model-path', default=config.MODEL_PATH)
+    parser.add_argument('--class-map-path', default=config.CLASS_MAP_PATH)
+    args = parser.parse_args()
+    # Separate directories so a fine-tune never resumes a from-scratch run
+    args.checkpoint_dir = os.path.join(args.checkpoint_dir, args.mode)
+
+    manifest.refresh(args.train_dir, args.val_dir)
+    paths, labels, class_names = training.list_images(args.train_dir)
+    num_classes = len(class_names)
+    val_paths, val_labels, _ = training.list_images(args.val_dir)
+    val_ds = training.make_dataset(val_paths, val_labels, num_classes, args.batch_size)
+
+    if args.mode == 'train':
+        model = training.compile_model(training.build_model(num_classes), args.learning_rate or 1e-3)
+        train_paths, train_labels = paths, labels
+    else:
+        model = tf.keras.models.load_model(args.model_path)
+        if model.output_shape[-1] != num_classes:
+            raise SystemExit(f"Model has {model.output_shape[-1]} outputs but the dataset has "
+                             f"{num_classes} classes; retrain from scratch to add classes")
+        train_paths, train_labels, fresh = select_finetune_samples(
+            paths, labels, args.state_file, args.replay_ratio, args.seed)
+        if not fresh:
+            print("No new or changed images since the last run; nothing to do")
+            return
+        print(f"Fine-tuning on {fresh} new/changed images + {len(train_paths) - fresh} replayed")
+        model = training.compile_model(model, args.learning_rate or 1e-4)
+        _, before = model.evaluate(val_ds, verbose=0)
+        print(f"Validation accuracy before fine-tuning: {before:.4f}")
+
+    model = fit_resumable(model, train_paths, train_labels, num_classes, val_ds, args)
+    _, accuracy = model.evaluate(val_ds, verbose=0)
+    print(f"Validation accuracy: {accuracy:.4f}")
+
+    training.save_artifacts(model, class_names, args.model_path, args.class_map_path)
+    _save_state(args.state_file, paths)
+    # The run finished, so the next invocation must start fresh rather than resume
+    shutil.rmtree(args.checkpoint_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
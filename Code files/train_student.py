@@ -0,0 +1,146 @@
+"""
+GreenClassify - Student Model Distillation
+Train the small low-resolution model used by the cascade (cascade.py)
+
+The student is a three-block CNN on STUDENT_IMAGE_SIZE inputs. It learns
+from the hard labels and from the temperature-softened probabilities of
+vegetable_classifier.h5, so its confidence tracks the full model's and a
+confidence threshold is a meaningful escalation rule.
+
+Usage:
+    python train_student.py --train-dir data/train --val-dir data/validation
+    python cascade.py evaluate --dir data/validation
+"""
+
+import argparse
+import os
+from typing import Sequence
+
+import tensorflow as tf
+from tensorflow.keras import Sequential
+from tensorflow.keras.layers import Conv2D, Dense, Dropout, Flatten, MaxPooling2D
+
+import config
+import manifest
+import training
+
+
+def build_student(num_classes: int) -> tf.keras.Model:
+    height, width = config.STUDENT_IMAGE_SIZE
+    model = Sequential()
+    model.add(Conv2D(16, 3, padding='same', activation='relu', input_shape=[height, width, 3]))
+    model.add(MaxPooling2D(2))
+    model.add(Conv2D(32, 3, padding='same', activation='relu'))
+    model.add(MaxPooling2D(2))
+    model.add(Conv2D(64, 3, padding='same', activation='relu'))
+    model.add(MaxPooling2D(2))
+    model.add(Flatten())
+    model.add(Dense(64, activation='relu'))
+    model.add(Dropout(0.25))
+    model.add(Dense(num_classes, activation='softmax'))
+    return model
+
+
+class Distiller(tf.keras.Model):
+    """Trains the student against hard labels and the teacher's softened outputs"""
+
+    def __init__(self, student: tf.keras.Model, teacher: tf.keras.Model,
+                 alpha: float = 0.5, temperature: float = 4.0):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.alpha = alpha
+        self.temperature = temperature
+        self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+        self.accuracy = tf.keras.metrics.CategoricalAccuracy(name='accuracy')
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.accuracy]
+
+    def _soften(self, probs: tf.Tensor) -> tf.Tensor:
+        # Both models end in softmax, so rescale their log-probabilities
+        return tf.nn.softmax(tf.math.log(probs + 1e-7) / self.temperature)
+
+    def train_step(self, data):
+        (student_x, teacher_x), y = data
+        teacher_probs = self.teacher(teacher_x, training=False)
+        with tf.GradientTape() as tape:
+            student_probs = self.student(student_x, training=True)
+            hard = tf.keras.losses.categorical_crossentropy(y, student_probs)
+            soft = tf.keras.losses.kl_divergence(self._soften(teacher_probs), self._soften(student_probs))
+            loss = tf.reduce_mean(self.alpha * hard + (1 - self.alpha) * soft * self.temperature ** 2)
+        grads = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(grads, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.accuracy.update_state(y, student_probs)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        (student_x, _), y = data
+        student_probs = self.student(student_x, training=False)
+        self.loss_tracker.update_state(tf.keras.losses.categorical_crossentropy(y, student_probs))
+        self.accuracy.update_state(y, student_probs)
+        return {m.name: m.result() for m in self.metrics}
+
+
+def make_dataset(paths: Sequence[str], labels: Sequence[int], num_classes: int,
+                 batch_size: int, training_mode: bool = False, seed: int = 42) -> tf.data.Dataset:
+    """((student image, teacher image), one-hot) with both sizes cut from one decode"""
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        if training_mode:
+            image = tf.image.random_flip_left_right(image, seed=seed)
+        # Resize from the original, as preprocessing.prepare_input does when serving
+        student = tf.image.resize(image, config.STUDENT_IMAGE_SIZE, method='nearest')
+        teacher = tf.image.resize(image, config.IMAGE_TARGET_SIZE, method='nearest')
+        return ((tf.cast(student, tf.float32) / 255.0, tf.cast(teacher, tf.float32) / 255.0),
+                tf.one_hot(label, num_classes))
+
+    ds = tf.data.Dataset.from_tensor_slices((list(paths), list(labels)))
+    if training_mode:
+        ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil vegetable_classifier.h5 into a small student")
+    parser.add_argument('--train-dir', required=True)
+    parser.add_argument('--val-dir', required=True)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--alpha', type=float, default=0.5, help="Weight of the hard-label loss")
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--teacher', default=config.MODEL_PATH)
+    parser.add_argument('--output', default=config.STUDENT_MODEL_PATH)
+    args = parser.parse_args()
+
+    tf.keras.utils.set_random_seed(args.seed)
+    manifest.refresh(args.train_dir, args.val_dir)
+    paths, labels, class_names = training.list_images(args.train_dir)
+    val_paths, val_labels, _ = training.list_images(args.val_dir)
+    num_classes = len(class_names)
+
+    teacher = tf.keras.models.load_model(args.teacher)
+    teacher.trainable = False
+    student = build_student(num_classes)
+    distiller = Distiller(student, teacher, args.alpha, args.temperature)
+    distiller.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate))
+
+    early_stop = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=5,
+                                                  restore_best_weights=True)
+    distiller.fit(make_dataset(paths, labels, num_classes, args.batch_size, True, args.seed),
+                  validation_data=make_dataset(val_paths, val_labels, num_classes, args.batch_size),
+                  epochs=args.epochs, callbacks=[early_stop], verbose=2)
+
+    student.compile(loss='categorical_crossentropy', metrics=['accuracy'])
+    student.save(args.output)
+    print(f"Student ({student.count_params():,} parameters, teacher {teacher.count_params():,}) "
+          f"saved to {os.path.abspath(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
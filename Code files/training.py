@@ -0,0 +1,116 @@
+"""
+GreenClassify - Model Training
+Notebook model definition and tf.data input pipeline shared by the training scripts
+"""
+
+import os
+import pickle
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tensorflow as tf
+from tensorflow.keras import Sequential
+from tensorflow.keras.layers import Conv2D, Dense, Dropout, Flatten, MaxPooling2D
+
+import config
+from augment import BatchAugmenter
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def build_model(num_classes: int = 15, dense_units: Sequence[int] = (128, 128),
+                dropout: float = 0.25) -> tf.keras.Model:
+    """The CNN from the training notebook"""
+    height, width = config.IMAGE_TARGET_SIZE
+    model = Sequential()
+    model.add(Conv2D(filters=32, kernel_size=3, strides=1, padding='same', activation='relu',
+                     input_shape=[height, width, 3]))
+    model.add(MaxPooling2D(2))
+    model.add(Conv2D(filters=64, kernel_size=3, strides=1, padding='same', activation='relu'))
+    model.add(MaxPooling2D(2))
+    model.add(Flatten())
+    model.add(Dense(dense_units[0], activation='relu'))
+    model.add(Dropout(dropout))
+    for units in dense_units[1:]:
+        model.add(Dense(units, activation='relu'))
+    model.add(Dense(num_classes, activation='softmax'))
+    return model
+
+
+def compile_model(model: tf.keras.Model, learning_rate: float = 0.001) -> tf.keras.Model:
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+
+def list_images(directory: str) -> Tuple[List[str], List[int], List[str]]:
+    """Paths, label indices and class names for a class-per-folder dataset"""
+    # Prefer the manifest (python manifest.py build ...) over walking the tree,
+    # as long as it still matches the folders on disk (see manifest.refresh)
+    if os.path.exists(config.MANIFEST_PATH):
+        import manifest
+        index = manifest.Manifest(config.MANIFEST_PATH)
+        try:
+            if index.has_split(directory) and index.is_current(directory):
+                return index.samples(directory)
+        finally:
+            index.close()
+
+    class_names = sorted(name for name in os.listdir(directory)
+                         if os.path.isdir(os.path.join(directory, name)))
+    paths, labels = [], []
+    for label, name in enumerate(class_names):
+        class_dir = os.path.join(directory, name)
+        for filename in sorted(os.listdir(class_dir)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, filename))
+                labels.append(label)
+    return paths, labels, class_names
+
+
+def load_image(path: tf.Tensor) -> tf.Tensor:
+    """Decode, resize (nearest, like flow_from_directory) and rescale to [0, 1]"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, config.IMAGE_TARGET_SIZE, method='nearest')
+    return tf.cast(image, tf.float32) / 255.0
+
+
+def make_dataset(paths: Sequence[str], labels: Sequence[int], num_classes: int,
+                 batch_size: int, training: bool = False, seed: int = 42,
+                 input_context: Optional[tf.distribute.InputContext] = None) -> tf.data.Dataset:
+    """Batched (image, one-hot label) dataset, sharded per input pipeline if given"""
+    ds = tf.data.Dataset.from_tensor_slices((list(paths), list(labels)))
+    if input_context is not None and input_context.num_input_pipelines > 1:
+        # Shard file names before decoding so each worker only reads its part
+        ds = ds.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+    if training:
+        ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    ds = ds.map(lambda p, y: (load_image(p), tf.one_hot(y, num_classes)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+    if training:
+        ds = ds.repeat()
+    ds = ds.batch(batch_size, drop_remainder=training)
+    if training:
+        # One vectorized affine resampling per batch (see augment.py). The
+        # transforms are drawn from (seed, batch index) rather than a shared
+        # RNG, so parallel map calls finishing in any order give the same data
+        augmenter = BatchAugmenter(seed=seed)
+
+        def augment(index: tf.Tensor, batch: Tuple[tf.Tensor, tf.Tensor]):
+            x, y = batch
+            return tf.ensure_shape(tf.numpy_function(augmenter.seeded, [x, index], tf.float32), x.shape), y
+
+        ds = ds.enumerate().map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def save_artifacts(model: tf.keras.Model, class_names: Sequence[str],
+                   model_path: str = config.MODEL_PATH,
+                   class_map_path: str = config.CLASS_MAP_PATH):
+    """Write the .h5 model and class_map.pkl the Flask app loads"""
+    model.save(model_path)
+    class_map: Dict[int, str] = dict(enumerate(class_names))
+    with open(class_map_path, 'wb') as f:
+        pickle.dump(class_map, f)
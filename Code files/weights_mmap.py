@@ -0,0 +1,298 @@
+"""
+GreenClassify - Memory-Mapped Weights
+Flat page-aligned weight file and a NumPy forward pass that reads it in place
+
+`export` writes every layer's weights from vegetable_classifier.h5 into one
+file: a JSON header describing the layers, then each array at a 4 KiB page
+boundary, already in the layout the forward pass multiplies with. Serving
+processes map the file read-only, so the OS page cache holds one physical
+copy of the weights for all of them and no process needs TensorFlow.
+
+Usage:
+    python weights_mmap.py export                      # vegetable_classifier.weights
+    python weights_mmap.py measure --workers 4         # per-worker RSS/PSS, mmap vs private
+
+    # config.py
+    INFERENCE_BACKEND = 'mmap'
+"""
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config
+
+
+MAGIC = b'GCWMMAP1'
+PAGE_SIZE = mmap.PAGESIZE
+CHUNK_SIZE = 8  # Images per forward pass; bounds the im2col buffers
+
+
+def _align(offset: int) -> int:
+    return (offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+# ==================== Export ==================== #
+def write_weights(path: str, layers: List[dict], arrays: Dict[str, np.ndarray], source_version: str = ''):
+    """Write layer specs and named float32 arrays, each at a page boundary"""
+    specs, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype=np.float32)
+        arrays[name] = array
+        specs[name] = {'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({'layers': layers, 'arrays': specs, 'source_version': source_version}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + specs[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def export(model_path: str = config.MODEL_PATH, out_path: str = config.MMAP_WEIGHTS_PATH) -> str:
+    """Convert a Keras model of Conv2D/MaxPooling2D/Flatten/Dense/Dropout layers"""
+    import tensorflow as tf
+
+    import inference
+
+    model = tf.keras.models.load_model(model_path)
+    layers, arrays = [], {}
+    for i, layer in enumerate(model.layers):
+        kind = type(layer).__name__
+        cfg = layer.get_config()
+        spec = {'type': kind, 'name': layer.name}
+        if kind == 'Conv2D':
+            kernel, bias = layer.get_weights()
+            kh, kw, cin, cout = kernel.shape
+            # (cin, kh, kw, cout) matches the im2col patch order of the forward pass
+            arrays[f'{i}/kernel'] = kernel.transpose(2, 0, 1, 3).reshape(cin * kh * kw, cout)
+            arrays[f'{i}/bias'] = bias
+            spec.update(kernel_size=list(cfg['kernel_size']), strides=list(cfg['strides']),
+                        padding=cfg['padding'], activation=cfg['activation'])
+        elif kind == 'Dense':
+            kernel, bias = layer.get_weights()
+            arrays[f'{i}/kernel'] = kernel
+            arrays[f'{i}/bias'] = bias
+            spec.update(activation=cfg['activation'])
+        elif kind == 'MaxPooling2D':
+            spec.update(pool_size=list(cfg['pool_size']), strides=list(cfg['strides']),
+                        padding=cfg['padding'])
+        elif kind not in ('Flatten', 'Dropout', 'InputLayer'):
+            raise ValueError(f"Layer {layer.name} ({kind}) is not supported by the mmap backend")
+        spec['arrays'] = [k for k in arrays if k.startswith(f'{i}/')]
+        layers.append(spec)
+
+    write_weights(out_path, layers, arrays, inference.file_version(model_path))
+
+    # The exported forward pass must agree with Keras
+    sample = np.random.default_rng(0).random((4, *model.input_shape[1:]), dtype=np.float32)
+    expected = model.predict_on_batch(sample)
+    actual = MappedModel(out_path).predict(sample)
+    print(f"Exported {len(arrays)} arrays to {out_path} "
+          f"(max abs difference vs Keras {np.abs(expected - actual).max():.2e})")
+    return out_path
+
+
+# ==================== NumPy Forward Pass ==================== #
+def _activate(x: np.ndarray, activation: str) -> np.ndarray:
+    if activation == 'relu':
+        return np.maximum(x, 0, out=x)
+    if activation == 'softmax':
+        x = x - x.max(axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        return x / x.sum(axis=-1, keepdims=True)
+    if activation == 'linear':
+        return x
+    raise ValueError(f"Unsupported activation {activation}")
+
+
+def _same_padding(size: int, kernel: int, stride: int) -> Tuple[int, int]:
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _conv2d(x: np.ndarray, kernel: np.ndarray, bias: np.ndarray, spec: dict) -> np.ndarray:
+    (kh, kw), (sh, sw) = spec['kernel_size'], spec['strides']
+    if spec['padding'] == 'same':
+        x = np.pad(x, ((0, 0), _same_padding(x.shape[1], kh, sh), _same_padding(x.shape[2], kw, sw), (0, 0)))
+    # (N, H', W', C, kh, kw) view, flattened in the (cin, kh, kw) order of the exported kernel
+    patches = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))[:, ::sh, ::sw]
+    n, h, w = patches.shape[:3]
+    out = patches.reshape(n * h * w, -1) @ kernel
+    out += bias
+    return _activate(out, spec['activation']).reshape(n, h, w, -1)
+
+
+def _max_pool(x: np.ndarray, spec: dict) -> np.ndarray:
+    (ph, pw), (sh, sw) = spec['pool_size'], spec['strides']
+    n, height, width, c = x.shape
+    if (ph, pw) == (sh, sw) and spec['padding'] == 'valid':
+        h, w = height // ph, width // pw
+        return x[:, :h * ph, :w * pw].reshape(n, h, ph, w, pw, c).max(axis=(2, 4))
+    if spec['padding'] == 'same':
+        x = np.pad(x, ((0, 0), _same_padding(height, ph, sh), _same_padding(width, pw, sw), (0, 0)),
+                   constant_values=-np.inf)
+    windows = np.lib.stride_tricks.sliding_window_view(x, (ph, pw), axis=(1, 2))[:, ::sh, ::sw]
+    return windows.max(axis=(-2, -1))
+
+
+class MappedModel:
+    """Read-only view of an exported weight file with a NumPy forward pass"""
+
+    def __init__(self, path: str = config.MMAP_WEIGHTS_PATH, private: bool = False):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a GreenClassify weight file")
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len))
+            data_start = _align(len(MAGIC) + 8 + header_len)
+            if private:
+                # Comparison mode for `measure`: a private heap copy like a normal model load
+                f.seek(0)
+                self._buffer = bytearray(f.read())
+            else:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.layers = header['layers']
+        self.source_version = header.get('source_version', '')
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, spec in header['arrays'].items():
+            count = int(np.prod(spec['shape']))
+            self.arrays[name] = np.frombuffer(self._buffer, dtype=np.float32, count=count,
+                                              offset=data_start + spec['offset']).reshape(spec['shape'])
+
+    def _forward(self, x: np.ndarray, penultimate: bool = False):
+        embedding = None
+        last_dense = max(i for i, layer in enumerate(self.layers) if layer['type'] == 'Dense')
+        for i, layer in enumerate(self.layers):
+            kind = layer['type']
+            if kind == 'Conv2D':
+                x = _conv2d(x, self.arrays[f'{i}/kernel'], self.arrays[f'{i}/bias'], layer)
+            elif kind == 'MaxPooling2D':
+                x = _max_pool(x, layer)
+            elif kind == 'Flatten':
+                x = x.reshape(len(x), -1)
+            elif kind == 'Dense':
+                if i == last_dense:
+                    embedding = x
+                x = x @ self.arrays[f'{i}/kernel']
+                x += self.arrays[f'{i}/bias']
+                x = _activate(x, layer['activation'])
+        return (x, embedding) if penultimate else x
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Class probabilities for a (N, H, W, 3) batch"""
+        batch = np.asarray(batch, dtype=np.float32)
+        return np.concatenate([self._forward(batch[i:i + CHUNK_SIZE])
+                               for i in range(0, len(batch), CHUNK_SIZE)])
+
+    def predict_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Probabilities and penultimate Dense activations, like inference.predict_with_embeddings"""
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = [self._forward(batch[i:i + CHUNK_SIZE], penultimate=True)
+                   for i in range(0, len(batch), CHUNK_SIZE)]
+        return (np.concatenate([p for p, _ in outputs]),
+                np.concatenate([e for _, e in outputs]).astype(np.float32, copy=False))
+
+
+_lock = threading.Lock()
+_mapped: Optional[MappedModel] = None
+
+
+def get_mapped_model() -> MappedModel:
+    """Map MMAP_WEIGHTS_PATH once per process"""
+    global _mapped
+    if _mapped is None:
+        with _lock:
+            if _mapped is None:
+                _mapped = MappedModel(config.MMAP_WEIGHTS_PATH)
+    return _mapped
+
+
+# ==================== RSS Measurement ==================== #
+def _memory_kb() -> Dict[str, int]:
+    """Rss, Pss and shared/private page totals of this process (Linux)"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields
+
+
+def _measure_worker(path: str, private: bool, shape: Sequence[int], ready, done, results):
+    model = MappedModel(path, private=private)
+    model.predict(np.zeros((1, *shape), dtype=np.float32))  # touch every weight page
+    ready.wait()  # all workers hold their weights before anyone is measured
+    results.put(_memory_kb())
+    done.wait()
+
+
+def sample_workers(path: str, workers: int, private: bool,
+                   shape: Sequence[int] = (*config.IMAGE_TARGET_SIZE, 3)) -> List[Dict[str, int]]:
+    """Memory of N processes that hold the weights at the same time, one sample each"""
+    ctx = multiprocessing.get_context('spawn')
+    ready, done, results = ctx.Barrier(workers + 1), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_measure_worker, args=(path, private, shape, ready, done, results))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    try:
+        ready.wait(timeout=600)
+        time.sleep(0.5)
+        return [results.get(timeout=600) for _ in procs]
+    finally:
+        done.set()
+        for p in procs:
+            p.join()
+
+
+def measure(path: str, workers: int):
+    """Start N workers per mode and compare their memory with shared vs private weights"""
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        raise SystemExit("measure needs Linux /proc/<pid>/smaps_rollup")
+    weights_mb = os.path.getsize(path) / 2 ** 20
+    print(f"Weight file: {weights_mb:.1f} MB, {workers} workers per mode")
+    print(f"{'mode':>8} {'RSS/worker':>11} {'PSS/worker':>11} {'shared':>9} {'total PSS':>10}")
+    totals = {}
+    for private in (True, False):
+        samples = sample_workers(path, workers, private)
+        rss = np.mean([s['Rss'] for s in samples]) / 1024
+        pss = np.mean([s['Pss'] for s in samples]) / 1024
+        shared = np.mean([s.get('Shared_Clean', 0) + s.get('Shared_Dirty', 0) for s in samples]) / 1024
+        mode = 'private' if private else 'mmap'
+        totals[mode] = pss * workers
+        print(f"{mode:>8} {rss:>9.1f}MB {pss:>9.1f}MB {shared:>7.1f}MB {pss * workers:>8.1f}MB")
+    print(f"Memory saved by sharing: {totals['private'] - totals['mmap']:.1f} MB "
+          f"(weights counted once instead of {workers} times)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Memory-mapped model weights")
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help="Write the flat weight file from the .h5 model")
+    exp.add_argument('--model', default=config.MODEL_PATH)
+    exp.add_argument('--output', default=config.MMAP_WEIGHTS_PATH)
+    mea = sub.add_parser('measure', help="Per-worker memory with mmap vs private weights")
+    mea.add_argument('--weights', default=config.MMAP_WEIGHTS_PATH)
+    mea.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    if args.command == 'export':
+        export(args.model, args.output)
+    else:
+        measure(args.weights, args.workers)